@@ -6,6 +6,15 @@ No API key required, no budget needed.
 
 Includes an in-memory TTL cache so we respect Jikan's rate limits
 (~3 requests/second, 60/minute) and keep our pages fast + SEO friendly.
+Concurrent misses on the same key are coalesced into a single upstream
+request (single-flight), so a popular page expiring doesn't queue N identical
+Jikan calls behind the rate limiter.
+
+Entries are stale-while-revalidate: past their soft TTL they are still served
+instantly while one background refresh runs, until the hard TTL
+(``CATALOG_STALE_FACTOR`` x soft) drops them. Soft TTLs adapt to the content -
+airing shows and schedules refresh hourly, finished series weekly - and 404s
+are cached briefly so repeated misses don't hammer Jikan.
 
 Docs: https://docs.api.jikan.moe/
 """
@@ -34,15 +43,26 @@ JIKAN_BASE = "https://api.jikan.moe/v4"
 # shared, survives restarts). Redis is optional — set REDIS_URL (e.g. an Upstash
 # rediss:// URL) to enable it. Without it, only the in-memory tier is used.
 # ---------------------------------------------------------------------------
+# key -> {"data", "fresh_until", "expires"}; data is None for a cached 404
 _CACHE: Dict[str, Dict[str, Any]] = {}
 _CACHE_LOCK = asyncio.Lock()
 
 # How long an item pulled from Redis is mirrored in the (faster) memory tier.
 _MEMORY_BACKFILL_TTL = 600  # seconds
 
+# Stale entries stay servable until soft TTL x this factor
+CATALOG_STALE_FACTOR = float(os.environ.get("CATALOG_STALE_FACTOR", "4"))
+# Soft TTL for payloads about currently airing shows (schedules, seasonal, ...)
+CATALOG_AIRING_TTL = int(os.environ.get("CATALOG_AIRING_TTL", "3600"))
+# Soft TTL for a single finished series, which rarely changes
+CATALOG_FINISHED_TTL = int(os.environ.get("CATALOG_FINISHED_TTL", str(7 * 24 * 3600)))
+# How long a 404 is remembered
+CATALOG_NEGATIVE_TTL = int(os.environ.get("CATALOG_NEGATIVE_TTL", "300"))
+
 # ---- Redis (L2) configuration ----
 REDIS_URL = os.environ.get("REDIS_URL", "").strip()
-REDIS_KEY_PREFIX = "otaku:catalog:"
+# v2: values are {"data", "fresh_until", "expires"} envelopes, not raw payloads
+REDIS_KEY_PREFIX = "otaku:catalog:v2:"
 _redis_client: Optional["aioredis.Redis"] = None
 _redis_enabled = bool(REDIS_URL) and aioredis is not None
 _redis_unavailable = False  # flips True after a failure so we stop retrying
@@ -79,6 +99,11 @@ _request_lock = asyncio.Lock()
 _last_request_ts = 0.0
 _MIN_INTERVAL = 0.40  # ~2.5 req/sec, safely under Jikan's limit
 
+# cache key -> upstream fetch in progress; concurrent misses await it
+_IN_FLIGHT: Dict[str, "asyncio.Task[Optional[Dict[str, Any]]]"] = {}
+# cache key -> background revalidation of a stale entry (one per key)
+_REFRESHES: Dict[str, "asyncio.Task[None]"] = {}
+
 
 async def _get_client() -> httpx.AsyncClient:
     global _client
@@ -103,21 +128,18 @@ async def close_client():
         _redis_client = None
 
 
-def _cache_set_memory(key: str, data: Any, ttl: int):
-    _CACHE[key] = {"data": data, "expires": time.time() + ttl}
-
-
-def _cache_get_memory(key: str) -> Optional[Any]:
+def _cache_get_memory(key: str) -> Optional[Dict[str, Any]]:
+    """The entry for ``key`` if it is within its hard TTL (fresh or stale)."""
     entry = _CACHE.get(key)
     if not entry:
         return None
     if entry["expires"] < time.time():
         _CACHE.pop(key, None)
         return None
-    return entry["data"]
+    return entry
 
 
-async def _cache_get(key: str) -> Optional[Any]:
+async def _cache_get(key: str) -> Optional[Dict[str, Any]]:
     """Look up a key in L1 (memory) then L2 (Redis). A Redis hit backfills L1."""
     # L1: in-memory
     mem = _cache_get_memory(key)
@@ -130,35 +152,105 @@ async def _cache_get(key: str) -> Optional[Any]:
         try:
             raw = await r.get(REDIS_KEY_PREFIX + key)
             if raw is not None:
-                data = json.loads(raw)
-                _cache_set_memory(key, data, _MEMORY_BACKFILL_TTL)
-                return data
+                entry = json.loads(raw)
+                _CACHE[key] = {
+                    **entry,
+                    "expires": min(entry["expires"], time.time() + _MEMORY_BACKFILL_TTL),
+                }
+                return entry
         except Exception as e:
             logger.warning(f"Redis get failed for {key}: {e}")
     return None
 
 
 async def _cache_set(key: str, data: Any, ttl: int):
-    """Write through to both tiers."""
-    _cache_set_memory(key, data, ttl)
+    """Write through to both tiers; ``ttl`` is the soft TTL."""
+    now = time.time()
+    hard_ttl = max(int(ttl * CATALOG_STALE_FACTOR), ttl)
+    entry = {"data": data, "fresh_until": now + ttl, "expires": now + hard_ttl}
+    _CACHE[key] = entry
     r = await _get_redis()
     if r is not None:
         try:
-            await r.set(REDIS_KEY_PREFIX + key, json.dumps(data), ex=ttl)
+            await r.set(REDIS_KEY_PREFIX + key, json.dumps(entry), ex=hard_ttl)
         except Exception as e:
             logger.warning(f"Redis set failed for {key}: {e}")
 
 
+def _is_airing(item: Any) -> bool:
+    return isinstance(item, dict) and (
+        item.get("airing") is True or item.get("status") in ("Currently Airing", "Not yet aired")
+    )
+
+
+def _adaptive_ttl(data: Any, ttl: int) -> int:
+    """Soft TTL for a payload: the caller's ``ttl``, shortened when it is about
+    airing shows and lengthened for a single finished series."""
+    body = data.get("data") if isinstance(data, dict) else None
+    if isinstance(body, dict):
+        if _is_airing(body):
+            return min(ttl, CATALOG_AIRING_TTL)
+        if body.get("status") == "Finished Airing":
+            return max(ttl, CATALOG_FINISHED_TTL)
+    elif isinstance(body, list) and any(_is_airing(item) for item in body):
+        return min(ttl, CATALOG_AIRING_TTL)
+    return ttl
+
+
 async def _fetch(path: str, params: Optional[Dict[str, Any]] = None,
                  ttl: int = 3600) -> Optional[Dict[str, Any]]:
-    """Fetch a Jikan endpoint with caching + light rate limiting."""
-    global _last_request_ts
+    """Fetch a Jikan endpoint with caching + light rate limiting.
+
+    Only one upstream fetch per cache key runs at a time; callers that miss
+    while it is in flight await the same result instead of queueing their own.
+    A stale (soft-expired) entry is returned as-is and refreshed in the
+    background.
+    """
     cache_key = f"{path}?{params}"
 
-    cached = await _cache_get(cache_key)
-    if cached is not None:
-        return cached
+    entry = await _cache_get(cache_key)
+    if entry is not None:
+        if entry["fresh_until"] < time.time() and cache_key not in _REFRESHES:
+            _REFRESHES[cache_key] = asyncio.create_task(_revalidate(path, params, cache_key, ttl))
+        return entry["data"]
+
+    return await _fetch_coalesced(path, params, cache_key, ttl)
+
+
+async def _revalidate(path: str, params: Optional[Dict[str, Any]],
+                      cache_key: str, ttl: int):
+    try:
+        await _fetch_coalesced(path, params, cache_key, ttl)
+    except Exception as e:
+        logger.warning(f"Background refresh failed on {path}: {e}")
+    finally:
+        _REFRESHES.pop(cache_key, None)
+
+
+async def _fetch_coalesced(path: str, params: Optional[Dict[str, Any]],
+                           cache_key: str, ttl: int) -> Optional[Dict[str, Any]]:
+    task = _IN_FLIGHT.get(cache_key)
+    if task is None:
+        # The fetch runs in its own task, not any caller's, so no caller going
+        # away (the first included) cancels it for the rest
+        task = _IN_FLIGHT[cache_key] = asyncio.create_task(
+            _fetch_upstream(path, params, cache_key, ttl)
+        )
+        task.add_done_callback(lambda done: _fetch_finished(cache_key, done))
+    return await asyncio.shield(task)
+
+
+def _fetch_finished(cache_key: str, task: "asyncio.Task[Optional[Dict[str, Any]]]") -> None:
+    if _IN_FLIGHT.get(cache_key) is task:
+        del _IN_FLIGHT[cache_key]
+    if not task.cancelled():
+        # Every waiter may be gone; don't leave "exception never retrieved"
+        task.exception()
 
+
+async def _fetch_upstream(path: str, params: Optional[Dict[str, Any]],
+                          cache_key: str, ttl: int) -> Optional[Dict[str, Any]]:
+    global _last_request_ts
     client = await _get_client()
 
     # Gentle rate limiting so we never trip Jikan's 429s
@@ -179,21 +271,24 @@ async def _fetch(path: str, params: Optional[Dict[str, Any]] = None,
                     await asyncio.sleep(wait)
                     continue
 
+                if resp.status_code == 404:
+                    # Remember the miss briefly instead of asking again
+                    await _cache_set(cache_key, None, CATALOG_NEGATIVE_TTL)
+                    return None
+
                 resp.raise_for_status()
                 data = resp.json()
-                await _cache_set(cache_key, data, ttl)
+                await _cache_set(cache_key, data, _adaptive_ttl(data, ttl))
                 return data
             except httpx.HTTPStatusError as e:
                 logger.warning(f"Jikan HTTP error on {path}: {e}")
-                if e.response.status_code == 404:
-                    return None
                 await asyncio.sleep(0.6 * (attempt + 1))
             except Exception as e:
                 logger.warning(f"Jikan request failed on {path}: {e}")
                 await asyncio.sleep(0.6 * (attempt + 1))
 
-    # If a stale cached value exists, prefer it over nothing
-    stale = _CACHE.get(cache_key)
+    # If a stale cached value exists (within its hard TTL), prefer it over nothing
+    stale = _cache_get_memory(cache_key)
     return stale["data"] if stale else None
 
 
@@ -356,6 +451,20 @@ async def get_episodes(mal_id: int, page: int = 1) -> Dict[str, Any]:
     }
 
 
+async def get_characters(mal_id: int) -> List[Dict[str, Any]]:
+    """Characters of an anime as ``{"name", "role"}``; MAL names read
+    "Last, First"."""
+    payload = await _fetch(f"/anime/{mal_id}/characters", ttl=24 * 3600)
+    if not payload:
+        return []
+    characters = []
+    for entry in payload.get("data", []):
+        name = (entry.get("character") or {}).get("name")
+        if name:
+            characters.append({"name": name, "role": entry.get("role")})
+    return characters
+
+
 async def get_recommendations(mal_id: int, limit: int = 12) -> List[Dict[str, Any]]:
     payload = await _fetch(f"/anime/{mal_id}/recommendations", ttl=24 * 3600)
     if not payload:
@@ -0,0 +1,132 @@
+"""
+Arc State Machine
+=================
+In-memory arc progression for active users.
+
+The progression rules are a fixed table (``TRANSITIONS``): each phase has at
+most one successor, reached once every stat threshold for that step is met.
+A user's arc (phase, arc title, stats, last activity) is loaded once from
+``user_arcs`` and then kept here, so each stats flush (see ``persist_stats`` in
+server.py) applies the user's deltas in memory and looks up the single rule
+for the current phase - no re-read of ``user_arcs`` per update.
+
+The stat deltas themselves are persisted by the stats aggregator's bulk
+write; only a phase change adds a write of its own (with its
+``arc_history`` entry, and the usual ``arc_progression`` emit).
+"""
+
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+MAX_ACTIVE_ARCS = int(os.environ.get("MAX_ACTIVE_ARCS", "20000"))
+REDEMPTION_DAYS = 7
+
+# phase -> (next phase, next arc title, milestone, stat thresholds)
+TRANSITIONS = {
+    "prologue": ("connection", "⚡ Connection Arc: First Match Found", "first_match",
+                 {"matches_completed": 1}),
+    "connection": ("rising_bond", "🔥 Rising Bond Arc: 100 Messages Shared", "chatty_character",
+                   {"messages_sent": 100}),
+    "rising_bond": ("adventure", "🌟 Adventure Arc: Episode Rooms Explorer", "room_explorer",
+                    {"episode_rooms_joined": 5}),
+    "adventure": ("power", "👑 Power Arc: Social Butterfly", "social_butterfly",
+                  {"friends_count": 3, "messages_sent": 250}),
+    "power": ("eclipse", "🌙 Eclipse Arc: Master Connector", "master_connector",
+              {"friends_count": 10, "episode_rooms_joined": 20}),
+}
+
+# user_id -> {"current_arc", "current_phase", "stats", "last_updated"}
+_STATES: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value if isinstance(value, datetime) else None
+
+
+def get(user_id: str) -> Optional[Dict[str, Any]]:
+    state = _STATES.get(user_id)
+    if state is not None:
+        _STATES.move_to_end(user_id)
+    return state
+
+
+def load(user_id: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Cache a ``user_arcs`` document; an entry loaded concurrently wins."""
+    state = _STATES.get(user_id)
+    if state is not None:
+        return state
+    state = _STATES[user_id] = {
+        "current_arc": doc.get("current_arc"),
+        "current_phase": doc.get("current_phase", "prologue"),
+        "stats": dict(doc.get("stats") or {}),
+        "last_updated": _as_datetime(doc.get("last_updated")),
+    }
+    while len(_STATES) > MAX_ACTIVE_ARCS:
+        _STATES.popitem(last=False)
+    return state
+
+
+def _transition(state: Dict[str, Any], next_arc: str, next_phase: str,
+                milestone: str, now: datetime, **extra) -> Dict[str, Any]:
+    entry = {
+        "arc": state["current_arc"],
+        "phase": state["current_phase"],
+        "achieved_at": now.isoformat(),
+        "stats_at_time": dict(state["stats"]),
+        "milestone": milestone,
+        **extra,
+    }
+    state["current_arc"] = next_arc
+    state["current_phase"] = next_phase
+    return entry
+
+
+def apply(state: Dict[str, Any], deltas: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    """Apply stat deltas; returns the ``arc_history`` entry if the phase
+    changed (``state`` then holds the new arc and phase), else None."""
+    now = datetime.now(timezone.utc)
+    entry = None
+
+    # Redemption Arc: coming back after a week away, past the prologue
+    last_updated = state["last_updated"]
+    phase = state["current_phase"]
+    if last_updated is not None and phase not in ("prologue", "redemption"):
+        days_away = (now - last_updated).days
+        if days_away >= REDEMPTION_DAYS:
+            entry = _transition(state, f"🌅 Redemption Arc: Returned After {days_away} Days",
+                                "redemption", "redemption_return", now, days_away=days_away)
+
+    for stat, delta in deltas.items():
+        state["stats"][stat] = state["stats"].get(stat, 0) + delta
+    state["last_updated"] = now
+
+    if entry is None:
+        rule = TRANSITIONS.get(state["current_phase"])
+        if rule is not None:
+            next_phase, next_arc, milestone, thresholds = rule
+            if all(state["stats"].get(key, 0) >= target for key, target in thresholds.items()):
+                entry = _transition(state, next_arc, next_phase, milestone, now)
+    return entry
+
+
+def overlay(user_id: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Bring a ``user_arcs`` document read from MongoDB up to date with the
+    cached state (latest phase and stats)."""
+    state = _STATES.get(user_id)
+    if state is not None:
+        doc["current_arc"] = state["current_arc"]
+        doc["current_phase"] = state["current_phase"]
+        doc["stats"] = dict(state["stats"])
+        if state["last_updated"] is not None:
+            doc["last_updated"] = state["last_updated"]
+    return doc
+
+
+def forget_user(user_id: str) -> None:
+    _STATES.pop(user_id, None)
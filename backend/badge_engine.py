@@ -0,0 +1,105 @@
+"""
+Badge Rule Engine
+=================
+Badge unlock rules compiled once at startup instead of re-reading
+``passport_badges`` on every stat change.
+
+``compile_rules`` indexes each badge under every stat its ``unlock_condition``
+mentions, so a ``messages_sent`` increment only evaluates the badges that
+depend on ``messages_sent``. Conditions keep their stored meaning: a numeric
+target is a minimum, anything else must match exactly.
+
+Each user's earned badge ids are cached here too (bounded LRU, loaded lazily
+by ``get_earned_badge_ids`` in server.py), so checking a user's updated stats
+costs no reads beyond the stats document itself - which ``persist_stats``
+fetches for the whole flushed batch in one query.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+MAX_CACHED_USERS = int(os.environ.get("BADGE_CACHE_MAX_USERS", "20000"))
+
+# badge_id -> badge document
+_BADGES: Dict[str, Dict[str, Any]] = {}
+# stat name -> badges whose unlock condition mentions it
+_RULES_BY_STAT: Dict[str, List[Dict[str, Any]]] = {}
+_loaded = False
+
+# user_id -> ids of badges already earned
+_EARNED: "OrderedDict[str, Set[str]]" = OrderedDict()
+
+
+def compile_rules(badges: Iterable[Dict[str, Any]]) -> None:
+    global _loaded
+    _BADGES.clear()
+    _RULES_BY_STAT.clear()
+    for badge in badges:
+        _BADGES[badge["id"]] = badge
+        for stat in badge.get("unlock_condition") or {}:
+            _RULES_BY_STAT.setdefault(stat, []).append(badge)
+    _loaded = True
+
+
+def loaded() -> bool:
+    return _loaded
+
+
+def all_badges() -> List[Dict[str, Any]]:
+    return list(_BADGES.values())
+
+
+def rules_for(changed_stats: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """Badges that depend on any of ``changed_stats`` (every badge if None)."""
+    if changed_stats is None:
+        return all_badges()
+    seen: Set[str] = set()
+    rules = []
+    for stat in changed_stats:
+        for badge in _RULES_BY_STAT.get(stat, ()):
+            if badge["id"] not in seen:
+                seen.add(badge["id"])
+                rules.append(badge)
+    return rules
+
+
+def unlocked(badge: Dict[str, Any], stats: Dict[str, Any]) -> bool:
+    for key, target in badge["unlock_condition"].items():
+        current = stats.get(key, 0)
+        if isinstance(target, (int, float)):
+            if current < target:
+                return False
+        elif current != target:
+            return False
+    return True
+
+
+def get_earned(user_id: str) -> Optional[Set[str]]:
+    earned = _EARNED.get(user_id)
+    if earned is not None:
+        _EARNED.move_to_end(user_id)
+    return earned
+
+
+def store_earned(user_id: str, badge_ids: Iterable[str]) -> Set[str]:
+    """Cache a freshly loaded set; if a concurrent load (and possibly an award)
+    got there first, keep that set so the award isn't forgotten."""
+    earned = _EARNED.get(user_id)
+    if earned is None:
+        earned = _EARNED[user_id] = set(badge_ids)
+        while len(_EARNED) > MAX_CACHED_USERS:
+            _EARNED.popitem(last=False)
+    return earned
+
+
+def mark_earned(user_id: str, badge_ids: Iterable[str]) -> None:
+    """Record awards before they are written, so a concurrent check for the
+    same user can't award them twice."""
+    earned = _EARNED.get(user_id)
+    if earned is not None:
+        earned.update(badge_ids)
+
+
+def forget_user(user_id: str) -> None:
+    _EARNED.pop(user_id, None)
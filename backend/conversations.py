@@ -0,0 +1,96 @@
+"""
+Direct Message Conversations
+============================
+Every ``direct_messages`` document carries a ``conversation_id`` - the two
+participants' ids, sorted and joined - so a chat is addressed by one indexed
+equality instead of a two-branch ``$or`` over from/to ids. Together with the
+``(conversation_id, timestamp, id)`` index created at startup, opening or paging a
+chat of any length is a single index range scan.
+
+History is paged with keyset cursors (see ``build_history_query``): ``before``
+walks back into older messages, ``after`` fetches anything newer than what the
+client already has. ``merge_pending`` folds messages still in the DM outbox
+into a page read from MongoDB, applying the same cursors in Python.
+"""
+
+from typing import Any, Dict, List, Optional
+
+
+def conversation_id(user_a: str, user_b: str) -> str:
+    """Order-independent id for the conversation between two users."""
+    return f"{min(user_a, user_b)}_{max(user_a, user_b)}"
+
+
+# Update pipeline that (re)computes conversation_id from from/to user ids.
+# Used to backfill old messages and after user ids are re-pointed. Mongo's
+# default string ordering is binary, matching Python's min/max above.
+CONVERSATION_ID_PIPELINE: List[Dict[str, Any]] = [
+    {"$set": {"conversation_id": {"$cond": [
+        {"$lt": ["$from_user_id", "$to_user_id"]},
+        {"$concat": ["$from_user_id", "_", "$to_user_id"]},
+        {"$concat": ["$to_user_id", "_", "$from_user_id"]},
+    ]}}}
+]
+
+
+def _cursor(op: str, timestamp: str, message_id: Optional[str]) -> Dict[str, Any]:
+    # timestamp alone is not unique, so the message id breaks ties
+    if not message_id:
+        return {"timestamp": {op: timestamp}}
+    return {"$or": [
+        {"timestamp": {op: timestamp}},
+        {"timestamp": timestamp, "id": {op: message_id}},
+    ]}
+
+
+def build_history_query(
+    conv_id: str,
+    before: Optional[str] = None,
+    before_id: Optional[str] = None,
+    after: Optional[str] = None,
+    after_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Keyset query for a conversation's messages, optionally bounded by
+    ``before``/``after`` cursors (ISO timestamps, plus the message id)."""
+    clauses: List[Dict[str, Any]] = [{"conversation_id": conv_id}]
+    if before:
+        clauses.append(_cursor("$lt", before, before_id))
+    if after:
+        clauses.append(_cursor("$gt", after, after_id))
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _key(message: Dict[str, Any]) -> tuple:
+    return (message["timestamp"], message["id"])
+
+
+def _in_range(message: Dict[str, Any], before: Optional[str], before_id: Optional[str],
+              after: Optional[str], after_id: Optional[str]) -> bool:
+    timestamp = message["timestamp"]
+    if before and not (timestamp < before or (before_id and timestamp == before and message["id"] < before_id)):
+        return False
+    if after and not (timestamp > after or (after_id and timestamp == after and message["id"] > after_id)):
+        return False
+    return True
+
+
+def merge_pending(
+    messages: List[Dict[str, Any]],
+    pending: List[Dict[str, Any]],
+    limit: int,
+    before: Optional[str] = None,
+    before_id: Optional[str] = None,
+    after: Optional[str] = None,
+    after_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """A history page (oldest first) from MongoDB plus not-yet-written
+    messages, cut back to ``limit`` the same way the query was."""
+    pending = [m for m in pending if _in_range(m, before, before_id, after, after_id)]
+    if not pending:
+        return messages
+    merged = {m["id"]: m for m in pending}
+    merged.update((m["id"], m) for m in messages)
+    page = sorted(merged.values(), key=_key)
+    if after and not before:
+        return page[:limit]
+    return page[-limit:]
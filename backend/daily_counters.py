@@ -0,0 +1,74 @@
+"""
+Daily Counters
+==============
+Per-user, per-day action counts (matches started, episode rooms created, ...)
+used for premium limits.
+
+Each user has one ``user_daily_counters`` document per UTC day, bumped with
+``$inc`` (see ``track_daily_stat`` in server.py), instead of one
+``user_daily_stats`` row per action - storage grows with users x days, not
+with activity. Today's counts for active users are mirrored here, so a limit
+check like ``max_daily_matches`` in ``join_matching`` is a dict lookup rather
+than a ``count_documents`` that gets slower as the day goes on.
+
+Only the current day is cached; everything is dropped when the date rolls
+over. Like ``friend_graph``, each increment bumps a per-user version so a
+lazy load that raced with an increment isn't cached.
+"""
+
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+MAX_CACHED_USERS = int(os.environ.get("DAILY_COUNTERS_MAX_USERS", "20000"))
+
+_day: Optional[str] = None
+# user_id -> action -> count, for _day only
+_COUNTS: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+_VERSIONS: Dict[str, int] = {}
+
+
+def today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _roll(day: str) -> None:
+    global _day
+    if day != _day:
+        _day = day
+        _COUNTS.clear()
+        _VERSIONS.clear()
+
+
+def get(user_id: str, day: str) -> Optional[Dict[str, int]]:
+    _roll(day)
+    counts = _COUNTS.get(user_id)
+    if counts is not None:
+        _COUNTS.move_to_end(user_id)
+    return counts
+
+
+def version(user_id: str) -> int:
+    """Take before querying MongoDB; pass to ``store`` with the result."""
+    return _VERSIONS.get(user_id, 0)
+
+
+def store(user_id: str, day: str, counts: Dict[str, int], loaded_version: int) -> Dict[str, int]:
+    _roll(day)
+    counts = dict(counts)
+    if _VERSIONS.get(user_id, 0) != loaded_version:
+        return counts
+    _COUNTS[user_id] = counts
+    _COUNTS.move_to_end(user_id)
+    while len(_COUNTS) > MAX_CACHED_USERS:
+        _COUNTS.popitem(last=False)
+    return counts
+
+
+def increment(user_id: str, day: str, action: str, amount: int = 1) -> None:
+    _roll(day)
+    _VERSIONS[user_id] = _VERSIONS.get(user_id, 0) + 1
+    counts = _COUNTS.get(user_id)
+    if counts is not None:
+        counts[action] = counts.get(action, 0) + amount
@@ -0,0 +1,260 @@
+"""
+Direct Message Outbox
+=====================
+Write-behind queue for direct messages.
+
+``send_direct_message`` gives each message its id and timestamp, emits it to
+the conversation straight away (``status: "pending"``) and drops the document
+here. A background task in server.py drains the queue with ``insert_many`` in
+batches of up to ``MAX_BATCH`` and then acknowledges each message with a small
+``direct_message_persisted`` event, so delivery latency no longer includes a
+MongoDB round trip.
+
+A failed batch is put back at the front of the queue and retried with
+exponential backoff; nothing is dropped. Retries are idempotent because
+``direct_messages.id`` has a unique index - documents that made it in on an
+earlier attempt come back as duplicate-key errors and count as persisted.
+
+Every queued message is also appended to a spool file (``DM_SPOOL_PATH``).
+The spool is an append-only log: ``{"m": message}`` records a message (again
+after it is changed), ``{"ack": [ids]}`` retires messages that were written or
+discarded. On startup ``load_spool`` replays it and puts anything left over
+from a crash or restart back in the queue. All spool I/O runs, in order, on
+one writer thread, so the event loop never waits on the disk. The log is
+compacted on that thread once it holds ``_COMPACT_FACTOR`` times more records
+than live messages - or simply truncated whenever the queue drains. Point ``DM_SPOOL_PATH`` at a persistent disk - on an ephemeral one the
+spool only covers process restarts. The queue is capped at
+``MAX_PENDING`` messages: while MongoDB is down and the queue is full,
+``is_full`` is True and senders are told to retry instead of memory growing
+without bound.
+
+Reads don't wait for the queue to drain: ``pending_for`` hands back a
+conversation's unwritten messages (including the batch being written) to be
+merged into what MongoDB returns. Changes to queued messages
+(``mark_read``, ``discard``, ``rename_user``) must be made while holding the
+flush lock in server.py, so no batch is mid-write.
+"""
+
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, List, Optional, TextIO
+
+import conversations
+
+FLUSH_INTERVAL = float(os.environ.get("DM_FLUSH_INTERVAL", "0.1"))
+MAX_BATCH = int(os.environ.get("DM_FLUSH_BATCH", "500"))
+MAX_PENDING = int(os.environ.get("DM_OUTBOX_MAX", "10000"))
+SPOOL_PATH = Path(os.environ.get("DM_SPOOL_PATH", Path(__file__).parent / ".dm_spool.jsonl"))
+_MAX_BACKOFF = 30.0
+
+DUPLICATE_KEY = 11000
+
+logger = logging.getLogger(__name__)
+
+_QUEUE: Deque[Dict[str, Any]] = deque()
+# The batch currently being written; still readable through pending_for
+_IN_FLIGHT: List[Dict[str, Any]] = []
+
+# Spool records written since the last compaction
+_spool_records = 0
+_COMPACT_FACTOR = 4
+_COMPACT_MIN_RECORDS = 1000
+# Owned by the writer thread
+_spool: Optional[TextIO] = None
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dm-spool")
+
+
+def _write_lines(lines: List[str]) -> None:
+    global _spool
+    try:
+        if _spool is None:
+            SPOOL_PATH.parent.mkdir(parents=True, exist_ok=True)
+            _spool = open(SPOOL_PATH, "a", encoding="utf-8")
+        _spool.writelines(lines)
+        _spool.flush()
+    except OSError as e:
+        logger.error(f"Error appending to DM spool: {e}")
+
+
+def _compact(messages: List[Dict[str, Any]]) -> None:
+    """Replace the log with one record per live message."""
+    global _spool
+    try:
+        if _spool is not None:
+            _spool.close()
+            _spool = None
+        if not messages:
+            open(SPOOL_PATH, "w").close()
+            return
+        tmp = SPOOL_PATH.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as out:
+            out.writelines(json.dumps({"m": message}, default=str) + "\n" for message in messages)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, SPOOL_PATH)
+    except OSError as e:
+        logger.error(f"Error compacting DM spool: {e}")
+
+
+def _log(records: List[Dict[str, Any]]) -> None:
+    """Append records to the spool on the writer thread."""
+    global _spool_records
+    _spool_records += len(records)
+    _writer.submit(_write_lines, [json.dumps(record, default=str) + "\n" for record in records])
+
+
+def _log_messages(messages: Iterable[Dict[str, Any]]) -> None:
+    records = [{"m": message} for message in messages]
+    if records:
+        _log(records)
+
+
+def _log_acks(ids: List[str]) -> None:
+    if ids:
+        _log([{"ack": ids}])
+    _maybe_compact()
+
+
+def _maybe_compact() -> None:
+    global _spool_records
+    live = len(_QUEUE) + len(_IN_FLIGHT)
+    if not _spool_records or live and (_spool_records < _COMPACT_MIN_RECORDS or _spool_records < live * _COMPACT_FACTOR):
+        return
+    # Shallow copies: the writer serializes them while the loop may edit the originals
+    snapshot = [dict(message) for message in (*_IN_FLIGHT, *_QUEUE)]
+    _spool_records = len(snapshot)
+    _writer.submit(_compact, snapshot)
+
+
+def load_spool() -> int:
+    """Queue the messages a previous process spooled but never wrote."""
+    global _spool_records
+    if not SPOOL_PATH.exists():
+        return 0
+    live: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    with open(SPOOL_PATH, encoding="utf-8") as spool:
+        for line in spool:
+            _spool_records += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash mid-write
+                logger.warning("Skipping unreadable line in DM spool")
+                continue
+            if "m" in record:
+                message = record["m"]
+                if message["id"] in live:
+                    live[message["id"]].update(message)
+                else:
+                    live[message["id"]] = message
+            for message_id in record.get("ack", ()):
+                live.pop(message_id, None)
+    _QUEUE.extend(live.values())
+    _maybe_compact()
+    return len(live)
+
+
+def close_spool() -> None:
+    """Finish pending spool writes (on shutdown)."""
+    _writer.shutdown(wait=True)
+
+
+def is_full() -> bool:
+    return len(_QUEUE) + len(_IN_FLIGHT) >= MAX_PENDING
+
+
+def enqueue(message: Dict[str, Any]) -> None:
+    _log_messages([message])
+    _QUEUE.append(message)
+
+
+def has_pending() -> bool:
+    return bool(_QUEUE)
+
+
+def take_batch() -> List[Dict[str, Any]]:
+    batch = []
+    while _QUEUE and len(batch) < MAX_BATCH:
+        batch.append(_QUEUE.popleft())
+    _IN_FLIGHT[:] = batch
+    return batch
+
+
+def requeue(batch: List[Dict[str, Any]]) -> None:
+    """Put a failed batch back ahead of anything queued since, in order."""
+    _QUEUE.extendleft(reversed(batch))
+    _IN_FLIGHT.clear()
+
+
+def done(batch: List[Dict[str, Any]]) -> None:
+    """The batch is in MongoDB; retire it in the spool."""
+    _IN_FLIGHT.clear()
+    _log_acks([message["id"] for message in batch])
+
+
+def pending_for(conversation_id: str) -> List[Dict[str, Any]]:
+    """Copies of a conversation's unwritten messages, oldest first."""
+    return [
+        {**message, "status": "pending"}
+        for message in (*_IN_FLIGHT, *_QUEUE)
+        if message["conversation_id"] == conversation_id
+    ]
+
+
+def unread_to(user_id: str) -> List[Dict[str, Any]]:
+    """Unwritten, unread messages addressed to ``user_id``."""
+    return [
+        message for message in (*_IN_FLIGHT, *_QUEUE)
+        if message["to_user_id"] == user_id and not message.get("read")
+    ]
+
+
+def mark_read(from_user_id: str, to_user_id: str) -> None:
+    changed = []
+    for message in _QUEUE:
+        if message["from_user_id"] == from_user_id and message["to_user_id"] == to_user_id \
+                and not message.get("read"):
+            message["read"] = True
+            changed.append(message)
+    _log_messages(changed)
+
+
+def discard(conversation_id: str) -> None:
+    """Drop a conversation's queued messages (its history is being deleted)."""
+    kept = [message for message in _QUEUE if message["conversation_id"] != conversation_id]
+    if len(kept) != len(_QUEUE):
+        dropped = [message["id"] for message in _QUEUE if message["conversation_id"] == conversation_id]
+        _QUEUE.clear()
+        _QUEUE.extend(kept)
+        _log_acks(dropped)
+
+
+def rename_user(old_id: str, new_id: str) -> None:
+    """Re-point queued messages from ``old_id`` to ``new_id``."""
+    changed = []
+    for message in _QUEUE:
+        if old_id in (message["from_user_id"], message["to_user_id"]):
+            if message["from_user_id"] == old_id:
+                message["from_user_id"] = new_id
+            if message["to_user_id"] == old_id:
+                message["to_user_id"] = new_id
+            message["conversation_id"] = conversations.conversation_id(
+                message["from_user_id"], message["to_user_id"]
+            )
+            changed.append(message)
+    _log_messages(changed)
+
+
+def retry_delay(failures: int) -> float:
+    return min(_MAX_BACKOFF, FLUSH_INTERVAL * (2 ** failures))
+
+
+def only_duplicates(details: Dict[str, Any]) -> bool:
+    """True if a BulkWriteError only reports already-inserted documents."""
+    if details.get("writeConcernErrors"):
+        return False
+    return all(err.get("code") == DUPLICATE_KEY for err in details.get("writeErrors", []))
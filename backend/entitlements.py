@@ -0,0 +1,75 @@
+"""
+Entitlement Cache
+=================
+Per-user premium status and feature set, so feature gating on match joins and
+room creation is a dict lookup instead of a ``users`` read plus a
+``premium_subscriptions`` query every time.
+
+Each entry is due for refresh at its subscription's ``expires_at`` (or after
+``ENTITLEMENT_TTL`` seconds, whichever is sooner - the TTL bounds how long a
+change made by another worker can go unnoticed). Due times sit in a min-heap;
+lookups pop whatever has come due and drop those entries, so the next
+``get_user_premium_status`` in server.py reloads the user and downgrades an
+expired subscription right on time. ``/premium/upgrade`` and
+``/premium/cancel`` invalidate the user's entry directly; as in
+``friend_graph``, a version check keeps a load that raced with the
+invalidation from being cached.
+"""
+
+import heapq
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+ENTITLEMENT_TTL = float(os.environ.get("ENTITLEMENT_TTL", "300"))
+MAX_CACHED_USERS = int(os.environ.get("ENTITLEMENT_CACHE_MAX_USERS", "20000"))
+
+# user_id -> (premium status dict, refresh_at epoch seconds)
+_ENTRIES: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+# (refresh_at, user_id); stale pairs are skipped when popped
+_TIMERS: List[Tuple[float, str]] = []
+_VERSIONS: Dict[str, int] = {}
+
+
+def _expire_due(now: float) -> None:
+    while _TIMERS and _TIMERS[0][0] <= now:
+        refresh_at, user_id = heapq.heappop(_TIMERS)
+        entry = _ENTRIES.get(user_id)
+        if entry is not None and entry[1] == refresh_at:
+            del _ENTRIES[user_id]
+
+
+def get(user_id: str) -> Optional[Dict[str, Any]]:
+    _expire_due(time.time())
+    entry = _ENTRIES.get(user_id)
+    if entry is None:
+        return None
+    _ENTRIES.move_to_end(user_id)
+    return entry[0]
+
+
+def version(user_id: str) -> int:
+    """Take before querying MongoDB; pass to ``store`` with the result."""
+    return _VERSIONS.get(user_id, 0)
+
+
+def store(user_id: str, status: Dict[str, Any], loaded_version: int,
+          expires_at: Optional[float] = None) -> None:
+    if _VERSIONS.get(user_id, 0) != loaded_version:
+        return
+    now = time.time()
+    refresh_at = now + ENTITLEMENT_TTL
+    if expires_at is not None:
+        refresh_at = min(refresh_at, expires_at)
+    _ENTRIES[user_id] = (status, refresh_at)
+    _ENTRIES.move_to_end(user_id)
+    heapq.heappush(_TIMERS, (refresh_at, user_id))
+    while len(_ENTRIES) > MAX_CACHED_USERS:
+        _ENTRIES.popitem(last=False)
+    _expire_due(now)
+
+
+def invalidate(user_id: str) -> None:
+    _VERSIONS[user_id] = _VERSIONS.get(user_id, 0) + 1
+    _ENTRIES.pop(user_id, None)
@@ -0,0 +1,95 @@
+"""
+Friendship Graph Cache
+======================
+In-memory adjacency sets (user_id -> frozenset of friend ids) so "are these
+two users friends?" - asked on nearly every DM path - is an O(1) lookup
+instead of a ``friendships`` query with a two-branch ``$or``.
+
+A user's set is loaded lazily from MongoDB on first use (see
+``get_friend_ids`` in server.py) and kept in a bounded LRU. Writes to the
+graph (accepting a request, unfriending, blocking, account migration) update
+any loaded sets in place via ``add_edge`` / ``remove_edge`` / ``forget_user``.
+
+Each mutation bumps a per-user version, so a lazy load that raced with a
+write is discarded rather than caching a set that misses the write. Versions
+are kept in an LRU of the same size as the sets; evicting one bumps a global
+epoch that is part of every version, so loads that began before an eviction
+simply aren't cached.
+"""
+
+import os
+from collections import OrderedDict
+from typing import FrozenSet, Iterable, Optional, Tuple
+
+MAX_CACHED_USERS = int(os.environ.get("FRIEND_GRAPH_MAX_USERS", "20000"))
+
+_ADJACENCY: "OrderedDict[str, FrozenSet[str]]" = OrderedDict()
+_VERSIONS: "OrderedDict[str, int]" = OrderedDict()
+_epoch = 0
+
+
+def get(user_id: str) -> Optional[FrozenSet[str]]:
+    """Cached friend ids for a user, or None if not loaded."""
+    friends = _ADJACENCY.get(user_id)
+    if friends is not None:
+        _ADJACENCY.move_to_end(user_id)
+    return friends
+
+
+def version(user_id: str) -> Tuple[int, int]:
+    """Take before querying MongoDB; pass to ``store`` with the result."""
+    return (_epoch, _VERSIONS.get(user_id, 0))
+
+
+def store(user_id: str, friend_ids: Iterable[str], loaded_version: Tuple[int, int]) -> FrozenSet[str]:
+    friends = frozenset(friend_ids)
+    if version(user_id) != loaded_version:
+        # The graph changed while we were loading; don't cache a stale set.
+        return friends
+    _ADJACENCY[user_id] = friends
+    _ADJACENCY.move_to_end(user_id)
+    while len(_ADJACENCY) > MAX_CACHED_USERS:
+        _ADJACENCY.popitem(last=False)
+    return friends
+
+
+def _changed(user_id: str) -> None:
+    global _epoch
+    _VERSIONS[user_id] = _VERSIONS.get(user_id, 0) + 1
+    _VERSIONS.move_to_end(user_id)
+    while len(_VERSIONS) > MAX_CACHED_USERS:
+        _VERSIONS.popitem(last=False)
+        _epoch += 1
+
+
+def add_edge(user_a: str, user_b: str) -> None:
+    for user_id, other in ((user_a, user_b), (user_b, user_a)):
+        _changed(user_id)
+        friends = _ADJACENCY.get(user_id)
+        if friends is not None:
+            _ADJACENCY[user_id] = friends | {other}
+
+
+def remove_edge(user_a: str, user_b: str) -> None:
+    for user_id, other in ((user_a, user_b), (user_b, user_a)):
+        _changed(user_id)
+        friends = _ADJACENCY.get(user_id)
+        if friends is not None and other in friends:
+            _ADJACENCY[user_id] = friends - {other}
+
+
+def forget_user(user_id: str) -> None:
+    """Drop a user's set and every loaded set that mentions them; they are
+    reloaded from MongoDB on next use (e.g. after ids were re-pointed)."""
+    _changed(user_id)
+    _ADJACENCY.pop(user_id, None)
+    for other in [u for u, friends in _ADJACENCY.items() if user_id in friends]:
+        _changed(other)
+        del _ADJACENCY[other]
+
+
+def clear() -> None:
+    global _epoch
+    _epoch += 1
+    _VERSIONS.clear()
+    _ADJACENCY.clear()
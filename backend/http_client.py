@@ -0,0 +1,49 @@
+"""
+Outbound HTTP Client
+====================
+One shared ``httpx.AsyncClient`` for the server's outbound calls (the OAuth
+session exchange today). It is created at startup and closed at shutdown, so
+connections are kept alive and reused across requests instead of paying a TLS
+handshake - and a CA bundle parse - per call. The pool size is bounded, so a
+login storm after an outage queues for a connection rather than opening
+hundreds at once.
+
+The anime catalog keeps its own client (see anime_catalog.py) because it
+carries Jikan-specific headers and rate limiting.
+"""
+
+import os
+import ssl
+from typing import Optional
+
+import certifi
+import httpx
+
+MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "50"))
+MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "20"))
+TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "15"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """The shared client, created on first use if startup hasn't run yet."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            verify=ssl.create_default_context(cafile=certifi.where()),
+            timeout=httpx.Timeout(TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE,
+                keepalive_expiry=60.0,
+            ),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,235 @@
+"""
+Leaderboards
+============
+In-memory sorted leaderboards for passport XP and stats.
+
+Each board is a ``SortedList`` of ``(-score, user_id)`` plus a score map, so a
+user's rank is a bisect (O(log n)) and a page of the top k is a slice
+(O(log n + k)) - no Mongo sort per request. There are three kinds of board
+per metric:
+
+  * ``global``  - all-time value (XP from ``anime_passports``, stats from
+    ``passport_stats``);
+  * ``vibe``    - the same values, one board per ``anime_vibe``;
+  * ``weekly``  - what was gained this ISO week, persisted per user and week
+    in ``leaderboard_weekly``. Weekly boards are reset when the week rolls.
+
+The stats flush and the badge engine in server.py keep the boards current
+with absolute values (weekly totals are read back after each ``$inc``). On
+startup ``load_leaderboards`` in server.py rebuilds them by streaming the
+source collections with cursors rather than loading them into lists. That
+runs alongside live updates, so between ``begin_load`` and ``end_load`` every
+live write is remembered and the ``load_*`` calls skip those entries - a value
+read earlier by the cursor never overwrites a fresher one.
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from sortedcontainers import SortedList
+
+# metric -> passport_stats field (XP lives on anime_passports)
+METRICS = {
+    "xp": "total_experience",
+    "matches": "total_matches",
+    "messages": "messages_sent",
+    "friends": "total_friends",
+}
+STAT_METRICS = {field: metric for metric, field in METRICS.items() if metric != "xp"}
+SCOPES = ("global", "weekly", "vibe")
+
+
+class _Board:
+    __slots__ = ("entries", "scores")
+
+    def __init__(self) -> None:
+        self.entries: SortedList = SortedList()
+        self.scores: Dict[str, float] = {}
+
+    def set(self, user_id: str, score: float) -> None:
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self.entries.remove((-old, user_id))
+        self.scores[user_id] = score
+        self.entries.add((-score, user_id))
+
+    def remove(self, user_id: str) -> None:
+        old = self.scores.pop(user_id, None)
+        if old is not None:
+            self.entries.remove((-old, user_id))
+
+    def rank(self, user_id: str) -> Optional[int]:
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self.entries.index((-score, user_id)) + 1
+
+    def page(self, offset: int, limit: int) -> List[Tuple[str, float]]:
+        return [(user_id, -neg) for neg, user_id in self.entries.islice(offset, offset + limit)]
+
+
+_GLOBAL: Dict[str, _Board] = {metric: _Board() for metric in METRICS}
+_WEEKLY: Dict[str, _Board] = {metric: _Board() for metric in METRICS}
+# vibe -> metric -> board
+_BY_VIBE: Dict[str, Dict[str, _Board]] = {}
+_VIBES: Dict[str, str] = {}  # user_id -> anime_vibe
+_week: Optional[str] = None
+
+_loading = False
+# (kind, user_id, metric) written live while loading; the loader skips these
+_LIVE: Set[Tuple[str, str, str]] = set()
+# week -> user_id -> metric -> delta whose leaderboard_weekly write failed
+_WEEKLY_RETRY: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+
+def current_week() -> str:
+    year, week, _ = datetime.now(timezone.utc).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _roll_week() -> str:
+    global _week
+    week = current_week()
+    if week != _week:
+        _week = week
+        for board in _WEEKLY.values():
+            board.entries.clear()
+            board.scores.clear()
+    return week
+
+
+def _vibe_board(vibe: str, metric: str) -> _Board:
+    boards = _BY_VIBE.setdefault(vibe, {m: _Board() for m in METRICS})
+    return boards[metric]
+
+
+def begin_load() -> None:
+    global _loading
+    _loading = True
+    _LIVE.clear()
+
+
+def end_load() -> None:
+    global _loading
+    _loading = False
+    _LIVE.clear()
+
+
+def _mark_live(kind: str, user_id: str, metric: str = "") -> None:
+    if _loading:
+        _LIVE.add((kind, user_id, metric))
+
+
+def _store_score(user_id: str, metric: str, score: float) -> None:
+    _GLOBAL[metric].set(user_id, score)
+    vibe = _VIBES.get(user_id)
+    if vibe is not None:
+        _vibe_board(vibe, metric).set(user_id, score)
+
+
+def set_score(user_id: str, metric: str, score: float) -> None:
+    """All-time value of a metric (global and vibe boards)."""
+    _mark_live("score", user_id, metric)
+    _store_score(user_id, metric, score)
+
+
+def load_score(user_id: str, metric: str, score: float) -> None:
+    if ("score", user_id, metric) not in _LIVE:
+        _store_score(user_id, metric, score)
+
+
+def set_weekly(user_id: str, metric: str, score: float, week: str) -> None:
+    """A user's ``leaderboard_weekly`` total for ``week``."""
+    _mark_live("weekly", user_id, metric)
+    if _roll_week() == week:
+        _WEEKLY[metric].set(user_id, score)
+
+
+def load_weekly(user_id: str, metric: str, score: float, week: str) -> None:
+    if ("weekly", user_id, metric) not in _LIVE and _roll_week() == week:
+        _WEEKLY[metric].set(user_id, score)
+
+
+def requeue_weekly(week: str, gains: Dict[str, Dict[str, float]]) -> None:
+    """Keep weekly gains whose write failed for the next attempt."""
+    pending = _WEEKLY_RETRY.setdefault(week, {})
+    for user_id, deltas in gains.items():
+        merged = pending.setdefault(user_id, {})
+        for metric, delta in deltas.items():
+            merged[metric] = merged.get(metric, 0) + delta
+
+
+def take_weekly_retry(week: str) -> Dict[str, Dict[str, float]]:
+    """Failed gains for ``week``; those of past weeks are dropped."""
+    pending = _WEEKLY_RETRY.pop(week, {})
+    _WEEKLY_RETRY.clear()
+    return pending
+
+
+def set_vibe(user_id: str, vibe: Optional[str]) -> None:
+    _mark_live("vibe", user_id)
+    _store_vibe(user_id, vibe)
+
+
+def load_vibe(user_id: str, vibe: Optional[str]) -> None:
+    if ("vibe", user_id, "") not in _LIVE:
+        _store_vibe(user_id, vibe)
+
+
+def _store_vibe(user_id: str, vibe: Optional[str]) -> None:
+    old = _VIBES.get(user_id)
+    if old == vibe:
+        return
+    for metric in METRICS:
+        if old is not None:
+            _vibe_board(old, metric).remove(user_id)
+        score = _GLOBAL[metric].scores.get(user_id)
+        if vibe is not None and score is not None:
+            _vibe_board(vibe, metric).set(user_id, score)
+    if vibe is None:
+        _VIBES.pop(user_id, None)
+    else:
+        _VIBES[user_id] = vibe
+
+
+def _board(scope: str, metric: str, vibe: Optional[str]) -> Optional[_Board]:
+    if scope == "global":
+        return _GLOBAL[metric]
+    if scope == "weekly":
+        _roll_week()
+        return _WEEKLY[metric]
+    return _BY_VIBE.get(vibe, {}).get(metric)
+
+
+def top(scope: str, metric: str, limit: int, offset: int = 0,
+        vibe: Optional[str] = None) -> List[Tuple[str, float]]:
+    board = _board(scope, metric, vibe)
+    return board.page(offset, limit) if board else []
+
+
+def rank(scope: str, metric: str, user_id: str,
+         vibe: Optional[str] = None) -> Optional[Tuple[int, float]]:
+    """(1-based rank, score) of a user, or None if not on the board."""
+    board = _board(scope, metric, vibe)
+    position = board.rank(user_id) if board else None
+    return (position, board.scores[user_id]) if position else None
+
+
+def size(scope: str, metric: str, vibe: Optional[str] = None) -> int:
+    board = _board(scope, metric, vibe)
+    return len(board.scores) if board else 0
+
+
+def vibe_of(user_id: str) -> Optional[str]:
+    return _VIBES.get(user_id)
+
+
+def forget_user(user_id: str) -> None:
+    set_vibe(user_id, None)
+    for metric in METRICS:
+        _mark_live("score", user_id, metric)
+        _mark_live("weekly", user_id, metric)
+    for board in (*_GLOBAL.values(), *_WEEKLY.values()):
+        board.remove(user_id)
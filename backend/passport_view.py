@@ -0,0 +1,45 @@
+"""
+Materialized Passport View
+==========================
+One ``passport_views`` document per user holding everything the passport
+pages show - passport, stats, earned badges (with earned_at), journey - so
+``GET /passport`` is a single read instead of up to seven queries with lazy
+inserts in between.
+
+The view is built on first request (``build_passport_view`` in server.py) and
+then kept current in place: the stats flush writes new stats, the badge
+engine adds awards and experience, passport edits and journey milestones set
+their fields. Anything harder to patch marks the view ``stale`` and it is
+rebuilt on next read.
+
+Every change bumps ``version``, which doubles as the ETag: the PassportPage
+polls, and an unchanged passport costs a 304 with no body. Stats are served
+with the stats aggregator's unflushed deltas added, so those deltas are
+folded into the ETag too.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+
+def etag(view: Dict[str, Any], pending_stats: Optional[Dict[str, int]] = None) -> str:
+    tag = f'{view["user_id"]}-{view.get("version", 0)}'
+    if pending_stats:
+        digest = hashlib.sha1(json.dumps(pending_stats, sort_keys=True).encode()).hexdigest()[:12]
+        tag += f"-{digest}"
+    return f'W/"{tag}"'
+
+
+def not_modified(if_none_match: Optional[str], current: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match
+    current = current[2:] if current.startswith("W/") else current
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == current:
+            return True
+    return False
@@ -0,0 +1,87 @@
+"""
+Large Episode Room Delivery
+===========================
+State for the "large room" delivery mode used by busy episode rooms (think
+season finales with thousands of members).
+
+Below ``LARGE_ROOM_THRESHOLD`` members every message is emitted immediately,
+as before. At or above it:
+
+  * messages are queued and flushed as one frame per room every
+    ``FRAME_INTERVAL`` seconds, so the outbound packet rate is bounded by the
+    tick rate instead of growing with chat volume x members;
+  * each member may send at most one message per ``SLOW_MODE_SECONDS``;
+  * join/leave notifications are collapsed into a periodic member-count update
+    (at most one per ``COUNT_INTERVAL``), together with the DB count write.
+
+The Socket.IO side (actual emits) lives in server.py; this module only keeps
+the queues and timers, all O(1) per event.
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Set
+
+LARGE_ROOM_THRESHOLD = int(os.environ.get("LARGE_ROOM_THRESHOLD", "200"))
+FRAME_INTERVAL = float(os.environ.get("LARGE_ROOM_FRAME_INTERVAL", "0.15"))
+SLOW_MODE_SECONDS = float(os.environ.get("LARGE_ROOM_SLOW_MODE_SECONDS", "3"))
+COUNT_INTERVAL = 2.0
+
+# room_id -> messages waiting for the next frame (oldest first)
+_pending_frames: Dict[str, List[Dict[str, Any]]] = {}
+# room_id -> user_id -> last accepted send (epoch seconds)
+_last_sent: Dict[str, Dict[str, float]] = {}
+# Rooms whose member count changed since the last count update
+_dirty_counts: Set[str] = set()
+_last_count_flush: Dict[str, float] = {}
+
+
+def is_large(member_count: int) -> bool:
+    return member_count >= LARGE_ROOM_THRESHOLD
+
+
+def has_pending(room_id: str) -> bool:
+    return room_id in _pending_frames
+
+
+def queue_message(room_id: str, message: Dict[str, Any]) -> None:
+    _pending_frames.setdefault(room_id, []).append(message)
+
+
+def take_frames() -> Dict[str, List[Dict[str, Any]]]:
+    """Hand over every queued frame and start collecting fresh ones."""
+    global _pending_frames
+    frames, _pending_frames = _pending_frames, {}
+    return frames
+
+
+def slow_mode_wait(room_id: str, user_id: str) -> float:
+    """Seconds the user must still wait, or 0 (and the send is recorded)."""
+    now = time.time()
+    senders = _last_sent.setdefault(room_id, {})
+    wait = senders.get(user_id, 0.0) + SLOW_MODE_SECONDS - now
+    if wait > 0:
+        return wait
+    senders[user_id] = now
+    return 0.0
+
+
+def mark_count_dirty(room_id: str) -> None:
+    _dirty_counts.add(room_id)
+
+
+def take_due_counts() -> List[str]:
+    """Rooms whose member count should be broadcast now."""
+    now = time.time()
+    due = [r for r in _dirty_counts if now - _last_count_flush.get(r, 0.0) >= COUNT_INTERVAL]
+    for room_id in due:
+        _dirty_counts.discard(room_id)
+        _last_count_flush[room_id] = now
+    return due
+
+
+def drop_room(room_id: str) -> None:
+    _pending_frames.pop(room_id, None)
+    _last_sent.pop(room_id, None)
+    _dirty_counts.discard(room_id)
+    _last_count_flush.pop(room_id, None)
@@ -0,0 +1,71 @@
+"""
+Episode Room Expiry Scheduler
+=============================
+In-process min-heap of episode room deadlines.
+
+Rather than waking up every hour and scanning ``episode_rooms`` for anything
+past ``expires_at``, each room's deadline is pushed onto a heap when the room
+is created (or loaded at startup). A single background task sleeps until the
+earliest deadline and expires exactly the rooms that are due - O(log n) per
+room, no periodic full scans. A MongoDB TTL index on ``expires_at_dt`` backs
+this up for rooms whose deadline passes while the process is down.
+
+Cancelled or rescheduled rooms are dropped lazily: stale heap entries are
+skipped when they surface.
+"""
+
+import asyncio
+import heapq
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# Never sleep longer than this, so clock drift can't strand a deadline.
+_MAX_SLEEP = 3600.0
+
+_HEAP: List[Tuple[float, str]] = []
+_DEADLINES: Dict[str, float] = {}  # room_id -> current deadline (epoch seconds)
+
+# Set whenever a deadline earlier than the one being slept on is scheduled.
+wakeup = asyncio.Event()
+
+
+def schedule(room_id: str, expires_at: datetime) -> None:
+    deadline = expires_at.timestamp()
+    if _DEADLINES.get(room_id) == deadline:
+        return
+    earliest = _HEAP[0][0] if _HEAP else None
+    _DEADLINES[room_id] = deadline
+    heapq.heappush(_HEAP, (deadline, room_id))
+    if earliest is None or deadline < earliest:
+        wakeup.set()
+
+
+def cancel(room_id: str) -> None:
+    _DEADLINES.pop(room_id, None)
+
+
+def _discard_stale() -> None:
+    while _HEAP and _DEADLINES.get(_HEAP[0][1]) != _HEAP[0][0]:
+        heapq.heappop(_HEAP)
+
+
+def seconds_until_next() -> float:
+    """Time to sleep before the next deadline is due."""
+    _discard_stale()
+    if not _HEAP:
+        return _MAX_SLEEP
+    return min(_MAX_SLEEP, max(0.0, _HEAP[0][0] - time.time()))
+
+
+def pop_due(now: Optional[float] = None) -> List[str]:
+    """Remove and return every room whose deadline has passed."""
+    now = time.time() if now is None else now
+    due = []
+    while True:
+        _discard_stale()
+        if not _HEAP or _HEAP[0][0] > now:
+            return due
+        _, room_id = heapq.heappop(_HEAP)
+        del _DEADLINES[room_id]
+        due.append(room_id)
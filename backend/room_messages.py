@@ -0,0 +1,120 @@
+"""
+Episode Room Message Buffer
+===========================
+Bounded in-memory ring buffer of the most recent messages per episode room.
+
+Opening a room only ever needs the tail of the conversation, so we keep the
+last ``ROOM_BUFFER_SIZE`` messages of each active room in a ``deque`` and serve
+first loads straight from memory. Older history is paged from MongoDB with a
+keyset cursor (see ``build_before_query``) backed by the
+``(room_id, timestamp, id)`` index created at startup.
+
+A room's buffer is only trusted once it has been *seeded* - either from the
+database (the last N messages) or as empty for a freshly created room. Until
+then callers must fall back to the database and seed the buffer with the result.
+A database load is bracketed by ``begin_seed``/``end_seed``: messages appended
+while it runs are held and merged into the seed, since the query may have
+missed them.
+"""
+
+import os
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+# Messages kept per room, and how many rooms we keep buffers for (LRU).
+ROOM_BUFFER_SIZE = int(os.environ.get("ROOM_BUFFER_SIZE", "100"))
+MAX_BUFFERED_ROOMS = int(os.environ.get("MAX_BUFFERED_ROOMS", "500"))
+
+# room_id -> deque of message dicts (oldest first). OrderedDict gives us cheap
+# LRU eviction so memory stays bounded no matter how many rooms exist.
+_BUFFERS: "OrderedDict[str, Deque[Dict[str, Any]]]" = OrderedDict()
+# room_id -> [loads in progress, messages appended since the first began]
+_SEEDING: Dict[str, List[Any]] = {}
+
+
+def _touch(room_id: str) -> None:
+    _BUFFERS.move_to_end(room_id)
+    while len(_BUFFERS) > MAX_BUFFERED_ROOMS:
+        _BUFFERS.popitem(last=False)
+
+
+def is_seeded(room_id: str) -> bool:
+    return room_id in _BUFFERS
+
+
+def begin_seed(room_id: str) -> None:
+    """Call before querying a room's tail to seed from; pair with ``end_seed``."""
+    entry = _SEEDING.setdefault(room_id, [0, deque(maxlen=ROOM_BUFFER_SIZE)])
+    entry[0] += 1
+
+
+def end_seed(room_id: str) -> None:
+    entry = _SEEDING.get(room_id)
+    if entry is not None:
+        entry[0] -= 1
+        if entry[0] <= 0:
+            del _SEEDING[room_id]
+
+
+def seed(room_id: str, messages: List[Dict[str, Any]]) -> None:
+    """Set a room's buffer to ``messages`` (oldest first) plus anything
+    appended since ``begin_seed``. A room that is already seeded keeps its
+    buffer, which is at least as current as any load that started earlier."""
+    if room_id not in _BUFFERS:
+        entry = _SEEDING.get(room_id)
+        if entry is not None and entry[1]:
+            merged = {message["id"]: message for message in messages}
+            for message in entry[1]:
+                merged.setdefault(message["id"], message)
+            messages = sorted(merged.values(), key=lambda m: (m["timestamp"], m["id"]))
+        _BUFFERS[room_id] = deque(messages[-ROOM_BUFFER_SIZE:], maxlen=ROOM_BUFFER_SIZE)
+    _touch(room_id)
+
+
+def append(room_id: str, message: Dict[str, Any]) -> None:
+    """Record a new message. Unseeded rooms are left alone (unless a seed is
+    pending): the buffer must always hold the true tail, so a partial buffer
+    would be worse than none."""
+    entry = _SEEDING.get(room_id)
+    if entry is not None:
+        entry[1].append(message)
+    buf = _BUFFERS.get(room_id)
+    if buf is None:
+        return
+    buf.append(message)
+    _touch(room_id)
+
+
+def recent(room_id: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+    """Return up to ``limit`` of the newest messages (oldest first), or None if
+    the buffer can't answer (not seeded, or more requested than it holds)."""
+    buf = _BUFFERS.get(room_id)
+    if buf is None or limit > ROOM_BUFFER_SIZE:
+        return None
+    _touch(room_id)
+    if limit <= 0:
+        return []
+    items = list(buf)
+    return items[-limit:]
+
+
+def drop(room_id: str) -> None:
+    _BUFFERS.pop(room_id, None)
+    _SEEDING.pop(room_id, None)
+
+
+def build_before_query(room_id: str, before: str, before_id: Optional[str] = None) -> Dict[str, Any]:
+    """Keyset cursor for messages older than (before, before_id).
+
+    ``timestamp`` alone is not unique, so the message id breaks ties between
+    messages sent in the same instant.
+    """
+    if not before_id:
+        return {"room_id": room_id, "timestamp": {"$lt": before}}
+    return {
+        "room_id": room_id,
+        "$or": [
+            {"timestamp": {"$lt": before}},
+            {"timestamp": before, "id": {"$lt": before_id}},
+        ],
+    }
@@ -1,11 +1,15 @@
 from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Request, Response
+from fastapi.responses import FileResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
 import logging
 import json
 from pathlib import Path
+from http.cookies import SimpleCookie
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
@@ -13,8 +17,7 @@ from datetime import datetime, timezone, timedelta
 import socketio
 import asyncio
 import random
-import ssl
-import certifi
+import math
 
 # Import passport models
 from passport_models import (
@@ -32,6 +35,73 @@ from database_connection_fixed import get_database, close_database, is_database_
 # Import anime catalog service (free Jikan / MyAnimeList API, no key required)
 import anime_catalog
 
+# In-memory tail of recent messages per episode room
+import room_messages
+
+# In-memory trending-rooms leaderboard
+import trending_rooms
+
+# Min-heap of episode room deadlines
+import room_expiry
+
+# Compiled spoiler lexicons (base + per-anime terms)
+import spoiler_detection
+
+# Batched frames / slow mode for very large episode rooms
+import room_delivery
+
+# Direct message conversation ids + keyset paging
+import conversations
+
+# In-memory unread DM counters
+import unread_counts
+
+# Short-TTL cache behind batched user hydration
+import user_profiles
+
+# In-memory friendship adjacency sets
+import friend_graph
+
+# Write-behind queue for direct messages
+import dm_outbox
+
+# session_token -> user_id cache for get_current_user
+import session_cache
+
+# Optional HMAC-signed stateless session tokens
+import session_tokens
+
+# Shared outbound HTTP connection pool
+import http_client
+
+# Queue-backed, sampled logging
+import structured_logging
+from structured_logging import log_event
+
+# Badge unlock rules indexed by stat, plus per-user earned-badge cache
+import badge_engine
+
+# In-memory arc progression for active users
+import arc_state
+
+# Write-behind passport/arc stat counters, flushed with bulk_write
+import stats_aggregator
+
+# Per-user daily action counters for premium limits
+import daily_counters
+
+# Cached premium status / feature sets, refreshed at subscription expiry
+import entitlements
+
+# Materialized per-user passport documents with ETag versions
+import passport_view
+
+# Pillow-rendered passport share-card images, cached on disk
+import share_cards
+
+# In-memory sorted leaderboards (global, weekly, per anime vibe)
+import leaderboards
+
 # Database will be initialized in startup event
 db = None
 
@@ -112,10 +182,6 @@ active_users: Dict[str, Dict] = {}  # user_id -> {sid, user_data}
 matching_queue: List[Dict] = []  # Users waiting to be matched
 active_matches: Dict[str, Dict] = {}  # sid -> {partner_sid, user_id, partner_id}
 
-# In-memory message-stat counters, flushed to the DB periodically so we don't
-# perform a DB write (passport + arc) on every single chat message.
-pending_message_stats: Dict[str, int] = {}  # user_id -> messages since last flush
-
 # Store episode room connections
 episode_room_users: Dict[str, Dict] = {}  # sid -> {room_id, user_id, user_data}
 episode_rooms_cache: Dict[str, Dict] = {}  # room_id -> {room_data, users: []}
@@ -196,6 +262,7 @@ class DirectMessage(BaseModel):
     message: str
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     read: bool = False
+    conversation_id: Optional[str] = None
 
 class EpisodeRoom(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -324,32 +391,24 @@ class UserMemoryCollection(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-class UserDailyStats(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    date: str  # YYYY-MM-DD format
-    action: str  # "match_started", "episode_room_joined", "episode_room_created"
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
 # Auth Helper
 async def get_current_user(request: Request) -> Optional[User]:
     # Check cookie first
     session_token = request.cookies.get('session_token')
-    logging.debug(f"Session token from cookie: {session_token[:20] if session_token else 'None'}...")
     
     # Fallback to Authorization header
     if not session_token:
         auth_header = request.headers.get('Authorization')
         if auth_header and auth_header.startswith('Bearer '):
             session_token = auth_header.replace('Bearer ', '')
-            logging.debug(f"Session token from header: {session_token[:20]}...")
     
     if not session_token:
-        logging.debug("No session token found in cookies or headers")
         return None
     
+    return await get_user_for_token(session_token)
+
+async def get_user_for_token(session_token: str) -> Optional[User]:
+    """Resolve a session token (cookie or bearer) to its user, or None."""
     # Check if this is an anonymous session token
     if session_token.startswith('anon_token_'):
         logging.debug("Anonymous session detected")
@@ -359,6 +418,19 @@ async def get_current_user(request: Request) -> Optional[User]:
         # Socket.IO will handle anonymous users separately
         return None
     
+    # Signed session tokens are verified in-process, without any lookup
+    if session_tokens.enabled() and session_tokens.is_signed(session_token):
+        user_id = session_tokens.verify(session_token)
+        if user_id is None:
+            return None
+        if IN_MEMORY_MODE and user_id in IN_MEMORY_USERS:
+            return User(**IN_MEMORY_USERS[user_id])
+        try:
+            return await get_session_user(user_id)
+        except Exception as e:
+            logging.error(f"Error loading user for signed session: {e}")
+            return None
+    
     # Check in-memory sessions first (for development mode)
     if IN_MEMORY_MODE and session_token in IN_MEMORY_SESSIONS:
         session = IN_MEMORY_SESSIONS[session_token]
@@ -377,31 +449,74 @@ async def get_current_user(request: Request) -> Optional[User]:
         logging.debug(f"User authenticated from memory: {user_data.get('email')}")
         return User(**user_data)
     
-    # Try database if available
+    # Try database if available (sessions and users are cached in memory)
     try:
-        # Check session in database
-        session = await db.user_sessions.find_one({"session_token": session_token})
-        if not session:
-            logging.warning(f"Session not found in database for token: {session_token[:20]}...")
-            return None
-        
-        # Check expiry
-        if datetime.fromisoformat(session['expires_at']) < datetime.now(timezone.utc):
-            logging.warning(f"Session expired for user: {session['user_id']}")
-            return None
-        
-        # Get user
-        user_doc = await db.users.find_one({"id": session['user_id']}, {"_id": 0})
-        if not user_doc:
-            logging.warning(f"User not found for session user_id: {session['user_id']}")
+        user_id = session_cache.lookup(session_token)
+        if user_id is None:
+            # Check session in database
+            session = await db.user_sessions.find_one(
+                {"session_token": session_token}, {"_id": 0, "user_id": 1, "expires_at": 1}
+            )
+            if not session:
+                logging.warning("Session not found in database")
+                session_cache.store_invalid(session_token)
+                return None
+            
+            # Check expiry
+            expires_at = datetime.fromisoformat(session['expires_at'])
+            if expires_at < datetime.now(timezone.utc):
+                logging.warning(f"Session expired for user: {session['user_id']}")
+                session_cache.store_invalid(session_token)
+                return None
+            
+            user_id = session['user_id']
+            session_cache.store(session_token, user_id, expires_at.timestamp())
+        elif user_id == session_cache.INVALID:
             return None
         
-        logging.debug(f"User authenticated successfully: {user_doc.get('email')}")
-        return User(**user_doc)
+        return await get_session_user(user_id)
     except Exception as e:
         logging.error(f"Error checking session in database: {e}")
         return None
 
+async def get_session_user(user_id: str) -> Optional[User]:
+    """The (shared, cached) User model for an authenticated session."""
+    user = user_profiles.get_model(user_id)
+    if user is None:
+        user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
+        if not user_doc:
+            logging.warning(f"User not found for session user_id: {user_id}")
+            return None
+        user = User(**user_doc)
+        user_profiles.store_model(user_id, user)
+    return user
+
+_revocations_synced_at = ""
+
+async def sync_revoked_sessions():
+    """Pull signed-session revocations written since the last sync (by any
+    worker) into the in-memory revocation set."""
+    global _revocations_synced_at
+    now = datetime.now(timezone.utc)
+    revoked = await db.revoked_sessions.find(
+        {"revoked_at": {"$gt": _revocations_synced_at}, "expires_at_dt": {"$gt": now}},
+        {"_id": 0, "session_id": 1, "expires_at_dt": 1, "revoked_at": 1}
+    ).to_list(None)
+    for entry in revoked:
+        expires_at = entry['expires_at_dt'].replace(tzinfo=timezone.utc)
+        session_tokens.revoke(entry['session_id'], expires_at.timestamp())
+        _revocations_synced_at = max(_revocations_synced_at, entry['revoked_at'])
+
+async def refresh_revoked_sessions():
+    """Background task: keep this worker's revocation set current."""
+    while True:
+        try:
+            await asyncio.sleep(30)
+            if db is not None:
+                await sync_revoked_sessions()
+        except Exception as e:
+            logging.error(f"Error in refresh_revoked_sessions: {e}", exc_info=True)
+
 # Initialize mock anime database
 async def init_anime_db():
     count = await db.anime_data.count_documents({})
@@ -426,76 +541,473 @@ async def init_anime_db():
         await db.anime_data.insert_many(mock_anime)
         logging.info(f"Initialized anime database with {len(mock_anime)} entries")
 
+async def drop_superseded_index(collection, name: str):
+    """Drop an index that a differently keyed one has replaced"""
+    if name in await collection.index_information():
+        await collection.drop_index(name)
+
+# Indexes backing the hot read paths. create_index is idempotent, so this is
+# safe to run on every startup.
+async def ensure_indexes():
+    # id breaks timestamp ties in the history sort; without it in the index
+    # Mongo sorts the room's messages in memory
+    await drop_superseded_index(db.episode_room_messages, "room_timestamp")
+    await db.episode_room_messages.create_index(
+        [("room_id", 1), ("timestamp", -1), ("id", -1)], name="room_timestamp_id"
+    )
+    # Same for conversation history, which pages on (timestamp, id)
+    await drop_superseded_index(db.direct_messages, "conversation_timestamp")
+    await db.direct_messages.create_index(
+        [("conversation_id", 1), ("timestamp", -1), ("id", -1)], name="conversation_timestamp_id"
+    )
+    await db.direct_messages.create_index(
+        [("to_user_id", 1), ("read", 1), ("from_user_id", 1)], name="unread_by_sender"
+    )
+    # Makes write-behind retries idempotent (see dm_outbox)
+    await db.direct_messages.create_index("id", name="id_unique", unique=True)
+    await db.revoked_sessions.create_index(
+        "expires_at_dt", name="expires_at_ttl", expireAfterSeconds=0
+    )
+    await db.revoked_sessions.create_index("revoked_at", name="revoked_at")
+    await db.user_daily_counters.create_index(
+        [("user_id", 1), ("date", 1)], name="user_date_unique", unique=True
+    )
+    await db.passport_views.create_index("user_id", name="user_id_unique", unique=True)
+    await db.leaderboard_weekly.create_index(
+        [("week", 1), ("user_id", 1)], name="week_user_unique", unique=True
+    )
+
+async def backfill_conversation_ids():
+    """One-off migration: give pre-existing direct messages a conversation_id.
+    Cheap no-op once every message has one."""
+    result = await db.direct_messages.update_many(
+        {"conversation_id": {"$exists": False}},
+        conversations.CONVERSATION_ID_PIPELINE
+    )
+    if result.modified_count:
+        logging.info(f"✅ Backfilled conversation_id on {result.modified_count} direct messages")
+
+async def fetch_conversation_page(user_id: str, friend_id: str, limit: int,
+                                  before: Optional[str] = None, before_id: Optional[str] = None,
+                                  after: Optional[str] = None, after_id: Optional[str] = None):
+    """Up to ``limit`` messages of a conversation, oldest first: the newest
+    page by default, older than ``before`` or newer than ``after`` if given.
+    Messages still in the DM outbox are merged in rather than flushed first."""
+    conv_id = conversations.conversation_id(user_id, friend_id)
+    # Taken before the query: a message written meanwhile is in both, not neither
+    pending = dm_outbox.pending_for(conv_id)
+    query = conversations.build_history_query(conv_id, before, before_id, after, after_id)
+    if after and not before:
+        # Catching up: the oldest messages after the cursor
+        messages = await db.direct_messages.find(query, {"_id": 0}).sort(
+            [("timestamp", 1), ("id", 1)]
+        ).limit(limit).to_list(limit)
+    else:
+        messages = await db.direct_messages.find(query, {"_id": 0}).sort(
+            [("timestamp", -1), ("id", -1)]
+        ).limit(limit).to_list(limit)
+        messages.reverse()
+    return conversations.merge_pending(messages, pending, limit, before, before_id, after, after_id)
+
+# Only the fields User exposes are fetched when hydrating lists of users
+USER_PROFILE_PROJECTION = {"_id": 0, **{field: 1 for field in User.model_fields}}
+
+async def hydrate_users(user_ids) -> Dict[str, dict]:
+    """User documents for ``user_ids`` keyed by id (unknown ids are left out):
+    cached profiles plus at most one ``$in`` query for the rest. The returned
+    documents are shared with the cache and must not be modified."""
+    found, missing = user_profiles.lookup(user_ids)
+    if missing:
+        docs = await db.users.find(
+            {"id": {"$in": missing}}, USER_PROFILE_PROJECTION
+        ).to_list(None)
+        user_profiles.store(docs)
+        found.update((doc["id"], doc) for doc in docs)
+    return found
+
+async def get_friend_ids(user_id: str) -> frozenset:
+    """A user's friend ids, from the friend graph cache (loaded on first use)."""
+    friends = friend_graph.get(user_id)
+    if friends is None:
+        loaded_version = friend_graph.version(user_id)
+        friendships = await db.friendships.find(
+            {"$or": [{"user1_id": user_id}, {"user2_id": user_id}]},
+            {"_id": 0, "user1_id": 1, "user2_id": 1}
+        ).to_list(None)
+        friends = friend_graph.store(user_id, (
+            f['user2_id'] if f['user1_id'] == user_id else f['user1_id']
+            for f in friendships
+        ), loaded_version)
+    return friends
+
+async def are_friends(user_id: str, other_id: str) -> bool:
+    return other_id in await get_friend_ids(user_id)
+
+_trending_load_lock = asyncio.Lock()
+
+async def load_trending_rooms():
+    """Seed the trending leaderboard from live rooms: one query for the rooms
+    and one batched lookup for their anime. Concurrent callers share one load."""
+    async with _trending_load_lock:
+        if not trending_rooms.is_loaded():
+            await _load_trending_rooms()
+
+async def _load_trending_rooms():
+    now = datetime.now(timezone.utc)
+    rooms = await db.episode_rooms.find(
+        {"expires_at": {"$gt": now.isoformat()}},
+        {"_id": 0, "expires_at_dt": 0}
+    ).to_list(None)
+    anime_ids = list({room['anime_id'] for room in rooms})
+    anime_docs = await db.anime_data.find({"id": {"$in": anime_ids}}, {"_id": 0}).to_list(None)
+    anime_by_id = {a['id']: a for a in anime_docs}
+    for room in rooms:
+        # Live membership is rebuilt from socket joins, not the stale DB count
+        room['active_users_count'] = len(episode_rooms_cache.get(room['id'], {}).get('users', []))
+        trending_rooms.upsert_room(room, anime_by_id.get(room['anime_id']))
+    trending_rooms.mark_loaded()
+    logging.info(f"Loaded {len(rooms)} live rooms into the trending leaderboard")
+
+async def prepare_room_expiry():
+    """Background task: create the room TTL index and load expiries, retrying
+    until it succeeds. Kept apart from the rest of startup so a failure there
+    never leaves rooms unscheduled."""
+    while db is not None:
+        try:
+            # Safety net for room expiry: Mongo drops rooms whose native datetime
+            # deadline has passed, even if this process was down at the time.
+            await db.episode_rooms.create_index(
+                "expires_at_dt", name="expires_at_ttl", expireAfterSeconds=0
+            )
+            await load_room_expiries()
+            return
+        except Exception as e:
+            logging.error(f"Error preparing room expiry, retrying in 60s: {e}")
+            await asyncio.sleep(60)
+
+async def load_room_expiries():
+    """Push every room's deadline onto the expiry heap. Rooms that expired
+    while we were down come out due immediately, so the expiry task clears
+    them on its first pass."""
+    # Older rooms only carry the ISO string; give them the native datetime
+    # the TTL index needs.
+    await db.episode_rooms.update_many(
+        {"expires_at_dt": {"$exists": False}},
+        [{"$set": {"expires_at_dt": {"$dateFromString": {"dateString": "$expires_at"}}}}]
+    )
+    rooms = await db.episode_rooms.find({}, {"_id": 0, "id": 1, "expires_at": 1}).to_list(None)
+    for room in rooms:
+        room_expiry.schedule(room['id'], datetime.fromisoformat(room['expires_at']))
+    logging.info(f"Scheduled expiry for {len(rooms)} episode rooms")
+
+async def expire_room(room_id: str):
+    """Drop an expired room from every in-memory structure and tell anyone
+    still inside."""
+    if room_id in episode_rooms_cache:
+        del episode_rooms_cache[room_id]
+    room_messages.drop(room_id)
+    trending_rooms.remove_room(room_id)
+    room_delivery.drop_room(room_id)
+    await sio.emit('episode_room_expired', {'room_id': room_id}, room=room_id)
+
 # Background task for cleaning up expired rooms
 async def cleanup_expired_rooms():
-    """Background task that runs every hour to clean up expired episode rooms"""
+    """Background task that expires episode rooms on time. It sleeps until the
+    earliest deadline on the expiry heap (or until a sooner one is scheduled)
+    and then removes just the rooms that are due."""
     while True:
         try:
-            await asyncio.sleep(3600)  # Run every hour
+            try:
+                await asyncio.wait_for(room_expiry.wakeup.wait(), timeout=room_expiry.seconds_until_next())
+            except asyncio.TimeoutError:
+                pass
+            room_expiry.wakeup.clear()
             
-            # Skip cleanup if database is not available
-            if db is None:
-                logging.info("Skipping room cleanup - database not available")
+            expired_ids = room_expiry.pop_due()
+            if not expired_ids:
                 continue
             
-            now = datetime.now(timezone.utc)
-            logging.info("Running expired room cleanup task...")
-            
-            # Find expired rooms
-            expired_rooms = await db.episode_rooms.find(
-                {"expires_at": {"$lt": now.isoformat()}},
-                {"_id": 0}
-            ).to_list(100)
+            for room_id in expired_ids:
+                await expire_room(room_id)
             
-            for room in expired_rooms:
-                room_id = room['id']
-                
-                # Remove from cache
-                if room_id in episode_rooms_cache:
-                    del episode_rooms_cache[room_id]
-                
-                # Notify any remaining users
-                await sio.emit('episode_room_expired', {'room_id': room_id}, room=room_id)
-                
-                logging.info(f"Cleaned up expired room: {room_id} ({room['anime_title']} Ep {room['episode_number']})")
-            
-            # Delete expired rooms from database
-            if expired_rooms:
-                result = await db.episode_rooms.delete_many(
-                    {"expires_at": {"$lt": now.isoformat()}}
-                )
-                logging.info(f"Deleted {result.deleted_count} expired rooms from database")
+            # Delete expired rooms from database (the TTL index would get them
+            # eventually; this makes it immediate)
+            if db is not None:
+                result = await db.episode_rooms.delete_many({"id": {"$in": expired_ids}})
+                logging.info(f"Expired {len(expired_ids)} rooms, deleted {result.deleted_count} from database")
             
         except Exception as e:
             logging.error(f"Error in cleanup_expired_rooms: {e}", exc_info=True)
 
 
-async def _flush_message_stats_once():
-    """Flush accumulated per-user message counts to the DB in one batch."""
-    if db is None or not pending_message_stats:
+_stats_flush_lock = asyncio.Lock()
+
+async def _bulk_inc(collection: str, batch: dict, operations: list) -> list:
+    """Run one collection's stat bulk write; returns the user ids whose update
+    landed. Failed updates are requeued for the next flush; a write concern
+    error fails the whole batch, since none of it is known to be durable."""
+    user_ids = list(batch)
+    try:
+        await db[collection].bulk_write(operations, ordered=False)
+        return user_ids
+    except BulkWriteError as e:
+        if e.details.get('writeConcernErrors'):
+            stats_aggregator.requeue(collection, user_ids, batch)
+            logging.error(f"Write concern error on {collection} stats, requeued: {e}")
+            return []
+        failed = {err['index'] for err in e.details.get('writeErrors', [])}
+        stats_aggregator.requeue(collection, [user_ids[i] for i in failed], batch)
+        logging.error(f"{len(failed)} {collection} stat updates failed and were requeued: {e}")
+        return [user_id for i, user_id in enumerate(user_ids) if i not in failed]
+    except Exception as e:
+        stats_aggregator.requeue(collection, user_ids, batch)
+        logging.error(f"Error writing {collection} stats, requeued: {e}")
+        return []
+
+async def persist_stats():
+    """Flush the stats aggregator: one bulk $inc write per collection, then
+    arc and badge checks once per user for the whole batch."""
+    if db is None:
         return
-    # Snapshot and clear immediately so new messages keep counting
-    snapshot = dict(pending_message_stats)
-    pending_message_stats.clear()
-    for user_id, count in snapshot.items():
-        if count <= 0:
-            continue
+    async with _stats_flush_lock:
+        if not stats_aggregator.has_pending():
+            return
+        batch = stats_aggregator.take_batch()
+        now = datetime.now(timezone.utc)
+        passport_batch = batch[stats_aggregator.PASSPORT]
+        arc_batch = batch[stats_aggregator.ARC]
+        
+        # Arc states are loaded before this batch reaches user_arcs, then
+        # advanced in memory; only a phase change needs a write of its own
         try:
-            await update_passport_stats(user_id, {"messages_sent": count})
-            await update_user_stats(user_id, "messages_sent", count)
+            arc_states = await load_arc_states(list(arc_batch)) if arc_batch else {}
+            transitions = {}
+            for user_id, deltas in arc_batch.items():
+                arc_history_entry = arc_state.apply(arc_states[user_id], deltas)
+                if arc_history_entry is not None:
+                    transitions[user_id] = arc_history_entry
         except Exception as e:
-            logging.error(f"Error flushing message stats for {user_id}: {e}")
+            # Nothing has been written yet: put the whole batch back
+            stats_aggregator.requeue(stats_aggregator.PASSPORT, list(passport_batch), passport_batch)
+            stats_aggregator.requeue(stats_aggregator.ARC, list(arc_batch), arc_batch)
+            for user_id in arc_batch:
+                arc_state.forget_user(user_id)
+            logging.error(f"Error preparing stats flush, batch requeued: {e}", exc_info=True)
+            return
+        
+        passport_done = []
+        if passport_batch:
+            passport_done = await _bulk_inc(stats_aggregator.PASSPORT, passport_batch, [
+                UpdateOne(
+                    {"user_id": user_id},
+                    {"$inc": deltas, "$set": {"last_updated": now.isoformat()}},
+                    upsert=True
+                )
+                for user_id, deltas in passport_batch.items()
+            ])
+        arc_done = []
+        if arc_batch:
+            arc_done = await _bulk_inc(stats_aggregator.ARC, arc_batch, [
+                UpdateOne(
+                    {"user_id": user_id},
+                    {
+                        "$inc": {f"stats.{stat}": delta for stat, delta in deltas.items()},
+                        "$set": {"last_updated": now}
+                    },
+                    upsert=True
+                )
+                for user_id, deltas in arc_batch.items()
+            ])
+        
+        # Requeued arc deltas are already in memory; reload those users instead
+        for user_id in set(arc_batch) - set(arc_done):
+            arc_state.forget_user(user_id)
+        for user_id in arc_done:
+            if user_id in transitions:
+                try:
+                    await persist_arc_transition(user_id, arc_states[user_id], transitions[user_id])
+                except Exception as e:
+                    # Reload from user_arcs so the transition is detected again
+                    arc_state.forget_user(user_id)
+                    logging.error(f"Error recording arc transition for {user_id}: {e}")
+        
+        if not passport_done:
+            return
+        try:
+            stats_docs = await db.passport_stats.find(
+                {"user_id": {"$in": passport_done}}, {"_id": 0}
+            ).to_list(None)
+        except Exception as e:
+            logging.error(f"Error reading flushed passport stats: {e}")
+            return
+        # Keep built passport views in step with the new stats
+        if stats_docs:
+            try:
+                await db.passport_views.bulk_write([
+                    UpdateOne({"user_id": stats['user_id']}, {"$set": {"stats": stats}, "$inc": {"version": 1}})
+                    for stats in stats_docs
+                ], ordered=False)
+            except Exception as e:
+                logging.error(f"Error updating passport views after stats flush: {e}")
+        for stats in stats_docs:
+            record_leaderboard_stats(stats)
+        await record_weekly_gains({
+            user_id: {
+                leaderboards.STAT_METRICS[stat]: delta
+                for stat, delta in passport_batch[user_id].items() if stat in leaderboards.STAT_METRICS
+            }
+            for user_id in passport_done
+        })
+        # check_badge_unlocks contains its own errors, one user at a time
+        for stats in stats_docs:
+            await check_badge_unlocks(stats['user_id'], stats, passport_batch[stats['user_id']].keys())
+
+
+def record_leaderboard_stats(stats: dict):
+    """Feed a passport_stats document's all-time values to the leaderboards"""
+    for field, metric in leaderboards.STAT_METRICS.items():
+        if field in stats:
+            leaderboards.set_score(stats['user_id'], metric, stats[field])
+
+async def record_weekly_gains(gains: dict):
+    """Add user_id -> {metric: delta} to this week's leaderboard totals and put
+    the new totals on the weekly boards. Never raises: failed gains are kept
+    and retried with the next call, so the rest of a flush carries on."""
+    week = leaderboards.current_week()
+    gains = {user_id: deltas for user_id, deltas in gains.items() if deltas}
+    retry = leaderboards.take_weekly_retry(week)
+    for user_id, deltas in retry.items():
+        merged = gains.setdefault(user_id, {})
+        for metric, delta in deltas.items():
+            merged[metric] = merged.get(metric, 0) + delta
+    if not gains:
+        return
+    user_ids = list(gains)
+    try:
+        await db.leaderboard_weekly.bulk_write([
+            UpdateOne({"week": week, "user_id": user_id}, {"$inc": gains[user_id]}, upsert=True)
+            for user_id in user_ids
+        ], ordered=False)
+    except BulkWriteError as e:
+        if e.details.get('writeConcernErrors'):
+            failed = set(range(len(user_ids)))
+        else:
+            failed = {err['index'] for err in e.details.get('writeErrors', [])}
+        leaderboards.requeue_weekly(week, {user_ids[i]: gains[user_ids[i]] for i in failed})
+        logging.error(f"{len(failed)} weekly leaderboard updates failed, will retry: {e}")
+        gains = {user_id: gains[user_id] for i, user_id in enumerate(user_ids) if i not in failed}
+    except Exception as e:
+        leaderboards.requeue_weekly(week, gains)
+        logging.error(f"Error writing weekly leaderboard totals, will retry: {e}")
+        return
+    if not gains:
+        return
+    try:
+        totals = await db.leaderboard_weekly.find(
+            {"week": week, "user_id": {"$in": list(gains)}}, {"_id": 0}
+        ).to_list(None)
+    except Exception as e:
+        logging.error(f"Error reading back weekly leaderboard totals: {e}")
+        return
+    for doc in totals:
+        for metric in gains[doc['user_id']]:
+            leaderboards.set_weekly(doc['user_id'], metric, doc.get(metric, 0), week)
 
+async def load_leaderboards():
+    """Rebuild the in-memory leaderboards, streaming passports, stats and
+    this week's totals from MongoDB"""
+    if db is None:
+        return
+    # Live updates made while this streams win over what the cursors return
+    leaderboards.begin_load()
+    try:
+        async for passport in db.anime_passports.find(
+            {}, {"_id": 0, "user_id": 1, "anime_vibe": 1, "total_experience": 1}
+        ):
+            leaderboards.load_vibe(passport['user_id'], passport.get('anime_vibe'))
+            leaderboards.load_score(passport['user_id'], "xp", passport.get('total_experience', 0))
+        async for stats in db.passport_stats.find(
+            {}, {"_id": 0, "user_id": 1, **{field: 1 for field in leaderboards.STAT_METRICS}}
+        ):
+            for field, metric in leaderboards.STAT_METRICS.items():
+                if field in stats:
+                    leaderboards.load_score(stats['user_id'], metric, stats[field])
+        week = leaderboards.current_week()
+        async for weekly in db.leaderboard_weekly.find({"week": week}, {"_id": 0}):
+            for metric in leaderboards.METRICS:
+                if weekly.get(metric):
+                    leaderboards.load_weekly(weekly['user_id'], metric, weekly[metric], week)
+        logging.info(f"✅ Leaderboards loaded ({leaderboards.size('global', 'xp')} passports)")
+    except Exception as e:
+        logging.error(f"Error loading leaderboards: {e}", exc_info=True)
+    finally:
+        leaderboards.end_load()
 
-async def flush_message_stats():
-    """Background task: batch-write message stats every 20s instead of per message."""
+async def flush_stats():
+    """Background task: flush the stats aggregator every STATS_FLUSH_INTERVAL."""
     while True:
         try:
-            await asyncio.sleep(20)
-            await _flush_message_stats_once()
+            await asyncio.sleep(stats_aggregator.STATS_FLUSH_INTERVAL)
+            await persist_stats()
         except Exception as e:
-            logging.error(f"Error in flush_message_stats: {e}", exc_info=True)
+            logging.error(f"Error in flush_stats: {e}", exc_info=True)
+
 
+_dm_flush_lock = asyncio.Lock()
+
+async def persist_direct_messages():
+    """Write every queued direct message to the DB with insert_many, then ack
+    each one to its conversation and credit the senders' passport stats.
+    Raises (with the failed batch requeued) if a write fails."""
+    if db is None:
+        return
+    async with _dm_flush_lock:
+        while dm_outbox.has_pending():
+            batch = dm_outbox.take_batch()
+            try:
+                # insert_many adds _id to the dicts it is given
+                await db.direct_messages.insert_many([dict(m) for m in batch], ordered=False)
+            except BulkWriteError as e:
+                if not dm_outbox.only_duplicates(e.details):
+                    dm_outbox.requeue(batch)
+                    raise
+            except Exception:
+                dm_outbox.requeue(batch)
+                raise
+            dm_outbox.done(batch)
+            
+            for message in batch:
+                await sio.emit('direct_message_persisted', {
+                    'id': message['id'],
+                    'conversation_id': message['conversation_id'],
+                    'status': 'persisted'
+                }, room=f"direct_{message['conversation_id']}")
+                # Update passport stats for direct messages
+                stats_aggregator.record(message['from_user_id'], "messages_sent", 1)
+
+async def flush_direct_messages():
+    """Background task: drain the DM outbox every DM_FLUSH_INTERVAL, backing
+    off while writes are failing."""
+    failures = 0
+    while True:
+        try:
+            await asyncio.sleep(dm_outbox.retry_delay(failures) if failures else dm_outbox.FLUSH_INTERVAL)
+            await persist_direct_messages()
+            failures = 0
+        except Exception as e:
+            failures += 1
+            logging.error(f"Error persisting direct messages (attempt {failures}): {e}", exc_info=True)
+
+async def sweep_share_cards():
+    """Background task: keep the share-card disk cache within its limits."""
+    while True:
+        try:
+            removed = await asyncio.to_thread(share_cards.sweep)
+            if removed:
+                logging.info(f"Removed {removed} cached share cards")
+        except Exception as e:
+            logging.error(f"Error sweeping share cards: {e}", exc_info=True)
+        await asyncio.sleep(share_cards.SWEEP_INTERVAL)
 
 async def warm_catalog_cache():
     """
@@ -523,6 +1035,8 @@ async def warm_catalog_cache():
 @app.on_event("startup")
 async def startup_event():
     global db
+    # Open the shared outbound HTTP pool (CA bundle is parsed once, here)
+    http_client.get_client()
     try:
         # Initialize database connection with enhanced error handling
         logging.info("🚀 Initializing database connection...")
@@ -538,6 +1052,11 @@ async def startup_event():
             try:
                 await init_anime_db()
                 await initialize_passport_system()
+                await ensure_indexes()
+                await backfill_conversation_ids()
+                await load_trending_rooms()
+                if session_tokens.enabled():
+                    await sync_revoked_sessions()
                 logging.info("✅ Application data initialized successfully")
             except Exception as init_error:
                 logging.warning(f"⚠️ Application data initialization failed: {init_error}")
@@ -550,8 +1069,26 @@ async def startup_event():
         
         # Start background cleanup task (will handle db=None gracefully)
         asyncio.create_task(cleanup_expired_rooms())
-        # Start background task that batches message-stat DB writes
-        asyncio.create_task(flush_message_stats())
+        # Room deadlines load independently of the data initialization above
+        asyncio.create_task(prepare_room_expiry())
+        # Start background task that batches passport/arc stat DB writes
+        asyncio.create_task(flush_stats())
+        # Start the frame ticker for large episode rooms
+        asyncio.create_task(deliver_large_room_frames())
+        # Start the write-behind flusher for direct messages, after picking up
+        # anything a previous process spooled but never wrote
+        spooled = dm_outbox.load_spool()
+        if spooled:
+            logging.info(f"Recovered {spooled} spooled direct messages")
+        asyncio.create_task(flush_direct_messages())
+        # Rebuild leaderboards in the background (streams from MongoDB)
+        asyncio.create_task(load_leaderboards())
+        # Bound the rendered share-card cache on disk
+        if share_cards.available():
+            asyncio.create_task(sweep_share_cards())
+        # Keep signed-session revocations in sync across workers
+        if session_tokens.enabled():
+            asyncio.create_task(refresh_revoked_sessions())
         # Pre-warm the anime catalog cache so the first visitor after a
         # (cold) start gets instant catalog pages instead of waiting on Jikan.
         asyncio.create_task(warm_catalog_cache())
@@ -575,20 +1112,32 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean shutdown of database connections."""
+    try:
+        await persist_direct_messages()
+    except Exception as e:
+        logging.error(f"❌ Error persisting queued direct messages on shutdown: {e}")
+    try:
+        # Direct messages above may have added stats; both must land before
+        # the client closes
+        await persist_stats()
+    except Exception as e:
+        logging.error(f"❌ Error flushing stats on shutdown: {e}")
     try:
         logging.info("🔌 Closing database connection...")
         await close_database()
         logging.info("✅ Database connection closed successfully")
     except Exception as e:
         logging.error(f"❌ Error during shutdown: {e}")
-    try:
-        await _flush_message_stats_once()
-    except Exception as e:
-        logging.error(f"❌ Error flushing message stats on shutdown: {e}")
     try:
         await anime_catalog.close_client()
     except Exception as e:
         logging.error(f"❌ Error closing catalog client: {e}")
+    try:
+        await http_client.close_client()
+    except Exception as e:
+        logging.error(f"❌ Error closing HTTP client: {e}")
+    share_cards.close_pool()
+    dm_outbox.close_spool()
 
 # Calculate compatibility score
 def normalize_interests(interests: list) -> frozenset:
@@ -949,24 +1498,16 @@ async def create_session(response: Response, session_id: str):
     """Exchange session_id for user data and session_token"""
     global IN_MEMORY_MODE
     try:
-        # Call Emergent auth service with SSL certificate verification
-        import aiohttp
-        
-        # Create SSL context with certifi's CA bundle
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-        
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            async with session.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_id}
-            ) as resp:
-                if resp.status != 200:
-                    text = await resp.text()
-                    logging.error(f"Auth service returned {resp.status}: {text}")
-                    raise HTTPException(status_code=401, detail="Invalid or expired session")
-                
-                data = await resp.json()
+        # Call Emergent auth service over the shared (keep-alive) client
+        resp = await http_client.get_client().get(
+            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+            headers={"X-Session-ID": session_id}
+        )
+        if resp.status_code != 200:
+            logging.error(f"Auth service returned {resp.status_code}: {resp.text}")
+            raise HTTPException(status_code=401, detail="Invalid or expired session")
+        
+        data = resp.json()
         
         logging.info(f"OAuth data received for: {data.get('email')}")
         
@@ -1024,6 +1565,8 @@ async def create_session(response: Response, session_id: str):
         # Create session
         session_token = data["session_token"]
         expires_at = datetime.now(timezone.utc) + timedelta(days=7)
+        if session_tokens.enabled():
+            session_token = session_tokens.issue(user.id, expires_at.timestamp())
         
         if db_available:
             session_obj = UserSession(
@@ -1036,6 +1579,7 @@ async def create_session(response: Response, session_id: str):
             session_dict['created_at'] = session_dict['created_at'].isoformat()
             
             await db.user_sessions.insert_one(session_dict)
+            session_cache.invalidate(session_token)
         else:
             # Store session in memory
             IN_MEMORY_SESSIONS[session_token] = {
@@ -1075,15 +1619,12 @@ async def create_session(response: Response, session_id: str):
 
 @api_router.get("/auth/me")
 async def get_me(request: Request):
-    logging.info(f"Auth/me called - Cookies: {dict(request.cookies)}")
-    logging.info(f"Auth/me called - Headers: {dict(request.headers)}")
-    
     user = await get_current_user(request)
     if not user:
-        logging.warning("No user found in auth/me endpoint")
+        log_event("auth_me", "auth/me: not authenticated")
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    logging.info(f"User authenticated: {user.email}")
+    log_event("auth_me", "auth/me: %s", user.id)
     return user.dict()
 
 @api_router.post("/auth/logout")
@@ -1091,6 +1632,16 @@ async def logout(request: Request, response: Response):
     session_token = request.cookies.get('session_token')
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        session_cache.invalidate(session_token)
+        # Signed tokens stay verifiable until they expire, so revoke them
+        claims = session_tokens.decode(session_token)
+        if claims:
+            session_tokens.revoke(claims['sid'], claims['exp'])
+            await db.revoked_sessions.insert_one({
+                "session_id": claims['sid'],
+                "expires_at_dt": datetime.fromtimestamp(claims['exp'], tz=timezone.utc),
+                "revoked_at": datetime.now(timezone.utc).isoformat()
+            })
     
     response.delete_cookie("session_token", path="/")
     return {"message": "Logged out"}
@@ -1158,6 +1709,7 @@ async def migrate_anonymous_account(request: Request):
 
     if merged_update:
         await db.users.update_one({"id": new_id}, {"$set": merged_update})
+        user_profiles.invalidate(new_id)
         summary["interests_merged"] = True
 
     # If the anon user was never persisted, there is no social graph to move.
@@ -1187,6 +1739,8 @@ async def migrate_anonymous_account(request: Request):
             seen_pairs.add(other)
     if dupes:
         await db.friendships.delete_many({"id": {"$in": dupes}})
+    friend_graph.forget_user(anon_id)
+    friend_graph.forget_user(new_id)
 
     # 3) Re-point friend requests (incoming + outgoing).
     fr1 = await db.friend_requests.update_many({"from_user_id": anon_id}, {"$set": {"from_user_id": new_id}})
@@ -1195,16 +1749,34 @@ async def migrate_anonymous_account(request: Request):
     # Drop any request that became a self-request.
     await db.friend_requests.delete_many({"from_user_id": new_id, "to_user_id": new_id})
 
+    # Re-point queued messages too (waiting out a batch that is mid-write)
+    async with _dm_flush_lock:
+        dm_outbox.rename_user(anon_id, new_id)
     # 4) Re-point direct-message history.
     m1 = await db.direct_messages.update_many({"from_user_id": anon_id}, {"$set": {"from_user_id": new_id}})
     m2 = await db.direct_messages.update_many({"to_user_id": anon_id}, {"$set": {"to_user_id": new_id}})
     summary["messages"] = (m1.modified_count or 0) + (m2.modified_count or 0)
+    if summary["messages"]:
+        await db.direct_messages.update_many(
+            {"$or": [{"from_user_id": new_id}, {"to_user_id": new_id}]},
+            conversations.CONVERSATION_ID_PIPELINE
+        )
+    # Queued messages were re-pointed even if no stored ones were
+    unread_counts.forget_user(anon_id)
+    unread_counts.forget_user(new_id)
 
     # 5) Clean up the throwaway anonymous records.
     await db.users.delete_one({"id": anon_id})
+    user_profiles.invalidate(anon_id)
     await db.user_arcs.delete_many({"user_id": anon_id})
+    arc_state.forget_user(anon_id)
+    stats_aggregator.forget_user(anon_id)
     await db.passport_stats.delete_many({"user_id": anon_id})
     await db.passport_journeys.delete_many({"user_id": anon_id})
+    await db.passport_views.delete_many({"user_id": anon_id})
+    leaderboards.forget_user(anon_id)
+    await mark_passport_view_stale(new_id)
+    badge_engine.forget_user(anon_id)
 
     logging.info(f"✅ Migrated anonymous account {anon_id} -> {new_id}: {summary}")
     return {"message": "Account data migrated", "migrated": True, "summary": summary}
@@ -1241,6 +1813,7 @@ async def update_profile(profile: ProfileUpdate, request: Request):
     
     if update_data:
         await db.users.update_one({"id": user.id}, {"$set": update_data})
+        user_profiles.invalidate(user.id)
     
     updated_user = await db.users.find_one({"id": user.id}, {"_id": 0})
     return User(**updated_user).dict()
@@ -1271,24 +1844,12 @@ async def get_friends(request: Request):
     else:
         logging.info(f"✅ Authenticated user requesting friends: {user.name} ({user.id})")
     
-    friendships = await db.friendships.find(
-        {"$or": [{"user1_id": user.id}, {"user2_id": user.id}]},
-        {"_id": 0}
-    ).to_list(100)
+    friend_ids = await get_friend_ids(user.id)
     
-    logging.info(f"💬 Found {len(friendships)} friendships for {user.name}")
+    logging.info(f"💬 Found {len(friend_ids)} friends for {user.name}")
     
-    # Use a set to avoid duplicate friend IDs
-    friend_ids = set()
-    for f in friendships:
-        friend_id = f['user2_id'] if f['user1_id'] == user.id else f['user1_id']
-        friend_ids.add(friend_id)
-    
-    friends = []
-    for friend_id in friend_ids:
-        friend_doc = await db.users.find_one({"id": friend_id}, {"_id": 0})
-        if friend_doc:
-            friends.append(User(**friend_doc).dict())
+    friend_docs = await hydrate_users(friend_ids)
+    friends = [User(**friend_docs[friend_id]).dict() for friend_id in friend_ids if friend_id in friend_docs]
     
     logging.info(f"✅ Returning {len(friends)} friends for {user.name}")
     return friends
@@ -1365,6 +1926,7 @@ async def send_friend_request(to_user_id: str, request: Request):
                         {"id": user_id},
                         {"$set": user_dict}
                     )
+                    user_profiles.invalidate(user_id)
                     logging.info(f"✅ Updated user in DB: {user_data.get('name')} (ID: {user_id})")
                 
                 # Create a User object for validation
@@ -1391,14 +1953,7 @@ async def send_friend_request(to_user_id: str, request: Request):
             raise HTTPException(status_code=403, detail="This user isn't accepting friend requests")
         
         # Check if already friends
-        existing = await db.friendships.find_one({
-            "$or": [
-                {"user1_id": user.id, "user2_id": to_user_id},
-                {"user1_id": to_user_id, "user2_id": user.id}
-            ]
-        })
-        
-        if existing:
+        if await are_friends(user.id, to_user_id):
             raise HTTPException(status_code=400, detail="Already friends")
         
         # Check if request already exists (bidirectional)
@@ -1494,9 +2049,10 @@ async def get_friend_requests(request: Request):
     
     logging.info(f"📥 Found {len(requests)} pending friend requests for {user.name}")
     
+    from_users = await hydrate_users(req['from_user_id'] for req in requests)
     result = []
     for req in requests:
-        from_user_doc = await db.users.find_one({"id": req['from_user_id']}, {"_id": 0})
+        from_user_doc = from_users.get(req['from_user_id'])
         if from_user_doc:
             result.append({
                 "request": req,
@@ -1526,9 +2082,10 @@ async def get_sent_friend_requests(request: Request):
         {"_id": 0}
     ).to_list(50)
 
+    to_users = await hydrate_users(req['to_user_id'] for req in requests)
     result = []
     for req in requests:
-        to_user_doc = await db.users.find_one({"id": req['to_user_id']}, {"_id": 0})
+        to_user_doc = to_users.get(req['to_user_id'])
         # Keep a flat shape that includes to_user_id so the client can match easily
         entry = dict(req)
         if to_user_doc:
@@ -1607,23 +2164,24 @@ async def accept_friend_request(request_id: str, request: Request):
     friend_dict = friendship.dict()
     friend_dict['created_at'] = friend_dict['created_at'].isoformat()
     await db.friendships.insert_one(friend_dict)
+    friend_graph.add_edge(friend_request['from_user_id'], user.id)
     
-    # Update arc progression for both users
-    await update_user_stats(user.id, "friends_count", 1)
-    await update_user_stats(friend_request['from_user_id'], "friends_count", 1)
-    
-    # Update passport stats for both users
-    await update_passport_stats(user.id, {"total_friends": 1, "successful_matches": 1})
-    await update_passport_stats(friend_request['from_user_id'], {"total_friends": 1, "successful_matches": 1})
+    # Update arc progression and passport stats for both users
+    for uid in [user.id, friend_request['from_user_id']]:
+        stats_aggregator.record(uid, "friends_count", 1, stats_aggregator.ARC)
+        stats_aggregator.record(uid, "total_friends", 1)
+        stats_aggregator.record(uid, "successful_matches", 1)
     
     # Update passport journey milestones
     for uid in [user.id, friend_request['from_user_id']]:
         journey = await db.passport_journeys.find_one({"user_id": uid}, {"_id": 0})
         if journey and not journey.get('first_friend_date'):
+            first_friend_date = datetime.now(timezone.utc).isoformat()
             await db.passport_journeys.update_one(
                 {"user_id": uid},
-                {"$set": {"first_friend_date": datetime.now(timezone.utc).isoformat()}}
+                {"$set": {"first_friend_date": first_friend_date}}
             )
+            await update_passport_view(uid, {"$set": {"journey.first_friend_date": first_friend_date}})
     
     # Send real-time notification to the requester that their request was accepted
     requester_id = friend_request['from_user_id']
@@ -1776,14 +2334,18 @@ async def cleanup_duplicate_requests(request: Request):
     for self_friendship in self_friendships:
         await db.friendships.delete_one({"id": self_friendship["id"]})
         self_friendship_count += 1
+    if self_friendship_count:
+        friend_graph.clear()
     
     return {
         "message": f"Cleaned up {removed_count} duplicate friend requests, {friendship_removed_count} duplicate friendships, and {self_friendship_count} self-friendships"
     }
 
 @api_router.get("/chat/history/{friend_id}")
-async def get_chat_history(friend_id: str, request: Request):
-    logging.info(f"🔵 Get chat history endpoint called: friend_id={friend_id}")
+async def get_chat_history(friend_id: str, request: Request, limit: int = 100,
+                           before: Optional[str] = None, before_id: Optional[str] = None,
+                           after: Optional[str] = None, after_id: Optional[str] = None):
+    logging.debug("🔵 Get chat history endpoint called: friend_id=%s", friend_id)
     
     # Try to get authenticated user
     user = await get_current_user(request)
@@ -1803,29 +2365,20 @@ async def get_chat_history(friend_id: str, request: Request):
             raise HTTPException(status_code=404, detail="User not found")
         
         user = User(**user_doc)
-        logging.info(f"✅ Anonymous user requesting chat history: {user.name} ({user.id})")
+        logging.debug("✅ Anonymous user requesting chat history: %s (%s)", user.name, user.id)
     else:
-        logging.info(f"✅ Authenticated user requesting chat history: {user.name} ({user.id})")
+        logging.debug("✅ Authenticated user requesting chat history: %s (%s)", user.name, user.id)
     
     # Verify friendship exists - only friends can access chat history
-    friendship = await db.friendships.find_one({
-        "$or": [
-            {"user1_id": user.id, "user2_id": friend_id},
-            {"user1_id": friend_id, "user2_id": user.id}
-        ]
-    })
-    
-    if not friendship:
+    if not await are_friends(user.id, friend_id):
         raise HTTPException(status_code=403, detail="Not friends with this user")
     
-    # Get direct messages between these two users from the correct collection
-    messages = await db.direct_messages.find(
-        {"$or": [
-            {"from_user_id": user.id, "to_user_id": friend_id},
-            {"from_user_id": friend_id, "to_user_id": user.id}
-        ]},
-        {"_id": 0}
-    ).sort("timestamp", 1).limit(100).to_list(100)
+    # Get direct messages between these two users (newest page unless a
+    # before/after cursor is given), oldest first
+    limit = max(1, min(limit, 200))
+    messages = await fetch_conversation_page(
+        user.id, friend_id, limit, before, before_id, after, after_id
+    )
     
     # Get friend info for message display
     friend = await db.users.find_one({"id": friend_id}, {"_id": 0, "name": 1, "picture": 1})
@@ -1848,22 +2401,12 @@ async def get_trending_rooms(request: Request):
     if not user:
         raise HTTPException(status_code=401)
     
-    # Get active rooms (not expired)
-    now = datetime.now(timezone.utc)
-    rooms = await db.episode_rooms.find(
-        {"expires_at": {"$gt": now.isoformat()}},
-        {"_id": 0}
-    ).sort("active_users_count", -1).limit(20).to_list(20)
-    
-    # Get anime info for each room
-    result = []
-    for room in rooms:
-        anime = await db.anime_data.find_one({"id": room['anime_id']}, {"_id": 0})
-        if anime:
-            room['anime_info'] = anime
-            result.append(room)
+    # Served from the in-memory leaderboard; it is seeded once and then kept
+    # current by room creation, joins/leaves and messages.
+    if not trending_rooms.is_loaded():
+        await load_trending_rooms()
     
-    return result
+    return trending_rooms.top(20)
 
 @api_router.post("/episode-rooms/create")
 async def create_episode_room(anime_id: str, episode_number: int, request: Request):
@@ -1881,7 +2424,7 @@ async def create_episode_room(anime_id: str, episode_number: int, request: Reque
         "anime_id": anime_id,
         "episode_number": episode_number,
         "expires_at": {"$gt": datetime.now(timezone.utc).isoformat()}
-    })
+    }, {"_id": 0, "expires_at_dt": 0})
     
     if existing:
         return {"room": existing, "created": False}
@@ -1902,7 +2445,13 @@ async def create_episode_room(anime_id: str, episode_number: int, request: Reque
     room_dict['created_at'] = room_dict['created_at'].isoformat()
     room_dict['expires_at'] = room_dict['expires_at'].isoformat()
     
-    await db.episode_rooms.insert_one(room_dict)
+    # expires_at_dt is the native datetime twin of expires_at for the TTL index
+    await db.episode_rooms.insert_one({**room_dict, "expires_at_dt": room.expires_at})
+    room_expiry.schedule(room.id, room.expires_at)
+    
+    # A brand-new room has no history, so its buffer is complete as-is
+    room_messages.seed(room.id, [])
+    trending_rooms.upsert_room(room_dict, anime)
     
     # Track daily stat for room creation
     await track_daily_stat(user.id, "episode_room_created")
@@ -1915,7 +2464,7 @@ async def get_room_details(room_id: str, request: Request):
     if not user:
         raise HTTPException(status_code=401)
     
-    room = await db.episode_rooms.find_one({"id": room_id}, {"_id": 0})
+    room = await db.episode_rooms.find_one({"id": room_id}, {"_id": 0, "expires_at_dt": 0})
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
@@ -1931,21 +2480,50 @@ async def get_room_details(room_id: str, request: Request):
     return room
 
 @api_router.get("/episode-rooms/{room_id}/messages")
-async def get_room_messages(room_id: str, request: Request, limit: int = 50):
+async def get_room_messages(room_id: str, request: Request, limit: int = 50,
+                            before: Optional[str] = None, before_id: Optional[str] = None):
+    """Newest ``limit`` messages (oldest first). Pass the timestamp/id of the
+    oldest message already shown as ``before``/``before_id`` to page back."""
     user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401)
     
-    messages = await db.episode_room_messages.find(
-        {"room_id": room_id},
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(limit).to_list(limit)
+    limit = max(1, min(limit, 200))
     
-    return list(reversed(messages))
+    if before:
+        query = room_messages.build_before_query(room_id, before, before_id)
+        messages = await db.episode_room_messages.find(
+            query,
+            {"_id": 0}
+        ).sort([("timestamp", -1), ("id", -1)]).limit(limit).to_list(limit)
+        return list(reversed(messages))
+    
+    # First load: serve the tail from memory when the room is buffered
+    cached = room_messages.recent(room_id, limit)
+    if cached is not None:
+        return cached
+    
+    fetch = max(limit, room_messages.ROOM_BUFFER_SIZE)
+    # Messages sent while the query runs are held for the seed to merge
+    room_messages.begin_seed(room_id)
+    try:
+        messages = await db.episode_room_messages.find(
+            {"room_id": room_id},
+            {"_id": 0}
+        ).sort([("timestamp", -1), ("id", -1)]).limit(fetch).to_list(fetch)
+        messages.reverse()
+        room_messages.seed(room_id, messages)
+    finally:
+        room_messages.end_seed(room_id)
+    
+    cached = room_messages.recent(room_id, limit)
+    return cached if cached is not None else messages[-limit:]
 
 @api_router.get("/direct-messages/{friend_id}")
-async def get_direct_messages(friend_id: str, request: Request, limit: int = 50):
-    logging.info(f"🔵 Get direct messages endpoint called: friend_id={friend_id}")
+async def get_direct_messages(friend_id: str, request: Request, limit: int = 50,
+                              before: Optional[str] = None, before_id: Optional[str] = None,
+                              after: Optional[str] = None, after_id: Optional[str] = None):
+    logging.debug("🔵 Get direct messages endpoint called: friend_id=%s", friend_id)
     
     # Try to get authenticated user
     user = await get_current_user(request)
@@ -1965,31 +2543,19 @@ async def get_direct_messages(friend_id: str, request: Request, limit: int = 50)
             raise HTTPException(status_code=404, detail="User not found")
         
         user = User(**user_doc)
-        logging.info(f"✅ Anonymous user requesting direct messages: {user.name} ({user.id})")
+        logging.debug("✅ Anonymous user requesting direct messages: %s (%s)", user.name, user.id)
     else:
-        logging.info(f"✅ Authenticated user requesting direct messages: {user.name} ({user.id})")
+        logging.debug("✅ Authenticated user requesting direct messages: %s (%s)", user.name, user.id)
     
     # Verify friendship exists
-    friendship = await db.friendships.find_one({
-        "$or": [
-            {"user1_id": user.id, "user2_id": friend_id},
-            {"user1_id": friend_id, "user2_id": user.id}
-        ]
-    })
-    
-    if not friendship:
+    if not await are_friends(user.id, friend_id):
         raise HTTPException(status_code=403, detail="Not friends with this user")
     
-    # Get direct messages between these two users
-    messages = await db.direct_messages.find(
-        {
-            "$or": [
-                {"from_user_id": user.id, "to_user_id": friend_id},
-                {"from_user_id": friend_id, "to_user_id": user.id}
-            ]
-        },
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(limit).to_list(limit)
+    # Get direct messages between these two users, oldest first
+    limit = max(1, min(limit, 200))
+    messages = await fetch_conversation_page(
+        user.id, friend_id, limit, before, before_id, after, after_id
+    )
     
     # Get friend info for message display
     friend = await db.users.find_one({"id": friend_id}, {"_id": 0, "name": 1, "picture": 1})
@@ -2004,13 +2570,13 @@ async def get_direct_messages(friend_id: str, request: Request, limit: int = 50)
             message['from_user_picture'] = friend.get('picture') if friend else None
     
     return {
-        'messages': list(reversed(messages)),
+        'messages': messages,
         'friend': friend
     }
 
 @api_router.get("/unread-counts")
 async def get_unread_counts(request: Request):
-    logging.info("🔵 Get unread counts endpoint called")
+    logging.debug("🔵 Get unread counts endpoint called")
     
     # Try to get authenticated user
     user = await get_current_user(request)
@@ -2030,53 +2596,41 @@ async def get_unread_counts(request: Request):
             raise HTTPException(status_code=404, detail="User not found")
         
         user = User(**user_doc)
-        logging.info(f"✅ Anonymous user requesting unread counts: {user.name} ({user.id})")
+        logging.debug("✅ Anonymous user requesting unread counts: %s (%s)", user.name, user.id)
     else:
-        logging.info(f"✅ Authenticated user requesting unread counts: {user.name} ({user.id})")
+        logging.debug("✅ Authenticated user requesting unread counts: %s (%s)", user.name, user.id)
     
-    # Get all friends
-    friendships = await db.friendships.find({
-        "$or": [
-            {"user1_id": user.id},
-            {"user2_id": user.id}
-        ]
-    }).to_list(None)
-    
-    unread_counts = {}
+    # Unread counts by sender (senders with nothing unread are omitted).
+    # Served from memory once loaded; the first request runs one aggregation.
+    counts = unread_counts.get(user.id)
+    if counts is None:
+        loaded_version = unread_counts.version(user.id)
+        pending = dm_outbox.unread_to(user.id)
+        rows = await db.direct_messages.aggregate(
+            unread_counts.aggregation_pipeline(user.id, [message['id'] for message in pending])
+        ).to_list(None)
+        counts = unread_counts.load(user.id, rows, pending, loaded_version)
     
-    for friendship in friendships:
-        # Determine friend ID
-        friend_id = friendship['user2_id'] if friendship['user1_id'] == user.id else friendship['user1_id']
-        
-        # Count unread messages from this friend to current user
-        unread_count = await db.direct_messages.count_documents({
-            "from_user_id": friend_id,
-            "to_user_id": user.id,
-            "read": False
-        })
-        
-        unread_counts[friend_id] = unread_count
-    
-    return unread_counts
+    return counts
 
 @api_router.post("/mark-messages-read/{friend_id}")
 async def mark_messages_read(friend_id: str, request: Request):
-    logging.info(f"🔵 Mark messages read endpoint called: friend_id={friend_id}")
+    logging.debug("🔵 Mark messages read endpoint called: friend_id=%s", friend_id)
     
     # Read request body first
     body = None
     try:
         body = await request.json()
-        logging.info(f"📝 Request body received: {json.dumps(body, default=str)[:200]}")
+        logging.debug("📝 Request body received: %.200s", body)
     except Exception as e:
-        logging.info(f"ℹ️ No JSON body in request: {e}")
+        logging.debug("ℹ️ No JSON body in request: %s", e)
     
     # Try to get authenticated user
     user = await get_current_user(request)
     
     # If no authenticated user, check for anonymous user data in request body
     if not user:
-        logging.info("🟡 No authenticated user, checking request body for anonymous user...")
+        logging.debug("🟡 No authenticated user, checking request body for anonymous user...")
         
         if not body:
             logging.error("❌ No request body and no authenticated user")
@@ -2094,21 +2648,18 @@ async def mark_messages_read(friend_id: str, request: Request):
             raise HTTPException(status_code=404, detail="User not found")
         
         user = User(**user_data)
-        logging.info(f"✅ Anonymous user authenticated for mark read: {user.name}")
+        logging.debug("✅ Anonymous user authenticated for mark read: %s", user.name)
     else:
-        logging.info(f"✅ Authenticated user marking messages read: {user.name}")
+        logging.debug("✅ Authenticated user marking messages read: %s", user.name)
     
     # Verify friendship exists
-    friendship = await db.friendships.find_one({
-        "$or": [
-            {"user1_id": user.id, "user2_id": friend_id},
-            {"user1_id": friend_id, "user2_id": user.id}
-        ]
-    })
-    
-    if not friendship:
+    if not await are_friends(user.id, friend_id):
         raise HTTPException(status_code=403, detail="Not friends with this user")
     
+    # Queued messages are marked in the outbox; the lock waits out a batch
+    # that is mid-write so it is covered by the update below
+    async with _dm_flush_lock:
+        dm_outbox.mark_read(friend_id, user.id)
     # Mark all messages from friend to user as read
     result = await db.direct_messages.update_many(
         {
@@ -2118,6 +2669,7 @@ async def mark_messages_read(friend_id: str, request: Request):
         },
         {"$set": {"read": True}}
     )
+    unread_counts.clear(user.id, friend_id)
     
     return {"marked_read": result.modified_count}
 
@@ -2148,14 +2700,7 @@ async def check_friendship(user_id: str, request: Request):
         logging.info(f"✅ Authenticated user checking friendship: {user.name} ({user.id})")
     
     # Check if friendship exists
-    friendship = await db.friendships.find_one({
-        "$or": [
-            {"user1_id": user.id, "user2_id": user_id},
-            {"user1_id": user_id, "user2_id": user.id}
-        ]
-    })
-    
-    return {"is_friend": friendship is not None}
+    return {"is_friend": await are_friends(user.id, user_id)}
 
 @api_router.post("/user/episode-progress")
 async def update_episode_progress(anime_id: str, episode_number: int, request: Request):
@@ -2255,8 +2800,23 @@ PREMIUM_FEATURES = {
 
 # Premium Helper Functions
 async def get_user_premium_status(user_id: str) -> dict:
-    """Get user's premium status and features"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    """Get user's premium status and features (cached until the
+    subscription expires, see entitlements)"""
+    premium_status = entitlements.get(user_id)
+    if premium_status is None:
+        loaded_version = entitlements.version(user_id)
+        premium_status = await load_user_premium_status(user_id)
+        subscription = premium_status.get("subscription")
+        expires_at = (
+            datetime.fromisoformat(subscription["expires_at"].replace('Z', '+00:00')).timestamp()
+            if subscription else None
+        )
+        entitlements.store(user_id, premium_status, loaded_version, expires_at)
+    return premium_status
+
+async def load_user_premium_status(user_id: str) -> dict:
+    """Read user's premium status and features from the database"""
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "premium": 1})
     if not user:
         return {"is_premium": False, "features": PREMIUM_FEATURES["free"]}
     
@@ -2268,13 +2828,14 @@ async def get_user_premium_status(user_id: str) -> dict:
             "user_id": user_id,
             "status": "active",
             "expires_at": {"$gt": datetime.now(timezone.utc).isoformat()}
-        })
+        }, {"_id": 0})
         
         if subscription:
             return {"is_premium": True, "features": PREMIUM_FEATURES["premium"], "subscription": subscription}
         else:
             # Subscription expired, update user
             await db.users.update_one({"id": user_id}, {"$set": {"premium": False}})
+            user_profiles.invalidate(user_id)
             return {"is_premium": False, "features": PREMIUM_FEATURES["free"]}
     
     return {"is_premium": False, "features": PREMIUM_FEATURES["free"]}
@@ -2297,17 +2858,29 @@ async def check_premium_limit(user_id: str, feature: str, current_count: int = 0
 
 async def track_daily_stat(user_id: str, action: str):
     """Track daily user statistics for premium limits"""
-    today = datetime.now(timezone.utc).date()
-    stat = UserDailyStats(
-        user_id=user_id,
-        date=today.isoformat(),
-        action=action
+    today = daily_counters.today()
+    await db.user_daily_counters.update_one(
+        {"user_id": user_id, "date": today},
+        {
+            "$inc": {f"counts.{action}": 1},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        },
+        upsert=True
     )
-    
-    stat_dict = stat.dict()
-    stat_dict['timestamp'] = stat_dict['timestamp'].isoformat()
-    
-    await db.user_daily_stats.insert_one(stat_dict)
+    # After the write, so a concurrent load that missed it isn't cached
+    daily_counters.increment(user_id, today, action)
+
+async def get_daily_count(user_id: str, action: str) -> int:
+    """How many times the user did ``action`` today (UTC)"""
+    today = daily_counters.today()
+    counts = daily_counters.get(user_id, today)
+    if counts is None:
+        loaded_version = daily_counters.version(user_id)
+        doc = await db.user_daily_counters.find_one(
+            {"user_id": user_id, "date": today}, {"_id": 0, "counts": 1}
+        )
+        counts = daily_counters.store(user_id, today, (doc or {}).get("counts", {}), loaded_version)
+    return counts.get(action, 0)
 
 # Premium API Endpoints
 @api_router.get("/premium/status")
@@ -2352,6 +2925,8 @@ async def upgrade_to_premium(plan_type: str = "premium", request: Request = None
     
     # Update user premium status
     await db.users.update_one({"id": user.id}, {"$set": {"premium": True}})
+    user_profiles.invalidate(user.id)
+    entitlements.invalidate(user.id)
     
     return {"message": "Successfully upgraded to premium!", "subscription": sub_dict}
 
@@ -2376,6 +2951,7 @@ async def cancel_premium(request: Request):
         {"id": subscription["id"]},
         {"$set": {"status": "cancelled"}}
     )
+    entitlements.invalidate(user.id)
     
     return {"message": "Premium subscription cancelled. You'll retain premium features until your current billing period ends."}
 
@@ -2391,148 +2967,38 @@ async def initialize_user_arc(user_id: str):
     await db.user_arcs.insert_one(arc_dict)
     return arc_dict
 
-async def update_user_stats(user_id: str, stat_type: str, increment: int = 1):
-    """Update user stats and check for arc progression"""
-    # Update stats
+async def load_arc_states(user_ids: list) -> dict:
+    """In-memory arc states for these users, loading uncached ones from
+    user_arcs in a single query"""
+    states = {user_id: arc_state.get(user_id) for user_id in user_ids}
+    missing = [user_id for user_id, state in states.items() if state is None]
+    if missing:
+        docs = await db.user_arcs.find({"user_id": {"$in": missing}}, {"_id": 0}).to_list(None)
+        found = {doc['user_id']: doc for doc in docs}
+        for user_id in missing:
+            states[user_id] = arc_state.load(user_id, found.get(user_id) or UserArc(user_id=user_id).dict())
+    return states
+
+async def persist_arc_transition(user_id: str, state: dict, arc_history_entry: dict):
+    """Record a phase change made in memory and announce it"""
+    new_arc = state["current_arc"]
+    new_phase = state["current_phase"]
     await db.user_arcs.update_one(
         {"user_id": user_id},
         {
-            "$inc": {f"stats.{stat_type}": increment},
-            "$set": {"last_updated": datetime.now(timezone.utc)}
+            "$set": {
+                "current_arc": new_arc,
+                "current_phase": new_phase,
+                "arc_progress": 0,
+                "last_updated": datetime.now(timezone.utc)
+            },
+            "$push": {"arc_history": arc_history_entry}
         },
         upsert=True
-    )
-    
-    # Check for arc progression
-    await check_arc_progression(user_id)
-
-async def check_arc_progression(user_id: str):
-    """Check if user should progress to next arc based on milestones"""
-    user_arc = await db.user_arcs.find_one({"user_id": user_id})
-    if not user_arc:
-        await initialize_user_arc(user_id)
-        return
-    
-    stats = user_arc.get("stats", {})
-    current_phase = user_arc.get("current_phase", "prologue")
-    
-    # Check for Redemption Arc (returning after 7+ days)
-    await check_redemption_arc(user_id, user_arc)
-    
-    # Define anime-style arc progression logic
-    arc_progressions = [
-        {
-            "phase": "prologue",
-            "next_arc": "⚡ Connection Arc: First Match Found",
-            "next_phase": "connection",
-            "condition": stats.get("matches_completed", 0) >= 1,
-            "milestone": "first_match"
-        },
-        {
-            "phase": "connection",
-            "next_arc": "🔥 Rising Bond Arc: 100 Messages Shared",
-            "next_phase": "rising_bond",
-            "condition": stats.get("messages_sent", 0) >= 100,
-            "milestone": "chatty_character"
-        },
-        {
-            "phase": "rising_bond",
-            "next_arc": "🌟 Adventure Arc: Episode Rooms Explorer",
-            "next_phase": "adventure",
-            "condition": stats.get("episode_rooms_joined", 0) >= 5,
-            "milestone": "room_explorer"
-        },
-        {
-            "phase": "adventure",
-            "next_arc": "👑 Power Arc: Social Butterfly",
-            "next_phase": "power",
-            "condition": stats.get("friends_count", 0) >= 3 and stats.get("messages_sent", 0) >= 250,
-            "milestone": "social_butterfly"
-        },
-        {
-            "phase": "power",
-            "next_arc": "🌙 Eclipse Arc: Master Connector",
-            "next_phase": "eclipse",
-            "condition": stats.get("friends_count", 0) >= 10 and stats.get("episode_rooms_joined", 0) >= 20,
-            "milestone": "master_connector"
-        }
-    ]
-    
-    # Check for progression
-    for progression in arc_progressions:
-        if current_phase == progression["phase"] and progression["condition"]:
-            # Update to next arc
-            arc_history_entry = {
-                "arc": user_arc.get("current_arc"),
-                "phase": current_phase,
-                "achieved_at": datetime.now(timezone.utc).isoformat(),
-                "stats_at_time": stats.copy(),
-                "milestone": progression["milestone"]
-            }
-            
-            await db.user_arcs.update_one(
-                {"user_id": user_id},
-                {
-                    "$set": {
-                        "current_arc": progression["next_arc"],
-                        "current_phase": progression["next_phase"],
-                        "arc_progress": 0,
-                        "last_updated": datetime.now(timezone.utc)
-                    },
-                    "$push": {"arc_history": arc_history_entry}
-                }
-            )
-            
-            # Emit arc progression event to all user's active connections
-            await emit_arc_progression(user_id, progression["next_arc"], progression["next_phase"])
-            
-            break
-
-async def check_redemption_arc(user_id: str, user_arc: dict):
-    """Check if user qualifies for Redemption Arc (returned after 7+ days)"""
-    last_updated = user_arc.get("last_updated")
-    if not last_updated:
-        return
-    
-    # Convert to datetime if it's a string
-    if isinstance(last_updated, str):
-        last_updated = datetime.fromisoformat(last_updated.replace('Z', '+00:00'))
-    
-    # Ensure last_updated is timezone-aware
-    if last_updated.tzinfo is None:
-        last_updated = last_updated.replace(tzinfo=timezone.utc)
-    
-    # Check if user was away for 7+ days and is now active
-    days_away = (datetime.now(timezone.utc) - last_updated).days
-    current_phase = user_arc.get("current_phase", "prologue")
-    
-    # Only trigger redemption arc if they were away for 7+ days and have progressed beyond prologue
-    if days_away >= 7 and current_phase != "prologue" and current_phase != "redemption":
-        # Update to Redemption Arc
-        arc_history_entry = {
-            "arc": user_arc.get("current_arc"),
-            "phase": current_phase,
-            "achieved_at": datetime.now(timezone.utc).isoformat(),
-            "stats_at_time": user_arc.get("stats", {}),
-            "milestone": "redemption_return",
-            "days_away": days_away
-        }
-        
-        await db.user_arcs.update_one(
-            {"user_id": user_id},
-            {
-                "$set": {
-                    "current_arc": f"🌅 Redemption Arc: Returned After {days_away} Days",
-                    "current_phase": "redemption",
-                    "arc_progress": 0,
-                    "last_updated": datetime.now(timezone.utc)
-                },
-                "$push": {"arc_history": arc_history_entry}
-            }
-        )
-        
-        # Emit redemption arc progression
-        await emit_arc_progression(user_id, f"🌅 Redemption Arc: Returned After {days_away} Days", "redemption")
+    )
+    
+    # Emit arc progression event to all user's active connections
+    await emit_arc_progression(user_id, new_arc, new_phase)
 
 async def emit_arc_progression(user_id: str, new_arc: str, phase: str):
     """Emit arc progression to all user's active connections"""
@@ -2566,6 +3032,8 @@ async def get_user_arc(request: Request):
     user_arc = await db.user_arcs.find_one({"user_id": user.id}, {"_id": 0})
     if not user_arc:
         user_arc = await initialize_user_arc(user.id)
+    user_arc = arc_state.overlay(user.id, user_arc)
+    user_arc["stats"] = stats_aggregator.overlay(user.id, user_arc.get("stats") or {}, stats_aggregator.ARC)
     
     return user_arc
 
@@ -2579,6 +3047,8 @@ async def get_arc_milestones(request: Request):
     user_arc = await db.user_arcs.find_one({"user_id": user.id}, {"_id": 0})
     if not user_arc:
         user_arc = await initialize_user_arc(user.id)
+    user_arc = arc_state.overlay(user.id, user_arc)
+    user_arc["stats"] = stats_aggregator.overlay(user.id, user_arc.get("stats") or {}, stats_aggregator.ARC)
     
     stats = user_arc.get("stats", {})
     current_phase = user_arc.get("current_phase", "prologue")
@@ -2661,14 +3131,32 @@ async def get_arc_milestones(request: Request):
         "arc_history": user_arc.get("arc_history", [])
     }
 
-# Passport System API Endpoints
-@api_router.get("/passport")
-async def get_user_passport(request: Request):
-    """Get user's anime passport"""
-    user = await get_current_user(request)
-    if not user:
-        raise HTTPException(status_code=401)
-    
+async def get_or_create_journey(user: User) -> dict:
+    """User's passport journey, created on first use"""
+    journey = await db.passport_journeys.find_one({"user_id": user.id}, {"_id": 0})
+    if not journey:
+        journey_obj = PassportJourney(
+            user_id=user.id,
+            joined_date=user.created_at if hasattr(user, 'created_at') else datetime.now(timezone.utc)
+        )
+        journey_dict = journey_obj.dict()
+        journey_dict['joined_date'] = journey_dict['joined_date'].isoformat() if isinstance(journey_dict['joined_date'], datetime) else journey_dict['joined_date']
+        journey_dict['created_at'] = journey_dict['created_at'].isoformat()
+        journey_dict['last_updated'] = journey_dict['last_updated'].isoformat()
+        
+        # Set optional datetime fields
+        for field in ['first_match_date', 'first_episode_room_date', 'first_friend_date', 'first_streak_date']:
+            if journey_dict[field]:
+                journey_dict[field] = journey_dict[field].isoformat() if isinstance(journey_dict[field], datetime) else journey_dict[field]
+        
+        # insert_one adds _id to the dict it is given
+        await db.passport_journeys.insert_one(dict(journey_dict))
+        journey = journey_dict
+    return journey
+
+async def build_passport_view(user: User) -> dict:
+    """(Re)build the user's materialized passport view from the passport,
+    stats, badge and journey collections"""
     # Get or create passport
     passport = await db.anime_passports.find_one({"user_id": user.id}, {"_id": 0})
     if not passport:
@@ -2677,8 +3165,9 @@ async def get_user_passport(request: Request):
         passport_dict = passport_obj.dict()
         passport_dict['created_at'] = passport_dict['created_at'].isoformat()
         passport_dict['last_updated'] = passport_dict['last_updated'].isoformat()
-        await db.anime_passports.insert_one(passport_dict)
+        await db.anime_passports.insert_one(dict(passport_dict))
         passport = passport_dict
+        leaderboards.set_vibe(user.id, passport['anime_vibe'])
     
     # Get passport stats
     stats = await db.passport_stats.find_one({"user_id": user.id}, {"_id": 0})
@@ -2686,22 +3175,78 @@ async def get_user_passport(request: Request):
         stats_obj = PassportStats(user_id=user.id)
         stats_dict = stats_obj.dict()
         stats_dict['last_updated'] = stats_dict['last_updated'].isoformat()
-        await db.passport_stats.insert_one(stats_dict)
+        await db.passport_stats.insert_one(dict(stats_dict))
         stats = stats_dict
     
-    # Get user badges
-    user_badges = await db.user_passport_badges.find({"user_id": user.id}, {"_id": 0}).to_list(100)
-    badge_ids = [ub['badge_id'] for ub in user_badges]
-    badges = await db.passport_badges.find({"id": {"$in": badge_ids}}, {"_id": 0}).to_list(100)
+    # Get user badges; badge definitions come from the compiled rule set
+    user_badges = await db.user_passport_badges.find(
+        {"user_id": user.id}, {"_id": 0, "badge_id": 1, "earned_at": 1}
+    ).to_list(None)
+    earned_badges = {ub['badge_id']: ub['earned_at'] for ub in user_badges}
+    if not badge_engine.loaded():
+        await load_badge_rules()
+    badges = [badge for badge in badge_engine.all_badges() if badge['id'] in earned_badges]
     
-    # Get journey data
-    journey = await db.passport_journeys.find_one({"user_id": user.id}, {"_id": 0})
+    journey = await get_or_create_journey(user)
+    
+    return await db.passport_views.find_one_and_update(
+        {"user_id": user.id},
+        {
+            "$set": {
+                "passport": passport,
+                "stats": stats,
+                "badges": badges,
+                "earned_badges": earned_badges,
+                "journey": journey,
+                "stale": False
+            },
+            "$inc": {"version": 1}
+        },
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+async def get_passport_view(user: User) -> dict:
+    """User's materialized passport view, rebuilt if missing or stale"""
+    view = await db.passport_views.find_one({"user_id": user.id}, {"_id": 0})
+    if not view or view.get("stale"):
+        view = await build_passport_view(user)
+    return view
+
+async def update_passport_view(user_id: str, update: dict):
+    """Apply an update to a user's passport view (if built) and bump its version"""
+    update = {**update, "$inc": {**update.get("$inc", {}), "version": 1}}
+    await db.passport_views.update_one({"user_id": user_id}, update)
+
+async def mark_passport_view_stale(user_id: str):
+    """Have the user's passport view rebuilt on next read"""
+    await update_passport_view(user_id, {"$set": {"stale": True}})
+
+# Passport System API Endpoints
+@api_router.get("/passport")
+async def get_user_passport(request: Request, response: Response):
+    """Get user's anime passport"""
+    user = await get_current_user(request)
+    if not user:
+        raise HTTPException(status_code=401)
+    
+    view = await get_passport_view(user)
+    # Stats not yet flushed are shown too (as on /passport/badges)
+    pending_stats = stats_aggregator.pending(user.id)
+    
+    # The PassportPage polls; revalidate every time, answer 304 if unchanged
+    etag = passport_view.etag(view, pending_stats)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if passport_view.not_modified(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     
     return {
-        "passport": passport,
-        "stats": stats,
-        "badges": badges,
-        "journey": journey,
+        "passport": view["passport"],
+        "stats": stats_aggregator.overlay(user.id, view["stats"]),
+        "badges": view["badges"],
+        "journey": view["journey"],
         "anime_vibes": ANIME_VIBES
     }
 
@@ -2745,6 +3290,11 @@ async def update_passport(passport_data: dict, request: Request):
             {"$set": update_data},
             upsert=True
         )
+        await update_passport_view(user.id, {
+            "$set": {f"passport.{field}": value for field, value in update_data.items()}
+        })
+        if 'anime_vibe' in update_data:
+            leaderboards.set_vibe(user.id, update_data['anime_vibe'])
     
     return {"message": "Passport updated successfully"}
 
@@ -2756,29 +3306,21 @@ async def get_available_badges(request: Request):
         raise HTTPException(status_code=401)
     
     # Get all badges
-    all_badges = await db.passport_badges.find({}, {"_id": 0}).to_list(100)
+    if not badge_engine.loaded():
+        await load_badge_rules()
+    all_badges = badge_engine.all_badges()
     
-    # Get user's earned badges
-    user_badges = await db.user_passport_badges.find({"user_id": user.id}, {"_id": 0}).to_list(100)
-    earned_badge_ids = {ub['badge_id'] for ub in user_badges}
-    
-    # Get user stats for progress calculation
-    stats = await db.passport_stats.find_one({"user_id": user.id}, {"_id": 0})
-    if not stats:
-        stats = PassportStats(user_id=user.id).dict()
+    # Earned badges and stats for progress calculation come from the view
+    view = await get_passport_view(user)
+    earned_badges = view.get("earned_badges") or {}
+    stats = stats_aggregator.overlay(user.id, view["stats"])
     
     # Calculate progress for each badge
     badges_with_progress = []
     for badge in all_badges:
         badge_progress = badge.copy()
-        badge_progress['earned'] = badge['id'] in earned_badge_ids
-        badge_progress['earned_at'] = None
-        
-        # Find earned date if applicable
-        for user_badge in user_badges:
-            if user_badge['badge_id'] == badge['id']:
-                badge_progress['earned_at'] = user_badge['earned_at']
-                break
+        badge_progress['earned'] = badge['id'] in earned_badges
+        badge_progress['earned_at'] = earned_badges.get(badge['id'])
         
         # Calculate progress based on unlock condition
         condition = badge['unlock_condition']
@@ -2805,25 +3347,8 @@ async def get_passport_journey(request: Request):
     if not user:
         raise HTTPException(status_code=401)
     
-    # Get or create journey
-    journey = await db.passport_journeys.find_one({"user_id": user.id}, {"_id": 0})
-    if not journey:
-        journey_obj = PassportJourney(
-            user_id=user.id,
-            joined_date=user.created_at if hasattr(user, 'created_at') else datetime.now(timezone.utc)
-        )
-        journey_dict = journey_obj.dict()
-        journey_dict['joined_date'] = journey_dict['joined_date'].isoformat() if isinstance(journey_dict['joined_date'], datetime) else journey_dict['joined_date']
-        journey_dict['created_at'] = journey_dict['created_at'].isoformat()
-        journey_dict['last_updated'] = journey_dict['last_updated'].isoformat()
-        
-        # Set optional datetime fields
-        for field in ['first_match_date', 'first_episode_room_date', 'first_friend_date', 'first_streak_date']:
-            if journey_dict[field]:
-                journey_dict[field] = journey_dict[field].isoformat() if isinstance(journey_dict[field], datetime) else journey_dict[field]
-        
-        await db.passport_journeys.insert_one(journey_dict)
-        journey = journey_dict
+    # Get or create journey (via the passport view)
+    journey = (await get_passport_view(user))["journey"]
     
     # Get episode room visits for map
     room_visits = await db.episode_room_visits.find({"user_id": user.id}, {"_id": 0}).to_list(100)
@@ -2855,6 +3380,50 @@ async def get_passport_levels(request: Request):
         "experience_to_next": level_info['experience_to_next']
     }
 
+@api_router.get("/leaderboard")
+async def get_leaderboard(request: Request, scope: str = "global", metric: str = "xp",
+                          vibe: Optional[str] = None, limit: int = 20, offset: int = 0):
+    """A page of a leaderboard plus the current user's own rank"""
+    user = await get_current_user(request)
+    if not user:
+        raise HTTPException(status_code=401)
+    
+    if scope not in leaderboards.SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope must be one of {', '.join(leaderboards.SCOPES)}")
+    if metric not in leaderboards.METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(leaderboards.METRICS)}")
+    if scope == "vibe":
+        vibe = vibe or leaderboards.vibe_of(user.id)
+        if vibe not in ANIME_VIBES:
+            raise HTTPException(status_code=400, detail="Unknown anime vibe")
+    else:
+        vibe = None
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    
+    page = leaderboards.top(scope, metric, limit, offset, vibe)
+    profiles = await hydrate_users([user_id for user_id, _ in page])
+    entries = []
+    for position, (user_id, score) in enumerate(page, start=offset + 1):
+        profile = profiles.get(user_id, {})
+        entries.append({
+            "rank": position,
+            "user_id": user_id,
+            "name": profile.get('name'),
+            "picture": profile.get('picture'),
+            "score": score
+        })
+    
+    me = leaderboards.rank(scope, metric, user.id, vibe)
+    return {
+        "scope": scope,
+        "metric": metric,
+        "vibe": vibe,
+        "total": leaderboards.size(scope, metric, vibe),
+        "entries": entries,
+        "me": {"rank": me[0], "score": me[1]} if me else None
+    }
+
 @api_router.post("/passport/share")
 async def generate_share_card(request: Request):
     """Generate shareable passport card data"""
@@ -2862,18 +3431,30 @@ async def generate_share_card(request: Request):
     if not user:
         raise HTTPException(status_code=401)
     
-    # Get passport data
-    passport = await db.anime_passports.find_one({"user_id": user.id}, {"_id": 0})
-    if not passport:
-        raise HTTPException(status_code=404, detail="Passport not found")
-    
-    # Get user badges count
-    badges_count = await db.user_passport_badges.count_documents({"user_id": user.id})
+    # Get passport data and badge count from the passport view
+    view = await db.passport_views.find_one({"user_id": user.id}, {"_id": 0})
+    if not view or view.get("stale"):
+        if not await db.anime_passports.find_one({"user_id": user.id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Passport not found")
+        view = await build_passport_view(user)
+    share_card = build_share_card(user.name, user.picture, view["passport"], len(view["badges"]))
+    
+    if share_cards.available():
+        # Versioned by content hash, so the URL can be cached indefinitely
+        share_card["image_url"] = (
+            str(request.url_for("get_share_card_image", user_id=user.id, fmt="png"))
+            + f"?v={share_cards.card_key(share_card, 'png')}"
+        )
+        # Render now so the first unfurl of the link is already a file read
+        asyncio.create_task(prerender_share_card(share_card))
     
-    # Create shareable card data
-    share_card = {
-        "user_name": user.name,
-        "user_picture": user.picture,
+    return share_card
+
+def build_share_card(user_name: str, user_picture: Optional[str], passport: dict, badges_count: int) -> dict:
+    """Shareable passport card data"""
+    return {
+        "user_name": user_name,
+        "user_picture": user_picture,
         "top_anime": passport.get('top_5_anime', [])[:3],  # Show top 3 for sharing
         "anime_vibe": passport.get('anime_vibe', 'Wholesome'),
         "fate_number": passport.get('fate_number', 0),
@@ -2883,8 +3464,38 @@ async def generate_share_card(request: Request):
         "favorite_character": passport.get('top_3_characters', [{}])[0] if passport.get('top_3_characters') else None,
         "generated_at": datetime.now(timezone.utc).isoformat()
     }
+
+async def prerender_share_card(share_card: dict):
+    try:
+        await share_cards.get_card(share_card, "png")
+    except Exception as e:
+        logging.warning(f"Share card pre-render failed: {e}")
+
+@api_router.get("/passport/{user_id}/card.{fmt}")
+async def get_share_card_image(user_id: str, fmt: str, request: Request, v: Optional[str] = None):
+    """Rendered passport share card image (public, for link unfurls)"""
+    if fmt not in share_cards.FORMATS:
+        raise HTTPException(status_code=404)
+    if not share_cards.available():
+        raise HTTPException(status_code=503, detail="Share card images are unavailable")
     
-    return share_card
+    view = await db.passport_views.find_one({"user_id": user_id}, {"_id": 0, "passport": 1, "badges": 1})
+    profile = (await hydrate_users([user_id])).get(user_id)
+    if not view or not profile:
+        raise HTTPException(status_code=404, detail="Passport not found")
+    
+    share_card = build_share_card(profile.get('name'), profile.get('picture'), view["passport"], len(view["badges"]))
+    key = share_cards.card_key(share_card, fmt)
+    headers = {
+        "ETag": f'"{key}"',
+        # A matching ?v= pins this exact image; otherwise allow a short refresh
+        "Cache-Control": "public, max-age=31536000, immutable" if v == key else "public, max-age=300"
+    }
+    if passport_view.not_modified(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    path = await share_cards.get_card(share_card, fmt)
+    return FileResponse(path, media_type=share_cards.FORMATS[fmt], headers=headers)
 
 # Helper function to initialize passport system for existing users
 async def initialize_passport_system():
@@ -2902,111 +3513,104 @@ async def initialize_passport_system():
         await db.passport_badges.insert_many(badge_docs)
         logging.info(f"Initialized {len(badge_docs)} default badges")
 
-# Helper function to update passport stats
-async def update_passport_stats(user_id: str, stat_updates: dict):
-    """Update passport statistics and check for badge unlocks"""
-    # Separate numeric and non-numeric updates
-    inc_ops = {}
-    set_ops = {}
-    
-    for stat, value in stat_updates.items():
-        if isinstance(value, (int, float)):
-            inc_ops[stat] = value
-        else:
-            set_ops[stat] = value
-    
-    # Always set the last_updated timestamp
-    set_ops['last_updated'] = datetime.now(timezone.utc).isoformat()
-    
-    # Build the update operation
-    update_operation = {}
-    if inc_ops:
-        update_operation["$inc"] = inc_ops
-    if set_ops:
-        update_operation["$set"] = set_ops
-    
-    # If no operations, just set the timestamp
-    if not update_operation:
-        update_operation = {"$set": {"last_updated": datetime.now(timezone.utc).isoformat()}}
-    
-    await db.passport_stats.update_one(
-        {"user_id": user_id},
-        update_operation,
-        upsert=True
-    )
-    
-    # Check for badge unlocks
-    await check_badge_unlocks(user_id)
-
-async def check_badge_unlocks(user_id: str):
-    """Check if user has unlocked any new badges"""
+    await load_badge_rules()
+
+async def load_badge_rules():
+    """Compile badge unlock conditions into the per-stat rule index"""
+    badges = await db.passport_badges.find({}, {"_id": 0}).to_list(None)
+    badge_engine.compile_rules(badges)
+    logging.info(f"Compiled unlock rules for {len(badges)} badges")
+
+async def get_earned_badge_ids(user_id: str) -> set:
+    """Ids of badges the user has earned, cached after the first load"""
+    earned = badge_engine.get_earned(user_id)
+    if earned is None:
+        user_badges = await db.user_passport_badges.find(
+            {"user_id": user_id}, {"_id": 0, "badge_id": 1}
+        ).to_list(None)
+        earned = badge_engine.store_earned(user_id, (ub['badge_id'] for ub in user_badges))
+    return earned
+
+async def check_badge_unlocks(user_id: str, stats: Optional[dict] = None, changed_stats=None):
+    """Check if user has unlocked any new badges.
+
+    Only badges whose unlock condition mentions one of ``changed_stats`` are
+    evaluated (all of them when it is None), and ``stats`` may be passed in
+    to skip reading passport_stats.
+    """
     try:
-        # Get user stats
-        stats = await db.passport_stats.find_one({"user_id": user_id}, {"_id": 0})
-        if not stats:
+        if stats is None:
+            stats = await db.passport_stats.find_one({"user_id": user_id}, {"_id": 0})
+            if not stats:
+                return
+        
+        if not badge_engine.loaded():
+            await load_badge_rules()
+        candidates = badge_engine.rules_for(changed_stats)
+        if not candidates:
             return
         
-        # Get user's current badges
-        user_badges = await db.user_passport_badges.find({"user_id": user_id}, {"_id": 0}).to_list(100)
-        earned_badge_ids = {ub['badge_id'] for ub in user_badges}
+        earned_badge_ids = await get_earned_badge_ids(user_id)
+        new_badges = [
+            badge for badge in candidates
+            if badge['id'] not in earned_badge_ids and badge_engine.unlocked(badge, stats)
+        ]
+        if not new_badges:
+            return
+        badge_engine.mark_earned(user_id, [badge['id'] for badge in new_badges])
+        
+        # Award every newly unlocked badge in one write
+        user_badge_docs = []
+        for badge in new_badges:
+            user_badge = UserPassportBadge(
+                user_id=user_id,
+                badge_id=badge['id'],
+                progress_when_earned=stats.copy()
+            )
+            user_badge_dict = user_badge.dict()
+            user_badge_dict['earned_at'] = user_badge_dict['earned_at'].isoformat()
+            user_badge_docs.append(user_badge_dict)
         
-        # Get all available badges
-        all_badges = await db.passport_badges.find({}, {"_id": 0}).to_list(100)
+        await db.user_passport_badges.insert_many(user_badge_docs)
         
-        # Check each badge
-        for badge in all_badges:
-            if badge['id'] in earned_badge_ids:
-                continue  # Already earned
-            
-            # Check unlock condition
-            condition = badge['unlock_condition']
-            unlocked = True
-            
-            for key, target_value in condition.items():
-                current_value = stats.get(key, 0)
-                if isinstance(target_value, (int, float)):
-                    if current_value < target_value:
-                        unlocked = False
-                        break
-                else:
-                    if current_value != target_value:
-                        unlocked = False
-                        break
-            
-            if unlocked:
-                # Award badge
-                user_badge = UserPassportBadge(
-                    user_id=user_id,
-                    badge_id=badge['id'],
-                    progress_when_earned=stats.copy()
-                )
-                user_badge_dict = user_badge.dict()
-                user_badge_dict['earned_at'] = user_badge_dict['earned_at'].isoformat()
-                
-                await db.user_passport_badges.insert_one(user_badge_dict)
-                
-                # Add experience to passport
-                await db.anime_passports.update_one(
-                    {"user_id": user_id},
-                    {"$inc": {"total_experience": badge['experience_reward']}},
-                    upsert=True
-                )
-                
-                # Update passport level if needed
-                passport = await db.anime_passports.find_one({"user_id": user_id}, {"_id": 0})
-                if passport:
-                    level_info = get_passport_level_info(passport.get('total_experience', 0))
-                    await db.anime_passports.update_one(
-                        {"user_id": user_id},
-                        {"$set": {
-                            "passport_level": level_info['level'],
-                            "passport_level_name": level_info['name'],
-                            "experience_to_next_level": level_info['experience_to_next']
-                        }}
-                    )
-                
-                logging.info(f"User {user_id} earned badge: {badge['name']}")
+        # Add experience to passport and update the level from the new total
+        experience_gained = sum(badge['experience_reward'] for badge in new_badges)
+        passport = await db.anime_passports.find_one_and_update(
+            {"user_id": user_id},
+            {"$inc": {"total_experience": experience_gained}},
+            projection={"_id": 0, "total_experience": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        level_info = get_passport_level_info(passport.get('total_experience', 0))
+        await db.anime_passports.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "passport_level": level_info['level'],
+                "passport_level_name": level_info['name'],
+                "experience_to_next_level": level_info['experience_to_next']
+            }}
+        )
+        
+        leaderboards.set_score(user_id, "xp", passport.get('total_experience', 0))
+        await record_weekly_gains({user_id: {"xp": experience_gained}})
+        
+        await update_passport_view(user_id, {
+            "$set": {
+                "passport.total_experience": passport.get('total_experience', 0),
+                "passport.passport_level": level_info['level'],
+                "passport.passport_level_name": level_info['name'],
+                "passport.experience_to_next_level": level_info['experience_to_next'],
+                **{f"earned_badges.{doc['badge_id']}": doc['earned_at'] for doc in user_badge_docs}
+            },
+            "$addToSet": {"badges": {"$each": new_badges}}
+        })
+        
+        for badge in new_badges:
+            logging.info(f"User {user_id} earned badge: {badge['name']}")
     except Exception as e:
+        # Reload the earned set next time rather than trust a half-applied award
+        badge_engine.forget_user(user_id)
         logging.error(f"Error checking badge unlocks for user {user_id}: {e}")
 
 # Track episode room visits for passport journey
@@ -3037,11 +3641,58 @@ async def track_episode_room_visit(user_id: str, room_id: str, anime_title: str,
                 {"user_id": user_id},
                 {"$set": updates}
             )
+            await update_passport_view(user_id, {
+                "$set": {f"journey.{field}": value for field, value in updates.items()}
+            })
 
 # Socket.IO Events
+def _socket_session_token(environ, auth) -> Optional[str]:
+    """Session token for a Socket.IO handshake: the session cookie, then the
+    client's ``auth.token``, then an Authorization bearer header."""
+    cookie = SimpleCookie(environ.get('HTTP_COOKIE', '')).get('session_token')
+    if cookie and cookie.value:
+        return cookie.value
+    if isinstance(auth, dict) and auth.get('token'):
+        return auth['token']
+    auth_header = environ.get('HTTP_AUTHORIZATION', '')
+    if auth_header.startswith('Bearer '):
+        return auth_header.replace('Bearer ', '')
+    return None
+
+async def resolve_socket_user(sid, claimed_user_id: Optional[str] = None) -> Optional[dict]:
+    """Identity of a socket: ``{'user_id', 'profile'}`` from its session.
+
+    Sockets authenticated at connect always act as that user, whatever the
+    payload says. Anonymous users have no server-side session, so for them the
+    claimed id is accepted once - only if it is an anonymous account - and
+    then pinned to the socket.
+    """
+    session = await sio.get_session(sid)
+    if session.get('user_id'):
+        return session
+    if not claimed_user_id:
+        return None
+    if not claimed_user_id.startswith('anon_'):
+        doc = (await hydrate_users([claimed_user_id])).get(claimed_user_id)
+        if doc and not doc.get('isAnonymous'):
+            logging.warning(f"Rejected unauthenticated socket {sid} acting as {claimed_user_id}")
+            return None
+    session['user_id'] = claimed_user_id
+    session['profile'] = None
+    await sio.save_session(sid, session)
+    return session
+
 @sio.event
-async def connect(sid, environ):
+async def connect(sid, environ, auth=None):
     logging.info(f"Client connected: {sid}")
+    # Authenticate once per connection; handlers read identity from the session
+    session_token = _socket_session_token(environ, auth)
+    user = await get_user_for_token(session_token) if session_token else None
+    if user:
+        await sio.save_session(sid, {
+            'user_id': user.id,
+            'profile': {'id': user.id, 'name': user.name, 'picture': user.picture}
+        })
     await sio.emit('connected', {'message': 'Connected to server', 'sid': sid}, room=sid)
     await sio.emit('connected', {'sid': sid}, room=sid)
 
@@ -3077,17 +3728,11 @@ async def disconnect(sid):
             
             current_count = len(episode_rooms_cache[room_id]['users'])
             
-            # Update database
-            await db.episode_rooms.update_one(
-                {"id": room_id},
-                {"$set": {"active_users_count": current_count}}
-            )
-            
-            # Notify other users
-            await sio.emit('episode_room_user_left', {
+            # Update database + notify other users
+            await announce_room_count(room_id, current_count, 'episode_room_user_left', {
                 'user_id': user_id,
                 'active_users': current_count
-            }, room=room_id)
+            })
         
         del episode_room_users[sid]
     
@@ -3114,19 +3759,22 @@ async def disconnect(sid):
 @sio.event
 async def join_matching(sid, data):
     try:
-        user_id = data.get('user_id')
+        identity = await resolve_socket_user(sid, data.get('user_id'))
         user_data = data.get('user_data')
         watch_profile = data.get('watch_profile')
         
-        logging.info(f"Join matching request from {user_id}, sid: {sid}")
-        
-        if not user_id:
-            logging.error("No user_id provided in join_matching")
+        if not identity:
+            logging.error("No authenticated or anonymous user in join_matching")
             await sio.emit('error', {'message': 'User ID required'}, room=sid)
             return
+        user_id = identity['user_id']
+        if user_data:
+            user_data = {**user_data, 'id': user_id}
         
-        # Get user from database or use provided data
-        user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
+        log_event("matching", "Join matching request from %s, sid: %s", user_id, sid)
+        
+        # Get user (cached profile) or use provided data
+        user_doc = (await hydrate_users([user_id])).get(user_id)
         if not user_doc:
             # If user not found in database, use provided user_data for testing
             if user_data:
@@ -3144,7 +3792,6 @@ async def join_matching(sid, data):
         else:
             # User found in DB - but update with latest user_data if provided (for anonymous users)
             if user_data:
-                logging.info(f"Updating user {user_id} with fresh data from client")
                 # Merge database data with client data (client data takes precedence for interests)
                 merged_data = {**user_doc, **user_data}
                 user = User(**merged_data)
@@ -3155,18 +3802,15 @@ async def join_matching(sid, data):
                     {"id": user_id},
                     {"$set": update_dict}
                 )
-                logging.info(f"Updated user in database: {user.name}, anime: {len(user.favorite_anime)}, genres: {len(user.favorite_genres)}, themes: {len(user.favorite_themes)}")
+                user_profiles.invalidate(user_id)
+                log_event("matching", "Updated user in database: %s", user.name)
             else:
                 user = User(**user_doc)
-        logging.info(f"User loaded: {user.name}, anime count: {len(user.favorite_anime)}, genres: {len(user.favorite_genres)}, themes: {len(user.favorite_themes)}")
+        log_event("matching", "User loaded: %s, anime count: %d, genres: %d, themes: %d",
+                  user.name, len(user.favorite_anime), len(user.favorite_genres), len(user.favorite_themes))
         
         # Check premium limits for daily matches
-        today = datetime.now(timezone.utc).date()
-        daily_matches_count = await db.user_daily_stats.count_documents({
-            "user_id": user_id,
-            "date": today.isoformat(),
-            "action": "match_started"
-        })
+        daily_matches_count = await get_daily_count(user_id, "match_started")
         
         can_match = await check_premium_limit(user_id, "daily_matches", daily_matches_count)
         if not can_match:
@@ -3191,7 +3835,7 @@ async def join_matching(sid, data):
         # Send updated online users list to everyone (including the new user)
         online_user_ids = list(active_users.keys())
         await sio.emit('online_users_update', online_user_ids)
-        logging.info(f"Broadcasting online users list: {len(online_user_ids)} users online")
+        log_event("matching", "Broadcasting online users list: %d users online", len(online_user_ids))
         
         # Declare global variables at the start
         global matching_queue
@@ -3200,13 +3844,11 @@ async def join_matching(sid, data):
         user_watch_sets, user_watch_has = prepare_watch_sets(watch_profile)
 
         # Check if there's someone in the queue
-        logging.info(f"Current matching queue size: {len(matching_queue)}")
-        logging.info(f"Queue contents: {[u['user_data']['name'] for u in matching_queue]}")
+        log_event("matching", "Current matching queue size: %d", len(matching_queue))
         
         if matching_queue:
             # Find best match with improved algorithm
             match_result = await find_best_match(user, matching_queue, user_watch_sets, user_watch_has)
-            logging.info(f"Match result: {match_result}")
             
             if match_result:
                 best_match = match_result['match']
@@ -3218,7 +3860,7 @@ async def join_matching(sid, data):
                 # Remove from queue
                 original_queue_size = len(matching_queue)
                 matching_queue = [u for u in matching_queue if u['sid'] != best_match['sid']]
-                logging.info(f"Removed matched user from queue. Size: {original_queue_size} -> {len(matching_queue)}")
+                log_event("matching", "Removed matched user from queue. Size: %d -> %d", original_queue_size, len(matching_queue))
                 
                 # Broadcast queue update to remaining users
                 await broadcast_queue_update()
@@ -3247,16 +3889,11 @@ async def join_matching(sid, data):
                 await track_daily_stat(user_id, "match_started")
                 await track_daily_stat(partner_data['id'], "match_started")
                 
-                # Update passport stats for matches
-                try:
-                    await update_passport_stats(user_id, {"total_matches": 1})
-                    await update_passport_stats(partner_data['id'], {"total_matches": 1})
-                except Exception as e:
-                    logging.error(f"Error updating passport stats for match: {e}")
-                
-                # Update arc progression for both users (first match milestone)
-                await update_user_stats(user_id, "matches_completed", 1)
-                await update_user_stats(partner_data['id'], "matches_completed", 1)
+                # Update passport stats and arc progression (first match
+                # milestone) for both users
+                for uid in [user_id, partner_data['id']]:
+                    stats_aggregator.record(uid, "total_matches", 1)
+                    stats_aggregator.record(uid, "matches_completed", 1, stats_aggregator.ARC)
                 
                 # Calculate shared anime universe
                 partner_user_obj = User(**partner_data)
@@ -3331,7 +3968,7 @@ async def join_matching(sid, data):
                 'watch_has': user_watch_has,
                 'joined_at': datetime.utcnow().timestamp()  # For fairness tracking
             })
-            logging.info(f"Added user {user.name} to matching queue. Queue size: {len(matching_queue)}")
+            log_event("matching", "Added user %s to matching queue. Queue size: %d", user.name, len(matching_queue))
             
             # Send matching stats to user
             await send_matching_stats(sid)
@@ -3356,24 +3993,17 @@ async def send_message(sid, data):
         message = data.get('message', '')
         image = data.get('image', None)  # Get image data if present
         
-        # DEBUG: Log received data
-        logging.info(f"Received message from {sid}: message='{message}', has_image={image is not None}")
-        if image:
-            logging.info(f"Image data length: {len(image)} characters")
-        
         # Validate image size if present
         if image:
             # Rough estimate: base64 is ~33% larger than binary
             image_size = len(image) * 0.75 / (1024 * 1024)  # Size in MB
-            logging.info(f"Image size: {image_size:.2f}MB")
             if image_size > 5:  # 5MB limit
                 await sio.emit('error', {'message': 'Image too large. Maximum 5MB.'}, room=sid)
                 logging.warning(f"Image too large: {image_size:.2f}MB from user {match_info['user_id']}")
                 return
         
-        # Simple spoiler detection (rule-based)
-        spoiler_keywords = ['dies', 'killed', 'death', 'ending', 'finale', 'spoiler']
-        is_spoiler = any(keyword in message.lower() for keyword in spoiler_keywords)
+        # Rule-based spoiler detection (base lexicon - random chats have no anime context)
+        is_spoiler = spoiler_detection.is_spoiler(message)
         
         message_data = {
             'message': message,
@@ -3383,18 +4013,14 @@ async def send_message(sid, data):
             'image': image  # Include image in message data
         }
         
-        # DEBUG: Log message_data being sent
-        logging.info(f"Preparing to send message_data with image={message_data.get('image') is not None}")
-        
         # PRIVACY: Do NOT save random match messages to database
         # Only real-time transmission for ephemeral privacy
         # Messages vanish when users skip/leave - no permanent records
-        logging.info(f"Random match message - NOT saved to database (privacy feature)")
+        # (and never log their content)
         
         # Send to partner
         try:
             await sio.emit('receive_message', message_data, room=partner_sid)
-            logging.info(f"Message sent to partner {partner_sid}, has_image: {image is not None}, image_in_data: {message_data.get('image') is not None}")
         except Exception as e:
             logging.error(f"Error sending message to partner: {e}")
             await sio.emit('error', {'message': 'Failed to send message to partner'}, room=sid)
@@ -3402,12 +4028,13 @@ async def send_message(sid, data):
         
         # Echo back to sender
         await sio.emit('message_sent', message_data, room=sid)
-        logging.info(f"Message echoed back to sender {sid}, has_image: {message_data.get('image') is not None}")
+        log_event("chat_message", "Random match message %s -> %s (image: %s)", sid, partner_sid, image is not None)
         
-        # Count this message in memory; a background task flushes passport + arc
+        # Count this message in memory; flush_stats writes passport + arc
         # stats to the DB in batches (avoids 2 DB writes on every message).
         uid = match_info['user_id']
-        pending_message_stats[uid] = pending_message_stats.get(uid, 0) + 1
+        stats_aggregator.record(uid, "messages_sent", 1)
+        stats_aggregator.record(uid, "messages_sent", 1, stats_aggregator.ARC)
         
     except Exception as e:
         logging.error(f"Error in send_message: {e}", exc_info=True)
@@ -3535,7 +4162,7 @@ async def cancel_matching(sid):
         # Remove from matching queue
         original_size = len(matching_queue)
         matching_queue = [u for u in matching_queue if u['sid'] != sid]
-        logging.info(f"Removed user from matching queue. Queue size: {original_size} -> {len(matching_queue)}")
+        log_event("matching", "Removed user from matching queue. Queue size: %d -> %d", original_size, len(matching_queue))
         
         # Broadcast queue update to remaining users
         await broadcast_queue_update()
@@ -3579,7 +4206,7 @@ async def broadcast_queue_update():
     for queued_user in matching_queue:
         await sio.emit('matching_stats', stats, room=queued_user['sid'])
     
-    logging.info(f"Broadcasted queue update: {len(matching_queue)} users searching")
+    log_event("queue_update", "Broadcasted queue update: %d users searching", len(matching_queue))
 
 @api_router.get("/debug/queue")
 async def get_queue_status(request: Request):
@@ -3842,33 +4469,157 @@ async def try_immediate_match(sid, user):
         }, room=partner_sid)
         
         # Update passport stats for matches
-        try:
-            await update_passport_stats(user_id, {"total_matches": 1})
-            await update_passport_stats(partner_data['id'], {"total_matches": 1})
-        except Exception as e:
-            logging.error(f"Error updating passport stats for immediate match: {e}")
+        stats_aggregator.record(user_id, "total_matches", 1)
+        stats_aggregator.record(partner_data['id'], "total_matches", 1)
         
         logging.info(f"Immediate match created: {user.name} <-> {partner_data['name']} (type: {match_type}, score: {best_score})")
 
+async def find_catalog_mal_id(title: str):
+    """MAL id of the catalog entry whose title matches ``title`` exactly (up to
+    case and punctuation). A search's top hit may be a sequel or a different
+    series, whose characters would make the wrong words spoilers - so without
+    an exact match there is no id and only the base lexicon applies."""
+    wanted = anime_catalog.slugify(title)
+    for match in await anime_catalog.search(title, limit=5):
+        titles = (match.get('title'), match.get('title_original'))
+        if match.get('mal_id') and any(t and anime_catalog.slugify(t) == wanted for t in titles):
+            return match['mal_id']
+    return None
+
+async def build_spoiler_detector(anime_id: str):
+    """Build an anime's spoiler pattern: its character names from the Jikan
+    catalog plus any curated spoiler_terms"""
+    character_names, spoiler_terms = [], []
+    try:
+        anime = await db.anime_data.find_one(
+            {"id": anime_id}, {"_id": 0, "title": 1, "mal_id": 1, "spoiler_terms": 1}
+        )
+        if anime:
+            spoiler_terms = anime.get('spoiler_terms') or []
+            mal_id = anime.get('mal_id') or await find_catalog_mal_id(anime.get('title', ''))
+            if mal_id:
+                characters = await anime_catalog.get_characters(mal_id)
+                character_names = [character['name'] for character in characters]
+    except Exception as e:
+        logging.warning(f"Spoiler terms for anime {anime_id} unavailable: {e}")
+    # Registered even when empty, so a catalog outage isn't retried per message
+    spoiler_detection.register(anime_id, spoiler_detection.build_terms(character_names, spoiler_terms))
+
+async def get_spoiler_detector(anime_id: str):
+    """Compiled spoiler pattern for an anime, cached by spoiler_detection. On
+    a miss it is built in the background and None (the base lexicon) is
+    returned, so sending a message never waits on the catalog."""
+    pattern = spoiler_detection.get_detector(anime_id)
+    if pattern is None and spoiler_detection.start_build(anime_id):
+        asyncio.create_task(build_spoiler_detector(anime_id))
+    return pattern
+
+def _locked_room_message(message_dict: dict, episode: int) -> dict:
+    locked_message = message_dict.copy()
+    locked_message['message'] = f"🔒 Locked until you reach Episode {episode}"
+    locked_message['is_locked'] = True
+    locked_message['locked_until_episode'] = episode
+    return locked_message
+
+async def announce_room_count(room_id: str, current_count: int, event: str, payload: dict, skip_sid=None):
+    """Persist a room's member count and notify the room. Large rooms skip the
+    per-join/leave event; their count goes out with the next periodic update."""
+    trending_rooms.set_active_users(room_id, current_count)
+    if room_delivery.is_large(current_count):
+        room_delivery.mark_count_dirty(room_id)
+        return
+    await db.episode_rooms.update_one(
+        {"id": room_id},
+        {"$set": {"active_users_count": current_count}}
+    )
+    await sio.emit(event, payload, room=room_id, skip_sid=skip_sid)
+
+async def flush_room_frame(room_id: str, messages: list):
+    """Emit one frame of queued messages to a large room.
+
+    Members are split into ``<room>:spoilers`` / ``<room>:locked`` sub-rooms on
+    join, so the common cases (no spoilers, or current-episode spoilers) cost
+    one or two broadcasts. Only messages tagged with some other episode fall
+    back to per-member frames.
+    """
+    room_cache = episode_rooms_cache.get(room_id)
+    if not room_cache:
+        return
+    room_episode = room_cache['room_data'].get('episode_number')
+    spoiler_episodes = {
+        m['spoiler_episode_number'] for m in messages
+        if m.get('is_spoiler') and m.get('spoiler_episode_number')
+    }
+    
+    if not spoiler_episodes:
+        await sio.emit('episode_room_messages', {'room_id': room_id, 'messages': messages}, room=room_id)
+        return
+    
+    def frame_for(watched):
+        return [
+            m if not m.get('is_spoiler') or m.get('spoiler_episode_number') in watched
+            else _locked_room_message(m, m['spoiler_episode_number'])
+            for m in messages
+        ]
+    
+    if spoiler_episodes == {room_episode}:
+        await sio.emit('episode_room_messages', {'room_id': room_id, 'messages': frame_for({room_episode})},
+                       room=f"{room_id}:spoilers")
+        await sio.emit('episode_room_messages', {'room_id': room_id, 'messages': frame_for(set())},
+                       room=f"{room_id}:locked")
+        return
+    
+    # Group members by which of this frame's spoiler episodes they've watched
+    frames = {}
+    for user_info in room_cache['users']:
+        key = frozenset(spoiler_episodes & user_info.get('episodes_watched', set()))
+        if key not in frames:
+            frames[key] = frame_for(key)
+        await sio.emit('episode_room_messages', {'room_id': room_id, 'messages': frames[key]},
+                       room=user_info['sid'])
+
+async def deliver_large_room_frames():
+    """Background task: flush queued large-room messages every
+    FRAME_INTERVAL and send coalesced member-count updates."""
+    while True:
+        try:
+            await asyncio.sleep(room_delivery.FRAME_INTERVAL)
+            for room_id, messages in room_delivery.take_frames().items():
+                await flush_room_frame(room_id, messages)
+            for room_id in room_delivery.take_due_counts():
+                if room_id not in episode_rooms_cache:
+                    continue
+                current_count = len(episode_rooms_cache[room_id]['users'])
+                if db is not None:
+                    await db.episode_rooms.update_one(
+                        {"id": room_id},
+                        {"$set": {"active_users_count": current_count}}
+                    )
+                await sio.emit('episode_room_count', {
+                    'room_id': room_id,
+                    'active_users': current_count
+                }, room=room_id)
+        except Exception as e:
+            logging.error(f"Error in deliver_large_room_frames: {e}", exc_info=True)
+
 # Episode Room Socket.IO Events
 @sio.event
 async def join_episode_room(sid, data):
     try:
         room_id = data.get('room_id')
-        user_id = data.get('user_id')
+        identity = await resolve_socket_user(sid, data.get('user_id'))
+        user_id = identity['user_id'] if identity else None
         
         logging.info(f"User {user_id} joining room {room_id}, sid: {sid}")
         
-        # Get user from database
-        user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if not user_doc:
+        # Get user (cached model)
+        user = await get_session_user(user_id) if user_id else None
+        if not user:
             await sio.emit('error', {'message': 'User not found'}, room=sid)
             return
         
-        user = User(**user_doc)
-        
         # Get room from database
-        room = await db.episode_rooms.find_one({"id": room_id}, {"_id": 0})
+        room = await db.episode_rooms.find_one({"id": room_id}, {"_id": 0, "expires_at_dt": 0})
         if not room:
             await sio.emit('error', {'message': 'Room not found'}, room=sid)
             return
@@ -3887,8 +4638,10 @@ async def join_episode_room(sid, data):
         episodes_watched = progress.get('episodes_watched', []) if progress else []
         can_join = room['episode_number'] in episodes_watched
         
-        # Join the Socket.IO room
+        # Join the Socket.IO room, plus the spoiler sub-room used to address
+        # large-room frames to each audience with a single broadcast
         await sio.enter_room(sid, room_id)
+        await sio.enter_room(sid, f"{room_id}:{'spoilers' if can_join else 'locked'}")
         
         # Store user in episode room users
         episode_room_users[sid] = {
@@ -3913,15 +4666,16 @@ async def join_episode_room(sid, data):
             'sid': sid,
             'user_id': user_id,
             'name': user.name,
-            'picture': user.picture
+            'picture': user.picture,
+            'episodes_watched': set(episodes_watched)
         })
-        
-        # Update active users count in database
         current_count = len(episode_rooms_cache[room_id]['users'])
-        await db.episode_rooms.update_one(
-            {"id": room_id},
-            {"$set": {"active_users_count": current_count}}
-        )
+        
+        # Keep the trending leaderboard in step (rooms created before a restart
+        # are picked up here on their first join)
+        if not trending_rooms.has_room(room_id):
+            anime = await db.anime_data.find_one({"id": room['anime_id']}, {"_id": 0})
+            trending_rooms.upsert_room(room, anime)
         
         # Notify user they joined
         await sio.emit('episode_room_joined', {
@@ -3930,24 +4684,19 @@ async def join_episode_room(sid, data):
             'active_users': current_count
         }, room=sid)
         
-        # Notify other users in room
-        await sio.emit('episode_room_user_joined', {
+        # Update active users count in database + notify other users in room
+        await announce_room_count(room_id, current_count, 'episode_room_user_joined', {
             'user': {
                 'id': user.id,
                 'name': user.name,
                 'picture': user.picture
             },
             'active_users': current_count
-        }, room=room_id, skip_sid=sid)
+        }, skip_sid=sid)
         
-        # Update arc progression for joining episode room
-        await update_user_stats(user.id, "episode_rooms_joined", 1)
-        
-        # Update passport stats for episode room visits
-        try:
-            await update_passport_stats(user.id, {"episode_rooms_visited": 1})
-        except Exception as e:
-            logging.error(f"Error updating passport stats for episode room visit: {e}")
+        # Update arc progression and passport stats for the room visit
+        stats_aggregator.record(user.id, "episode_rooms_joined", 1, stats_aggregator.ARC)
+        stats_aggregator.record(user.id, "episode_rooms_visited", 1)
         
         logging.info(f"User {user.name} joined room {room_id}. Active users: {current_count}")
         
@@ -3965,8 +4714,10 @@ async def leave_episode_room(sid):
         room_id = room_info['room_id']
         user_id = room_info['user_id']
         
-        # Leave the Socket.IO room
+        # Leave the Socket.IO room (and whichever spoiler sub-room we were in)
         await sio.leave_room(sid, room_id)
+        await sio.leave_room(sid, f"{room_id}:spoilers")
+        await sio.leave_room(sid, f"{room_id}:locked")
         
         # Remove from episode room users
         del episode_room_users[sid]
@@ -3980,17 +4731,11 @@ async def leave_episode_room(sid):
             
             current_count = len(episode_rooms_cache[room_id]['users'])
             
-            # Update database
-            await db.episode_rooms.update_one(
-                {"id": room_id},
-                {"$set": {"active_users_count": current_count}}
-            )
-            
-            # Notify other users
-            await sio.emit('episode_room_user_left', {
+            # Update database + notify other users
+            await announce_room_count(room_id, current_count, 'episode_room_user_left', {
                 'user_id': user_id,
                 'active_users': current_count
-            }, room=room_id)
+            })
             
             logging.info(f"User {user_id} left room {room_id}. Active users: {current_count}")
         
@@ -4012,13 +4757,27 @@ async def send_episode_room_message(sid, data):
         message_text = data.get('message', '')
         spoiler_episode_number = data.get('spoiler_episode_number')  # Optional episode number for spoiler tagging
         
+        # Large rooms: one message per member per SLOW_MODE_SECONDS
+        large_room = room_id in episode_rooms_cache and (
+            room_delivery.is_large(len(episode_rooms_cache[room_id]['users']))
+            or room_delivery.has_pending(room_id)
+        )
+        if large_room:
+            retry_after = room_delivery.slow_mode_wait(room_id, user_data['id'])
+            if retry_after:
+                await sio.emit('slow_mode', {
+                    'message': f"Slow mode is on - wait {math.ceil(retry_after)}s before sending again",
+                    'retry_after': retry_after
+                }, room=sid)
+                return
+        
         # Get room info to determine current episode
         room = await db.episode_rooms.find_one({"id": room_id}, {"_id": 0})
         current_episode = room['episode_number'] if room else 1
         
-        # Enhanced spoiler detection
-        spoiler_keywords = ['dies', 'killed', 'death', 'ending', 'finale', 'spoiler', 'revealed', 'twist', 'betrays', 'betrayed']
-        keyword_detected = any(keyword in message_text.lower() for keyword in spoiler_keywords)
+        # Spoiler detection: base lexicon plus this anime's characters/terms
+        spoiler_pattern = await get_spoiler_detector(room['anime_id']) if room else None
+        keyword_detected = spoiler_detection.is_spoiler(message_text, spoiler_pattern)
         
         # Determine if message is a spoiler and which episode it spoils
         is_spoiler = False
@@ -4047,8 +4806,10 @@ async def send_episode_room_message(sid, data):
         message_dict = message.dict()
         message_dict['timestamp'] = message_dict['timestamp'].isoformat()
         
-        # Save to database
-        await db.episode_room_messages.insert_one(message_dict)
+        # Save to database (insert_one adds _id to the dict it is given)
+        await db.episode_room_messages.insert_one(message_dict.copy())
+        room_messages.append(room_id, message_dict)
+        trending_rooms.record_message(room_id)
         
         # Update room message count
         await db.episode_rooms.update_one(
@@ -4056,8 +4817,11 @@ async def send_episode_room_message(sid, data):
             {"$inc": {"total_messages": 1}}
         )
         
+        # Large rooms get the message in the next batched frame
+        if large_room:
+            room_delivery.queue_message(room_id, message_dict)
         # Send personalized messages to each user based on their episode progress
-        if room_id in episode_rooms_cache:
+        elif room_id in episode_rooms_cache:
             anime_id = room['anime_id']
             
             for user_info in episode_rooms_cache[room_id]['users']:
@@ -4082,22 +4846,15 @@ async def send_episode_room_message(sid, data):
                     await sio.emit('episode_room_message', message_dict, room=user_sid)
                 else:
                     # Send locked message
-                    locked_message = message_dict.copy()
-                    locked_message['message'] = f"🔒 Locked until you reach Episode {final_spoiler_episode}"
-                    locked_message['is_locked'] = True
-                    locked_message['locked_until_episode'] = final_spoiler_episode
+                    locked_message = _locked_room_message(message_dict, final_spoiler_episode)
                     await sio.emit('episode_room_message', locked_message, room=user_sid)
         
-        # Update arc progression for message sender
-        await update_user_stats(user_data['id'], "messages_sent", 1)
-        
-        # Update passport stats for episode room messages
-        try:
-            await update_passport_stats(user_data['id'], {"messages_sent": 1})
-        except Exception as e:
-            logging.error(f"Error updating passport stats for episode room message: {e}")
+        # Update arc progression and passport stats for the sender
+        stats_aggregator.record(user_data['id'], "messages_sent", 1, stats_aggregator.ARC)
+        stats_aggregator.record(user_data['id'], "messages_sent", 1)
         
-        logging.info(f"Message sent in room {room_id} by {user_data['name']}, spoiler: {is_spoiler}, episode: {final_spoiler_episode}")
+        log_event("room_message", "Message sent in room %s by %s, spoiler: %s, episode: %s",
+                  room_id, user_data['name'], is_spoiler, final_spoiler_episode)
         
     except Exception as e:
         logging.error(f"Error in send_episode_room_message: {e}", exc_info=True)
@@ -4110,12 +4867,14 @@ direct_message_users = {}  # sid -> user_data mapping for direct messages
 async def register_for_notifications(sid, data):
     """Register a user for global notifications"""
     try:
-        user_data = data.get('user_data')
-        user_id = data.get('user_id')
+        identity = await resolve_socket_user(sid, data.get('user_id'))
+        user_data = data.get('user_data') or (identity and identity.get('profile'))
         
-        if not user_data or not user_id:
+        if not user_data or not identity:
             await sio.emit('error', {'message': 'Missing user data'}, room=sid)
             return
+        user_id = identity['user_id']
+        user_data = {**user_data, 'id': user_id}
         
         # Register user in active_users for global notifications
         active_users[user_id] = {'sid': sid, 'user_data': user_data}
@@ -4126,7 +4885,7 @@ async def register_for_notifications(sid, data):
         # Send updated online users list to everyone (including the new user)
         online_user_ids = list(active_users.keys())
         await sio.emit('online_users_update', online_user_ids)
-        logging.info(f"Broadcasting online users list: {len(online_user_ids)} users online")
+        log_event("presence", "Broadcasting online users list: %d users online", len(online_user_ids))
         
         await sio.emit('notification_registration_success', {
             'message': 'Registered for notifications',
@@ -4144,15 +4903,18 @@ async def join_direct_chat(sid, data):
     try:
         user_data = data.get('user_data')
         friend_id = data.get('friend_id')
-        user_id = data.get('user_id')  # Also check for user_id parameter
-        
-        # Use user_id if user_data is not provided
-        if not user_data and user_id:
-            user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
-            if user_doc:
-                user_data = user_doc
-        
-        if not user_data or not friend_id:
+        claimed_user_id = data.get('user_id') or (user_data or {}).get('id')
+        identity = await resolve_socket_user(sid, claimed_user_id)
+        
+        # Use the session profile (or cached user doc) if user_data is not provided
+        if identity and not user_data:
+            user_data = identity.get('profile') or (
+                await hydrate_users([identity['user_id']])
+            ).get(identity['user_id'])
+        if identity and user_data:
+            user_data = {**user_data, 'id': identity['user_id']}
+        
+        if not identity or not user_data or not friend_id:
             await sio.emit('error', {'message': 'Missing user data or friend ID'}, room=sid)
             return
         
@@ -4162,14 +4924,7 @@ async def join_direct_chat(sid, data):
             return
         
         # Verify friendship exists
-        friendship = await db.friendships.find_one({
-            "$or": [
-                {"user1_id": user_data['id'], "user2_id": friend_id},
-                {"user1_id": friend_id, "user2_id": user_data['id']}
-            ]
-        })
-        
-        if not friendship:
+        if not await are_friends(user_data['id'], friend_id):
             await sio.emit('error', {'message': 'Not friends with this user'}, room=sid)
             return
         
@@ -4180,7 +4935,7 @@ async def join_direct_chat(sid, data):
         }
         
         # Join a room for this conversation (use sorted IDs for consistency)
-        room_name = f"direct_{min(user_data['id'], friend_id)}_{max(user_data['id'], friend_id)}"
+        room_name = f"direct_{conversations.conversation_id(user_data['id'], friend_id)}"
         await sio.enter_room(sid, room_name)
         
         await sio.emit('direct_chat_joined', {
@@ -4211,10 +4966,12 @@ async def send_direct_message(sid, data):
             return
         
         # Create direct message
+        conv_id = conversations.conversation_id(user_data['id'], friend_id)
         direct_message = DirectMessage(
             from_user_id=user_data['id'],
             to_user_id=friend_id,
-            message=message_text
+            message=message_text,
+            conversation_id=conv_id
         )
         
         message_dict = direct_message.dict()
@@ -4222,13 +4979,18 @@ async def send_direct_message(sid, data):
         message_dict['from_user_name'] = user_data['name']
         message_dict['from_user_picture'] = user_data.get('picture')
         
-        # Create a copy for database insertion (will get _id added)
-        db_message_dict = message_dict.copy()
-        await db.direct_messages.insert_one(db_message_dict)
+        # Backpressure: while the DB is failing the outbox only grows so far
+        if dm_outbox.is_full():
+            await sio.emit('error', {'message': 'Messages are delayed right now, please try again shortly'}, room=sid)
+            return
+        
+        # Persisted in the background; the ack follows as direct_message_persisted
+        dm_outbox.enqueue(message_dict.copy())
+        unread_counts.increment(friend_id, user_data['id'])
         
-        # Send to both users in the conversation room (use original dict without _id)
-        room_name = f"direct_{min(user_data['id'], friend_id)}_{max(user_data['id'], friend_id)}"
-        await sio.emit('direct_message_received', message_dict, room=room_name)
+        # Send to both users in the conversation room right away
+        room_name = f"direct_{conv_id}"
+        await sio.emit('direct_message_received', {**message_dict, 'status': 'pending'}, room=room_name)
         
         # Also send a global notification to the recipient if they're online but not in the chat room
         if friend_id in active_users:
@@ -4246,13 +5008,7 @@ async def send_direct_message(sid, data):
                 }, room=recipient_sid)
                 logging.info(f"Sent notification to {friend_id} (not in chat room)")
         
-        # Update passport stats for direct messages
-        try:
-            await update_passport_stats(user_data['id'], {"messages_sent": 1})
-        except Exception as e:
-            logging.error(f"Error updating passport stats for direct message: {e}")
-        
-        logging.info(f"Direct message sent from {user_data['name']} to {friend_id}")
+        log_event("direct_message", "Direct message sent from %s to %s", user_data['name'], friend_id)
         
     except Exception as e:
         logging.error(f"Error in send_direct_message: {e}", exc_info=True)
@@ -4267,7 +5023,7 @@ async def leave_direct_chat(sid):
             friend_id = chat_info['friend_id']
             
             # Leave the room
-            room_name = f"direct_{min(user_data['id'], friend_id)}_{max(user_data['id'], friend_id)}"
+            room_name = f"direct_{conversations.conversation_id(user_data['id'], friend_id)}"
             await sio.leave_room(sid, room_name)
             
             # Remove from tracking
@@ -4297,23 +5053,18 @@ async def delete_chat_history(friend_id: str, request: Request):
         raise HTTPException(status_code=401)
     
     # Verify friendship exists
-    friendship = await db.friendships.find_one({
-        "$or": [
-            {"user1_id": user.id, "user2_id": friend_id},
-            {"user1_id": friend_id, "user2_id": user.id}
-        ]
-    })
-    
-    if not friendship:
+    if not await are_friends(user.id, friend_id):
         raise HTTPException(status_code=403, detail="Not friends with this user")
     
+    # Drop queued messages too (waiting out a batch that is mid-write)
+    async with _dm_flush_lock:
+        dm_outbox.discard(conversations.conversation_id(user.id, friend_id))
     # Delete all direct messages between these two users
     result = await db.direct_messages.delete_many({
-        "$or": [
-            {"from_user_id": user.id, "to_user_id": friend_id},
-            {"from_user_id": friend_id, "to_user_id": user.id}
-        ]
+        "conversation_id": conversations.conversation_id(user.id, friend_id)
     })
+    unread_counts.clear(user.id, friend_id)
+    unread_counts.clear(friend_id, user.id)
     
     return {"message": f"Deleted {result.deleted_count} messages", "deleted_count": result.deleted_count}
 
@@ -4325,33 +5076,31 @@ async def unfriend_user(friend_id: str, request: Request):
         raise HTTPException(status_code=401)
     
     # Check if friendship exists
-    friendship = await db.friendships.find_one({
+    if not await are_friends(user.id, friend_id):
+        raise HTTPException(status_code=404, detail="Friendship not found")
+    
+    # Delete the friendship
+    await db.friendships.delete_many({
         "$or": [
             {"user1_id": user.id, "user2_id": friend_id},
             {"user1_id": friend_id, "user2_id": user.id}
         ]
     })
+    friend_graph.remove_edge(user.id, friend_id)
     
-    if not friendship:
-        raise HTTPException(status_code=404, detail="Friendship not found")
-    
-    # Delete the friendship
-    await db.friendships.delete_one({"id": friendship["id"]})
-    
+    # Drop queued messages too (waiting out a batch that is mid-write)
+    async with _dm_flush_lock:
+        dm_outbox.discard(conversations.conversation_id(user.id, friend_id))
     # Optionally delete chat history as well when unfriending
     await db.direct_messages.delete_many({
-        "$or": [
-            {"from_user_id": user.id, "to_user_id": friend_id},
-            {"from_user_id": friend_id, "to_user_id": user.id}
-        ]
+        "conversation_id": conversations.conversation_id(user.id, friend_id)
     })
+    unread_counts.clear(user.id, friend_id)
+    unread_counts.clear(friend_id, user.id)
     
     # Update passport stats for both users (decrease friend count)
-    try:
-        await update_passport_stats(user.id, {"total_friends": -1})
-        await update_passport_stats(friend_id, {"total_friends": -1})
-    except Exception as e:
-        logging.error(f"Error updating passport stats for unfriend: {e}")
+    stats_aggregator.record(user.id, "total_friends", -1)
+    stats_aggregator.record(friend_id, "total_friends", -1)
     
     # Get friend's name for response
     friend_user = await db.users.find_one({"id": friend_id}, {"_id": 0, "name": 1})
@@ -4448,6 +5197,7 @@ async def block_user(block_data: dict, request: Request):
             {"user1_id": blocked_user_id, "user2_id": user.id}
         ]
     })
+    friend_graph.remove_edge(user.id, blocked_user_id)
     
     # Remove pending friend requests
     await db.friend_requests.delete_many({
@@ -4496,14 +5246,12 @@ async def get_blocked_users(request: Request):
     blocked_user_ids = [block['blocked_user_id'] for block in blocks]
     
     # Get user info for blocked users
-    blocked_users = []
-    for blocked_id in blocked_user_ids:
-        blocked_user = await db.users.find_one(
-            {"id": blocked_id},
-            {"_id": 0, "id": 1, "name": 1, "picture": 1}
-        )
-        if blocked_user:
-            blocked_users.append(blocked_user)
+    blocked_docs = await hydrate_users(blocked_user_ids)
+    blocked_users = [
+        {"id": doc["id"], "name": doc.get("name"), "picture": doc.get("picture")}
+        for doc in (blocked_docs.get(blocked_id) for blocked_id in blocked_user_ids)
+        if doc
+    ]
     
     return blocked_users
 
@@ -4997,10 +5745,7 @@ app.add_middleware(
 )
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+structured_logging.setup_logging(logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Duplicate shutdown handler removed - using the proper one defined earlier
@@ -0,0 +1,67 @@
+"""
+Session Lookup Cache
+====================
+Bounded TTL LRU of session_token -> (user_id, session expiry), so
+``get_current_user`` only reads ``user_sessions`` the first time it sees a
+token (and again every ``SESSION_CACHE_TTL`` seconds). The user's ``User``
+model comes from the profile cache in user_profiles.
+
+Unknown and expired tokens are cached too, for ``NEGATIVE_CACHE_TTL`` seconds,
+so a client hammering the API with bad tokens costs one lookup per token
+rather than one per request.
+
+Entries are dropped on logout (``invalidate``); session expiry is re-checked
+on every hit, so a cached session never outlives its ``expires_at``.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "300"))
+NEGATIVE_CACHE_TTL = float(os.environ.get("SESSION_NEGATIVE_CACHE_TTL", "10"))
+MAX_CACHED_SESSIONS = int(os.environ.get("MAX_CACHED_SESSIONS", "10000"))
+
+# session_token -> (user_id or None for a rejected token, expires_at epoch, cached_at)
+_SESSIONS: "OrderedDict[str, Tuple[Optional[str], float, float]]" = OrderedDict()
+
+# Returned by ``lookup`` for tokens known to be invalid
+INVALID = ""
+
+
+def lookup(token: str) -> Optional[str]:
+    """The session's user_id, ``INVALID`` for a known-bad or expired token, or
+    None if the token isn't cached and must be checked in the database."""
+    entry = _SESSIONS.get(token)
+    if entry is None:
+        return None
+    user_id, expires_at, cached_at = entry
+    now = time.time()
+    ttl = SESSION_CACHE_TTL if user_id else NEGATIVE_CACHE_TTL
+    if now - cached_at > ttl:
+        del _SESSIONS[token]
+        return None
+    if user_id and now >= expires_at:
+        return INVALID
+    _SESSIONS.move_to_end(token)
+    return user_id or INVALID
+
+
+def _put(token: str, entry: Tuple[Optional[str], float, float]) -> None:
+    _SESSIONS[token] = entry
+    _SESSIONS.move_to_end(token)
+    while len(_SESSIONS) > MAX_CACHED_SESSIONS:
+        _SESSIONS.popitem(last=False)
+
+
+def store(token: str, user_id: str, expires_at: float) -> None:
+    _put(token, (user_id, expires_at, time.time()))
+
+
+def store_invalid(token: str) -> None:
+    _put(token, (None, 0.0, time.time()))
+
+
+def invalidate(token: str) -> None:
+    _SESSIONS.pop(token, None)
@@ -0,0 +1,93 @@
+"""
+Signed Session Tokens
+=====================
+Optional stateless session format. When ``SESSION_SIGNING_KEY`` is set,
+``create_session`` issues tokens of the form::
+
+    v1.<base64url(json {"uid", "exp", "sid"})>.<base64url(HMAC-SHA256)>
+
+and ``get_current_user`` verifies them with CPU only - no ``user_sessions``
+read, no shared cache - so any number of workers can authenticate requests
+independently.
+
+The one piece of server state is a small revocation set of session ids,
+fed by logout. Revocations are also written to ``revoked_sessions`` (see
+server.py) so every worker picks them up, and each one is forgotten once
+the token it revokes would have expired anyway.
+
+Without a key, tokens stay opaque and are checked against the database as
+before. Signed tokens are still recorded in ``user_sessions``, so removing
+the key later does not log anyone out.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+SIGNING_KEY = os.environ.get("SESSION_SIGNING_KEY", "").encode()
+TOKEN_PREFIX = "v1."
+
+# session id -> token expiry (epoch seconds)
+_REVOKED: Dict[str, float] = {}
+
+
+def enabled() -> bool:
+    return bool(SIGNING_KEY)
+
+
+def is_signed(token: str) -> bool:
+    return token.startswith(TOKEN_PREFIX)
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(SIGNING_KEY, payload.encode(), hashlib.sha256).digest())
+
+
+def issue(user_id: str, expires_at: float, session_id: Optional[str] = None) -> str:
+    claims = {"uid": user_id, "exp": int(expires_at), "sid": session_id or str(uuid.uuid4())}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{TOKEN_PREFIX}{payload}.{_sign(payload)}"
+
+
+def decode(token: str) -> Optional[Dict[str, Any]]:
+    """Claims of a correctly signed token (expired or not), else None."""
+    if not enabled() or not is_signed(token):
+        return None
+    try:
+        payload, signature = token[len(TOKEN_PREFIX):].split(".")
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or not {"uid", "exp", "sid"} <= claims.keys():
+        return None
+    return claims
+
+
+def verify(token: str) -> Optional[str]:
+    """The user_id of a valid, unexpired, unrevoked token, else None."""
+    claims = decode(token)
+    if claims is None or claims["exp"] <= time.time() or claims["sid"] in _REVOKED:
+        return None
+    return claims["uid"]
+
+
+def revoke(session_id: str, expires_at: float) -> None:
+    _REVOKED[session_id] = expires_at
+    now = time.time()
+    for sid in [s for s, exp in _REVOKED.items() if exp <= now]:
+        del _REVOKED[sid]
@@ -0,0 +1,246 @@
+"""
+Passport Share Cards
+====================
+Server-rendered passport share cards (1200x630, the size link unfurlers
+expect) as PNG or WebP.
+
+Rendering is CPU work, so it runs in a small process pool off the event loop.
+Each card is stored on disk under a SHA-256 of its render inputs (the card
+fields, format and ``RENDER_VERSION``); the same passport shared again, or a
+crawler re-fetching the link, is served from that file without re-rendering.
+Because the hash changes whenever the card would, image URLs carry it and can
+be cached by browsers and CDNs for a year.
+
+Every passport change makes a new file, so ``sweep`` (run hourly from
+server.py) bounds the directory: cards not served for
+``SHARE_CARD_MAX_AGE_DAYS`` are removed, then the least recently served ones
+until it is under ``SHARE_CARD_CACHE_MAX_MB``. Serving a card refreshes its
+mtime, and nothing used in the last few minutes is removed, so a card is
+never deleted under a response that is about to send it.
+
+Pillow is optional: without it ``available()`` is False and the image
+endpoints answer 503, while ``/passport/share`` keeps returning card data.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # pragma: no cover
+    Image = None
+
+SHARE_CARD_DIR = Path(os.environ.get("SHARE_CARD_DIR", Path(__file__).parent / ".share_card_cache"))
+SHARE_CARD_WORKERS = int(os.environ.get("SHARE_CARD_WORKERS", "2"))
+# TTF/OTF used for card text; Pillow's built-in font if unset
+SHARE_CARD_FONT = os.environ.get("SHARE_CARD_FONT", "")
+SHARE_CARD_CACHE_MAX_MB = float(os.environ.get("SHARE_CARD_CACHE_MAX_MB", "512"))
+SHARE_CARD_MAX_AGE_DAYS = float(os.environ.get("SHARE_CARD_MAX_AGE_DAYS", "30"))
+SWEEP_INTERVAL = 3600  # seconds
+_SWEEP_GRACE = 600  # cards served this recently are never removed
+
+FORMATS = {"png": "image/png", "webp": "image/webp"}
+RENDER_VERSION = 1
+WIDTH, HEIGHT = 1200, 630
+
+# Card fields that end up in the image (generated_at etc. don't)
+RENDER_FIELDS = (
+    "user_name", "top_anime", "anime_vibe", "fate_number", "passport_level",
+    "passport_level_name", "badges_count", "favorite_character",
+)
+
+# anime_vibe -> (gradient top, gradient bottom)
+VIBE_COLORS = {
+    "Sad / Emotional": ((59, 130, 246), (79, 70, 229)),
+    "Dark / Psychological": ((147, 51, 234), (31, 41, 55)),
+    "Wholesome": ((244, 114, 182), (251, 191, 36)),
+    "High Energy": ((239, 68, 68), (249, 115, 22)),
+    "Chaotic Gremlin": ((34, 197, 94), (236, 72, 153)),
+    "Quiet Protagonist": ((100, 116, 139), (30, 41, 59)),
+}
+DEFAULT_COLORS = ((99, 102, 241), (168, 85, 247))
+
+_pool: Optional[ProcessPoolExecutor] = None
+# card key -> render in progress, so concurrent requests share one render
+_RENDERING: Dict[str, "asyncio.Future[Path]"] = {}
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def render_inputs(card: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: card.get(field) for field in RENDER_FIELDS}
+
+
+def card_key(card: Dict[str, Any], fmt: str) -> str:
+    payload = json.dumps(
+        {"v": RENDER_VERSION, "format": fmt, "card": render_inputs(card)},
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def path_for(key: str, fmt: str) -> Path:
+    return SHARE_CARD_DIR / key[:2] / f"{key}.{fmt}"
+
+
+def _font(size: int):
+    if SHARE_CARD_FONT:
+        try:
+            return ImageFont.truetype(SHARE_CARD_FONT, size)
+        except OSError:
+            pass
+    return ImageFont.load_default(size=size)
+
+
+def _fit(draw, text: str, font, max_width: int) -> str:
+    if draw.textlength(text, font=font) <= max_width:
+        return text
+    while text and draw.textlength(text + "…", font=font) > max_width:
+        text = text[:-1]
+    return text + "…"
+
+
+def render_card(card: Dict[str, Any], fmt: str) -> bytes:
+    """Draw a share card; runs in a worker process."""
+    import io
+
+    top, bottom = VIBE_COLORS.get(card.get("anime_vibe"), DEFAULT_COLORS)
+    image = Image.new("RGB", (WIDTH, HEIGHT))
+    draw = ImageDraw.Draw(image)
+    for y in range(HEIGHT):
+        t = y / (HEIGHT - 1)
+        draw.line([(0, y), (WIDTH, y)], fill=tuple(round(a + (b - a) * t) for a, b in zip(top, bottom)))
+
+    white, soft = (255, 255, 255), (230, 230, 240)
+    # Translucent shapes go on their own layer so they blend with the gradient
+    overlay = Image.new("RGBA", (WIDTH, HEIGHT), (0, 0, 0, 0))
+    shapes = ImageDraw.Draw(overlay)
+    shapes.rounded_rectangle((40, 40, WIDTH - 40, HEIGHT - 40), radius=36, fill=(0, 0, 0, 70))
+    shapes.ellipse((80, 80, 200, 200), fill=(255, 255, 255, 60), outline=white, width=4)
+    image = Image.alpha_composite(image.convert("RGBA"), overlay).convert("RGB")
+    draw = ImageDraw.Draw(image)
+
+    name = card.get("user_name") or "Anime Fan"
+    initial = name.strip()[:1].upper() or "?"
+    draw.text((140, 140), initial, font=_font(64), fill=white, anchor="mm")
+
+    draw.text((230, 92), "ANIME PASSPORT", font=_font(26), fill=soft)
+    draw.text((230, 128), _fit(draw, name, _font(56), 560), font=_font(56), fill=white)
+    level = f"Lv. {card.get('passport_level', 1)} · {card.get('passport_level_name') or 'Rookie Fan'}"
+    draw.text((80, 240), level, font=_font(34), fill=white)
+    draw.text((80, 290), f"Vibe: {card.get('anime_vibe') or 'Wholesome'}", font=_font(30), fill=soft)
+    draw.text((80, 334), f"Badges: {card.get('badges_count', 0)}", font=_font(30), fill=soft)
+
+    character = card.get("favorite_character") or {}
+    if character.get("name"):
+        fav = f"Favorite: {character['name']}"
+        if character.get("anime"):
+            fav += f" ({character['anime']})"
+        draw.text((80, 378), _fit(draw, fav, _font(28), 600), font=_font(28), fill=soft)
+
+    top_anime = [a.get("title") for a in card.get("top_anime") or [] if isinstance(a, dict) and a.get("title")]
+    if top_anime:
+        draw.text((80, 440), "Top Anime", font=_font(28), fill=white)
+        for i, title in enumerate(top_anime[:3]):
+            draw.text((80, 480 + i * 34), _fit(draw, f"{i + 1}. {title}", _font(26), 620), font=_font(26), fill=soft)
+
+    draw.text((WIDTH - 110, 120), "FATE NUMBER", font=_font(26), fill=soft, anchor="rm")
+    draw.text((WIDTH - 110, 240), f"#{card.get('fate_number', 0)}", font=_font(120), fill=white, anchor="rm")
+    draw.text((WIDTH - 110, HEIGHT - 90), "otakucafe.fun", font=_font(30), fill=soft, anchor="rm")
+
+    out = io.BytesIO()
+    if fmt == "webp":
+        image.save(out, "WEBP", quality=90, method=4)
+    else:
+        image.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def _write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+async def get_card(card: Dict[str, Any], fmt: str) -> Path:
+    """Path of the rendered card, rendering it first if it isn't on disk."""
+    global _pool
+    key = card_key(card, fmt)
+    path = path_for(key, fmt)
+    if path.exists():
+        try:
+            # Recently served cards are the last to be swept
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+    pending = _RENDERING.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    loop = asyncio.get_running_loop()
+    future = _RENDERING[key] = loop.create_future()
+    try:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=SHARE_CARD_WORKERS)
+        data = await loop.run_in_executor(_pool, render_card, render_inputs(card), fmt)
+        await asyncio.to_thread(_write, path, data)
+        future.set_result(path)
+        return path
+    except Exception as e:
+        future.set_exception(e)
+        # Nobody else may be waiting; don't leave "exception never retrieved"
+        future.exception()
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        _RENDERING.pop(key, None)
+
+
+def sweep() -> int:
+    """Remove expired and least recently served cards (and temp files left by
+    interrupted writes) until the cache fits its size cap; returns how many
+    files were removed. Blocking - run it in a thread."""
+    now = time.time()
+    max_age = SHARE_CARD_MAX_AGE_DAYS * 86400
+    max_bytes = SHARE_CARD_CACHE_MAX_MB * 1024 * 1024
+    files = []
+    for path in SHARE_CARD_DIR.glob("*/*"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        age = now - mtime
+        if age < _SWEEP_GRACE:
+            break
+        if path.suffix != ".tmp" and age < max_age and total <= max_bytes:
+            continue
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
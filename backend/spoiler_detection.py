@@ -0,0 +1,133 @@
+"""
+Spoiler Detection
+=================
+Multi-pattern spoiler detector built from a base lexicon plus per-anime terms.
+
+All terms for a given anime are folded into a single compiled regex shaped
+like a trie (shared prefixes are factored out), so a scan costs
+O(message length x longest term) no matter how many terms are loaded - adding
+a hundred character names does not make detection slower.
+
+Terms match at the start of a word, so "dies" flags "he dies" but not
+"studies", while inflections such as "spoilers" or "deaths" still match.
+
+Per-anime terms are the full names of the anime's characters from the Jikan
+catalog plus any curated ``spoiler_terms`` on its ``anime_data`` document (see
+``build_terms``). Names are never split: "Light" or "Monkey" alone are
+ordinary words in a room about that show, not spoilers.
+
+Per-anime detectors are built in the background by the caller (until then the
+base lexicon applies) and cached here with a bounded LRU + TTL so catalog
+edits are eventually picked up.
+"""
+
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Set, Tuple
+
+BASE_LEXICON = (
+    "dies", "killed", "death", "ending", "finale", "spoiler",
+    "revealed", "twist", "betrays", "betrayed",
+)
+
+# Shorter terms (e.g. the character "L") would flag far too many messages.
+_MIN_TERM_LENGTH = 3
+
+_MAX_CACHED = 256
+_CACHE_TTL = 3600  # seconds
+
+# anime_id -> (compiled pattern, built_at)
+_DETECTORS: "OrderedDict[str, Tuple[Pattern[str], float]]" = OrderedDict()
+# anime ids whose detector is being built
+_BUILDING: Set[str] = set()
+
+
+def _trie_regex(terms: Iterable[str]) -> str:
+    trie: Dict[str, Any] = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def walk(node: Dict[str, Any]) -> str:
+        is_end = "" in node
+        branches = [re.escape(ch) + walk(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not is_end:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if is_end else group
+
+    return walk(trie)
+
+
+def compile_lexicon(terms: Iterable[str]) -> Pattern[str]:
+    """Compile ``terms`` (plus the base lexicon) into one word-start regex."""
+    cleaned = {t.strip().lower() for t in terms if t and len(t.strip()) >= _MIN_TERM_LENGTH}
+    cleaned.update(BASE_LEXICON)
+    return re.compile(r"\b" + _trie_regex(cleaned), re.IGNORECASE)
+
+
+_BASE_PATTERN = compile_lexicon(())
+
+
+def build_terms(character_names: Iterable[str], spoiler_terms: Iterable[str] = ()) -> List[str]:
+    """Anime-specific spoiler terms: each character's full name, in both the
+    catalog's "Yagami, Light" order and as "Light Yagami", plus curated
+    ``spoiler_terms``. Name parts are deliberately not added on their own."""
+    terms = []
+    for name in character_names:
+        if not name:
+            continue
+        if "," in name:
+            last, _, first = name.partition(",")
+            last, first = " ".join(last.split()), " ".join(first.split())
+            terms.extend(n for n in (f"{first} {last}".strip(), f"{last} {first}".strip()) if n)
+        else:
+            terms.append(" ".join(name.split()))
+    terms.extend(t for t in spoiler_terms if t)
+    return terms
+
+
+def get_detector(anime_id: str) -> Optional[Pattern[str]]:
+    """Cached detector for an anime, or None if it must be (re)built."""
+    entry = _DETECTORS.get(anime_id)
+    if entry is None:
+        return None
+    pattern, built_at = entry
+    if time.time() - built_at > _CACHE_TTL:
+        _DETECTORS.pop(anime_id, None)
+        return None
+    _DETECTORS.move_to_end(anime_id)
+    return pattern
+
+
+def start_build(anime_id: str) -> bool:
+    """Claim building ``anime_id``'s detector; False if already underway."""
+    if anime_id in _BUILDING:
+        return False
+    _BUILDING.add(anime_id)
+    return True
+
+
+def register(anime_id: str, terms: Iterable[str]) -> Pattern[str]:
+    pattern = compile_lexicon(terms)
+    _DETECTORS[anime_id] = (pattern, time.time())
+    _DETECTORS.move_to_end(anime_id)
+    _BUILDING.discard(anime_id)
+    while len(_DETECTORS) > _MAX_CACHED:
+        _DETECTORS.popitem(last=False)
+    return pattern
+
+
+def invalidate(anime_id: str) -> None:
+    _DETECTORS.pop(anime_id, None)
+
+
+def is_spoiler(text: str, pattern: Optional[Pattern[str]] = None) -> bool:
+    if not text:
+        return False
+    return (pattern or _BASE_PATTERN).search(text) is not None
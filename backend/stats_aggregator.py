@@ -0,0 +1,71 @@
+"""
+Stats Aggregator
+================
+Write-behind counters for passport and arc stats.
+
+Every call site that bumps a stat (chat, episode-room and direct messages,
+matches, room joins, friendships) calls ``record(user_id, stat, delta)``,
+which only adds to an in-memory map. ``persist_stats`` in server.py drains the
+map every ``STATS_FLUSH_INTERVAL`` seconds as one ``bulk_write`` of ``$inc``
+upserts per collection, then runs badge and arc checks once per user for the
+whole batch rather than once per event.
+
+Operations that fail are merged back and retried on the next flush.
+``overlay`` adds still-pending deltas to a stats document read from MongoDB so
+a user's own pages don't lag behind the flush.
+"""
+
+import os
+from typing import Dict, Iterable
+
+STATS_FLUSH_INTERVAL = float(os.environ.get("STATS_FLUSH_INTERVAL", "5"))
+
+PASSPORT = "passport_stats"
+ARC = "user_arcs"
+
+# collection -> user_id -> stat -> delta
+_PENDING: Dict[str, Dict[str, Dict[str, int]]] = {PASSPORT: {}, ARC: {}}
+
+
+def record(user_id: str, stat: str, delta: int = 1, collection: str = PASSPORT) -> None:
+    deltas = _PENDING[collection].setdefault(user_id, {})
+    deltas[stat] = deltas.get(stat, 0) + delta
+
+
+def has_pending() -> bool:
+    return any(_PENDING.values())
+
+
+def take_batch() -> Dict[str, Dict[str, Dict[str, int]]]:
+    batch = {collection: users for collection, users in _PENDING.items()}
+    for collection in _PENDING:
+        _PENDING[collection] = {}
+    return batch
+
+
+def requeue(collection: str, user_ids: Iterable[str], batch: Dict[str, Dict[str, int]]) -> None:
+    """Merge the deltas of ``user_ids`` from a failed write back in."""
+    for user_id in user_ids:
+        for stat, delta in batch[user_id].items():
+            record(user_id, stat, delta, collection)
+
+
+def pending(user_id: str, collection: str = PASSPORT) -> Dict[str, int]:
+    """This user's unflushed deltas (a copy)."""
+    return dict(_PENDING[collection].get(user_id) or {})
+
+
+def overlay(user_id: str, stats: Dict, collection: str = PASSPORT) -> Dict:
+    """A copy of ``stats`` with this user's unflushed deltas added."""
+    pending = _PENDING[collection].get(user_id)
+    if not pending:
+        return stats
+    stats = dict(stats)
+    for stat, delta in pending.items():
+        stats[stat] = stats.get(stat, 0) + delta
+    return stats
+
+
+def forget_user(user_id: str) -> None:
+    for users in _PENDING.values():
+        users.pop(user_id, None)
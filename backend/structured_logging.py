@@ -0,0 +1,146 @@
+"""
+Structured Logging
+==================
+Logging setup that keeps log work off the event loop.
+
+  * Records go through a ``QueueHandler`` to a ``QueueListener`` thread, which
+    does the formatting and the actual write - the event loop only pays for
+    creating a record and putting it on a queue. Records whose args are
+    immutable (strings, numbers, ...) are queued with message and args
+    unmerged, so %-style messages are formatted on the listener thread; a
+    record with a mutable arg (a dict, a list, an object) is formatted before
+    it is queued, so it logs the value as of the call.
+  * ``log_event`` is for hot paths (per chat message, per queue broadcast,
+    per ``/auth/me``): it checks the level first, then samples per event
+    type, and only then builds a record. A dropped call costs a dict lookup.
+  * Every record can carry an ``event`` name; ``LOG_FORMAT=json`` emits one
+    JSON object per line for log aggregation, otherwise the familiar text
+    format is kept.
+
+Sample rates come from ``DEFAULT_SAMPLE_RATES`` overridden by
+``LOG_SAMPLE_RATES``, e.g. ``"chat_message=0.01,queue_update=0.1"`` keeps 1 in
+100 chat-message logs and 1 in 10 queue updates (``=1`` keeps everything).
+Events without a rate are always kept.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from typing import Dict, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+DEFAULT_SAMPLE_RATES = (
+    "chat_message=0.01,room_message=0.01,direct_message=0.01,"
+    "queue_update=0.02,matching=0.1,presence=0.1,auth_me=0.05"
+)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_logger = logging.getLogger("otakucafe")
+
+# event -> keep one record out of every N
+_SAMPLE_EVERY: Dict[str, int] = {}
+_seen: Dict[str, int] = {}
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """The stock ``prepare`` formats every message on the calling thread,
+    which is exactly the work we want off the loop. Here only records with
+    mutable args are formatted up front - they could change before the
+    listener gets to them."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and not (
+            isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args)
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def _parse_sample_rates(spec: str) -> Dict[str, int]:
+    rates = {}
+    for part in spec.split(","):
+        name, _, rate = part.partition("=")
+        try:
+            value = float(rate)
+        except ValueError:
+            continue
+        if name.strip() and 0 < value <= 1:
+            rates[name.strip()] = max(1, round(1 / value))
+    return rates
+
+
+def setup_logging(level: int = logging.INFO) -> None:
+    """Route the root logger through a background queue listener."""
+    global _listener
+    if _listener is not None:
+        return
+    level = getattr(logging, os.environ.get("LOG_LEVEL", "").upper(), level)
+    formatter = (
+        _JsonFormatter() if os.environ.get("LOG_FORMAT", "").lower() == "json"
+        else logging.Formatter(TEXT_FORMAT)
+    )
+    output = logging.StreamHandler()
+    output.setFormatter(formatter)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_LazyQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _SAMPLE_EVERY.update(_parse_sample_rates(DEFAULT_SAMPLE_RATES))
+    _SAMPLE_EVERY.update(_parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "")))
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def set_sample_rate(event: str, rate: float) -> None:
+    _SAMPLE_EVERY[event] = max(1, round(1 / rate)) if 0 < rate < 1 else 1
+
+
+def log_event(event: str, msg: str, *args, level: int = logging.INFO) -> None:
+    """Level-gated, sampled log call for hot paths. Pass values as ``args``
+    (``"%s joined"``) rather than an f-string so nothing is formatted for
+    records that are dropped."""
+    if not _logger.isEnabledFor(level):
+        return
+    every = _SAMPLE_EVERY.get(event, 1)
+    if every > 1:
+        count = _seen.get(event, 0)
+        _seen[event] = count + 1
+        if count % every:
+            return
+    _logger.log(level, msg, *args, extra={"event": event})
@@ -0,0 +1,134 @@
+"""
+Trending Episode Rooms
+======================
+Incrementally maintained in-memory leaderboard of live episode rooms.
+
+Every room carries a denormalized copy of its room document and anime info,
+so serving ``/episode-rooms/trending`` never touches MongoDB. Scores are kept
+up to date by the socket handlers (joins, leaves, messages) and combine:
+
+  * how many people are in the room right now, and
+  * recent message velocity - an exponentially decaying message counter, so
+    a burst of chat lifts a room quickly and fades once it quiets down.
+
+Ranking is recomputed at most once per ``_SNAPSHOT_TTL`` seconds (and only
+when something changed); in between, reads are an O(k) slice of the cached
+snapshot.
+"""
+
+import heapq
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# Weight of one "message per half-life" relative to one active user.
+VELOCITY_WEIGHT = 2.0
+# Message velocity halves every 5 minutes of silence.
+_VELOCITY_HALF_LIFE = 300.0
+_DECAY = math.log(2) / _VELOCITY_HALF_LIFE
+
+# How long a computed ranking is served before it is rebuilt.
+_SNAPSHOT_TTL = 5.0
+SNAPSHOT_SIZE = 50
+
+# room_id -> {"room": dict, "anime_info": dict, "velocity": float, "velocity_ts": float}
+_ROOMS: Dict[str, Dict[str, Any]] = {}
+_loaded = False
+
+_snapshot: List[Dict[str, Any]] = []
+_snapshot_ts = 0.0
+_dirty = True
+
+
+def is_loaded() -> bool:
+    return _loaded
+
+
+def mark_loaded() -> None:
+    global _loaded
+    _loaded = True
+
+
+def has_room(room_id: str) -> bool:
+    return room_id in _ROOMS
+
+
+def _invalidate() -> None:
+    global _dirty
+    _dirty = True
+
+
+def _velocity(entry: Dict[str, Any], now: float) -> float:
+    return entry["velocity"] * math.exp(-_DECAY * (now - entry["velocity_ts"]))
+
+
+def upsert_room(room: Dict[str, Any], anime_info: Optional[Dict[str, Any]]) -> None:
+    """Start tracking a room, or refresh its document / anime info."""
+    room = {k: v for k, v in room.items() if k != "_id"}
+    entry = _ROOMS.get(room["id"])
+    if entry is None:
+        _ROOMS[room["id"]] = {
+            "room": room,
+            "anime_info": anime_info,
+            "velocity": 0.0,
+            "velocity_ts": time.time(),
+        }
+    else:
+        entry["room"].update(room)
+        if anime_info is not None:
+            entry["anime_info"] = anime_info
+    _invalidate()
+
+
+def set_active_users(room_id: str, count: int) -> None:
+    entry = _ROOMS.get(room_id)
+    if entry is None:
+        return
+    entry["room"]["active_users_count"] = count
+    _invalidate()
+
+
+def record_message(room_id: str) -> None:
+    entry = _ROOMS.get(room_id)
+    if entry is None:
+        return
+    now = time.time()
+    entry["velocity"] = _velocity(entry, now) + 1.0
+    entry["velocity_ts"] = now
+    entry["room"]["total_messages"] = entry["room"].get("total_messages", 0) + 1
+    _invalidate()
+
+
+def remove_room(room_id: str) -> None:
+    if _ROOMS.pop(room_id, None) is not None:
+        _invalidate()
+
+
+def score(entry: Dict[str, Any], now: float) -> float:
+    users = entry["room"].get("active_users_count", 0) or 0
+    return users + VELOCITY_WEIGHT * _velocity(entry, now)
+
+
+def _rebuild(now: float) -> None:
+    global _snapshot, _snapshot_ts, _dirty
+    now_iso = datetime.now(timezone.utc).isoformat()
+    live = [
+        e for e in _ROOMS.values()
+        if e["anime_info"] is not None and e["room"].get("expires_at", "") > now_iso
+    ]
+    ranked = heapq.nlargest(SNAPSHOT_SIZE, live, key=lambda e: score(e, now))
+    _snapshot = [{**e["room"], "anime_info": e["anime_info"]} for e in ranked]
+    _snapshot_ts = now
+    _dirty = False
+
+
+def top(limit: int = 20) -> List[Dict[str, Any]]:
+    """The ``limit`` hottest non-expired rooms, each with ``anime_info``."""
+    now = time.time()
+    # Velocity decays continuously, so even an unchanged leaderboard is
+    # re-ranked once the snapshot goes stale.
+    age = now - _snapshot_ts
+    if (_dirty and age >= _SNAPSHOT_TTL) or age >= _SNAPSHOT_TTL * 6:
+        _rebuild(now)
+    return [dict(r) for r in _snapshot[:limit]]
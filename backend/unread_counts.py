@@ -0,0 +1,119 @@
+"""
+Unread Direct Message Counters
+==============================
+In-memory map of recipient -> sender -> unread message count.
+
+A user's counters are loaded once from MongoDB (a single aggregation grouped
+by sender, served by the ``(to_user_id, read, from_user_id)`` index, plus any
+messages still in the DM outbox) and then
+kept current by the socket handlers: ``send_direct_message`` increments,
+``mark_messages_read`` clears. Polling ``/unread-counts`` is then a dict copy.
+
+Like the room message buffer, a user's counters are only trusted once loaded -
+increments for users that aren't loaded are ignored, and their next read falls
+back to the aggregation. Memory stays bounded with an LRU over users.
+
+As in the friend graph, every change bumps a per-user version (bounded LRU
+plus a global epoch), and ``load`` only caches its result if the version
+taken before the aggregation still matches - so an increment or clear that
+landed while the aggregation was running is not lost.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MAX_TRACKED_USERS = int(os.environ.get("UNREAD_COUNTS_MAX_USERS", "10000"))
+
+# to_user_id -> {from_user_id: unread count}; only senders with unread > 0
+_COUNTS: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+_VERSIONS: "OrderedDict[str, int]" = OrderedDict()
+_epoch = 0
+
+
+def aggregation_pipeline(user_id: str, exclude_ids: Iterable[str] = ()) -> List[Dict[str, Any]]:
+    """``exclude_ids``: messages counted from the outbox instead."""
+    match: Dict[str, Any] = {"to_user_id": user_id, "read": False}
+    exclude_ids = list(exclude_ids)
+    if exclude_ids:
+        match["id"] = {"$nin": exclude_ids}
+    return [
+        {"$match": match},
+        {"$group": {"_id": "$from_user_id", "count": {"$sum": 1}}},
+    ]
+
+
+def _touch(user_id: str) -> None:
+    _COUNTS.move_to_end(user_id)
+    while len(_COUNTS) > MAX_TRACKED_USERS:
+        _COUNTS.popitem(last=False)
+
+
+def get(user_id: str) -> Optional[Dict[str, int]]:
+    """Unread counts by sender, or None if this user isn't loaded yet."""
+    counts = _COUNTS.get(user_id)
+    if counts is None:
+        return None
+    _touch(user_id)
+    return dict(counts)
+
+
+def version(user_id: str) -> Tuple[int, int]:
+    """Take before snapshotting the outbox and aggregating; pass to ``load``."""
+    return (_epoch, _VERSIONS.get(user_id, 0))
+
+
+def _changed(user_id: str) -> None:
+    global _epoch
+    _VERSIONS[user_id] = _VERSIONS.get(user_id, 0) + 1
+    _VERSIONS.move_to_end(user_id)
+    while len(_VERSIONS) > MAX_TRACKED_USERS:
+        _VERSIONS.popitem(last=False)
+        _epoch += 1
+
+
+def load(user_id: str, rows: List[Dict[str, Any]], pending: Iterable[Dict[str, Any]],
+         loaded_version: Tuple[int, int]) -> Dict[str, int]:
+    """Store the result of ``aggregation_pipeline`` for a user, plus the
+    unread outbox messages it excluded."""
+    counts = {row["_id"]: row["count"] for row in rows if row["count"]}
+    for message in pending:
+        counts[message["from_user_id"]] = counts.get(message["from_user_id"], 0) + 1
+    if version(user_id) != loaded_version:
+        # Counters changed mid-aggregation; answer, but let the next read reload.
+        return counts
+    _COUNTS[user_id] = counts
+    _touch(user_id)
+    return dict(counts)
+
+
+def increment(to_user_id: str, from_user_id: str, amount: int = 1) -> None:
+    _changed(to_user_id)
+    counts = _COUNTS.get(to_user_id)
+    if counts is None:
+        return
+    counts[from_user_id] = counts.get(from_user_id, 0) + amount
+
+
+def clear(to_user_id: str, from_user_id: str) -> None:
+    _changed(to_user_id)
+    counts = _COUNTS.get(to_user_id)
+    if counts is not None:
+        counts.pop(from_user_id, None)
+
+
+def drop(user_id: str) -> None:
+    _changed(user_id)
+    _COUNTS.pop(user_id, None)
+
+
+def forget_user(user_id: str) -> None:
+    """Discard everything known about a user id (e.g. after its messages were
+    re-pointed to another account): their own counters and their entries as a
+    sender. Affected users reload on their next request."""
+    global _epoch
+    # Any recipient may have a load in flight that still counts this sender
+    _epoch += 1
+    _COUNTS.pop(user_id, None)
+    for recipient in [r for r, counts in _COUNTS.items() if user_id in counts]:
+        del _COUNTS[recipient]
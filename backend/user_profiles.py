@@ -0,0 +1,77 @@
+"""
+User Profile Cache
+==================
+Short-lived LRU cache of user documents used to hydrate lists of user ids
+(friends, friend requests, blocked users, ...), plus the ready-built ``User``
+models that ``get_current_user`` hands out on every authenticated request.
+
+``hydrate_users`` in server.py serves whatever it can from here and fetches the
+rest with a single ``$in`` query, so a 200-friend list costs at most one round
+trip instead of 200. Entries expire after ``PROFILE_CACHE_TTL`` seconds and are
+invalidated explicitly whenever a user document is written (profile edits,
+premium changes, account migration).
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", "60"))
+MAX_CACHED_PROFILES = int(os.environ.get("MAX_CACHED_PROFILES", "5000"))
+
+# user_id -> (user document, cached_at)
+_PROFILES: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+# user_id -> (User model, cached_at); shared instances, never mutated
+_MODELS: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+
+
+def lookup(user_ids: Iterable[str]) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """Split ``user_ids`` into cached documents and ids that must be fetched."""
+    now = time.time()
+    found: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    for user_id in user_ids:
+        if user_id in found:
+            continue
+        entry = _PROFILES.get(user_id)
+        if entry is not None and now - entry[1] <= PROFILE_CACHE_TTL:
+            _PROFILES.move_to_end(user_id)
+            found[user_id] = entry[0]
+        else:
+            _PROFILES.pop(user_id, None)
+            if user_id not in missing:
+                missing.append(user_id)
+    return found, missing
+
+
+def store(docs: Iterable[Dict[str, Any]]) -> None:
+    now = time.time()
+    for doc in docs:
+        _PROFILES[doc["id"]] = (doc, now)
+        _PROFILES.move_to_end(doc["id"])
+    while len(_PROFILES) > MAX_CACHED_PROFILES:
+        _PROFILES.popitem(last=False)
+
+
+def get_model(user_id: str) -> Optional[Any]:
+    entry = _MODELS.get(user_id)
+    if entry is None:
+        return None
+    if time.time() - entry[1] > PROFILE_CACHE_TTL:
+        del _MODELS[user_id]
+        return None
+    _MODELS.move_to_end(user_id)
+    return entry[0]
+
+
+def store_model(user_id: str, model: Any) -> None:
+    _MODELS[user_id] = (model, time.time())
+    _MODELS.move_to_end(user_id)
+    while len(_MODELS) > MAX_CACHED_PROFILES:
+        _MODELS.popitem(last=False)
+
+
+def invalidate(user_id: str) -> None:
+    _PROFILES.pop(user_id, None)
+    _MODELS.pop(user_id, None)
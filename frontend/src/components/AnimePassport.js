@@ -531,7 +531,12 @@ Join me on otakucafe.fun! 🌟`;
                     <Copy className="h-4 w-4 mr-2" />
                     Copy Text
                   </Button>
-                  <Button variant="outline" className="border-gray-600 hover:bg-gray-800">
+                  <Button
+                    variant="outline"
+                    className="border-gray-600 hover:bg-gray-800"
+                    disabled={!shareCard.image_url}
+                    onClick={() => window.open(shareCard.image_url, '_blank', 'noopener')}
+                  >
                     <Download className="h-4 w-4" />
                   </Button>
                 </div>
@@ -48,7 +48,9 @@ export default function MainLayout({ user, setUser, children }) {
     const newSocket = io(BACKEND_URL, {
       path: '/api/socket.io',
       withCredentials: true,
-      transports: ['websocket', 'polling']
+      transports: ['websocket', 'polling'],
+      // Session token for when the cookie is blocked cross-site
+      auth: { token: localStorage.getItem('session_token') }
     });
 
     newSocket.on('connect', () => {
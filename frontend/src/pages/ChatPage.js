@@ -158,7 +158,9 @@ export default function ChatPage({ user, setUser, openSettings, openMenu, notifi
       reconnectionAttempts: 10,
       timeout: 10000,
       autoConnect: true,
-      withCredentials: true
+      withCredentials: true,
+      // Session token for when the cookie is blocked cross-site
+      auth: { token: localStorage.getItem('session_token') }
     });
 
     // Set socket immediately so it's available when connected
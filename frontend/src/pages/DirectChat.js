@@ -187,7 +187,9 @@ export default function DirectChat({ user }) {
       path: '/api/socket.io',
       withCredentials: true,
       transports: ['websocket', 'polling'],
-      forceNew: true // Force new connection to prevent reuse
+      forceNew: true, // Force new connection to prevent reuse
+      // Session token for when the cookie is blocked cross-site
+      auth: { token: localStorage.getItem('session_token') }
     });
 
     newSocket.on('connect', () => {
@@ -246,6 +248,13 @@ export default function DirectChat({ user }) {
       });
     });
 
+    // Messages arrive before they are saved; the server confirms once stored
+    newSocket.on('direct_message_persisted', (data) => {
+      setMessages(prev => prev.map(msg => (
+        msg.id === data.id ? { ...msg, status: data.status } : msg
+      )));
+    });
+
     newSocket.on('disconnect', () => {
       console.log('Disconnected from direct chat socket');
     });
@@ -567,6 +576,9 @@ export default function DirectChat({ user }) {
                       <span className="text-xs text-gray-400 hidden sm:inline">
                         {timestamp}
                       </span>
+                      {isFromUser && message.status === 'pending' && (
+                        <span className="text-xs text-gray-500">Sending…</span>
+                      )}
                     </div>
                     
                     {/* Message Text */}
@@ -23,7 +23,9 @@ const EpisodeRoom = () => {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [slowModeNotice, setSlowModeNotice] = useState(null);
   const messagesEndRef = useRef(null);
+  const lastSentRef = useRef('');
 
   useEffect(() => {
     fetchUserAndRoom();
@@ -97,7 +99,9 @@ const EpisodeRoom = () => {
   const initializeSocket = (userData, roomData) => {
     const newSocket = io(process.env.REACT_APP_API_URL, {
       path: '/api/socket.io',
-      transports: ['websocket', 'polling']
+      transports: ['websocket', 'polling'],
+      // Session token for when the cookie is blocked cross-site
+      auth: { token: localStorage.getItem('session_token') }
     });
 
     newSocket.on('connect', () => {
@@ -119,6 +123,23 @@ const EpisodeRoom = () => {
       setMessages(prev => [...prev, message]);
     });
 
+    // Large rooms deliver messages in batched frames
+    newSocket.on('episode_room_messages', (data) => {
+      setMessages(prev => [...prev, ...data.messages]);
+    });
+
+    // Large rooms send periodic member counts instead of join/leave events
+    newSocket.on('episode_room_count', (data) => {
+      setActiveUsers(data.active_users);
+    });
+
+    // Message rejected by slow mode: put the text back so it isn't lost
+    newSocket.on('slow_mode', (data) => {
+      setMessageInput(prev => prev || lastSentRef.current);
+      setSlowModeNotice(data.message);
+      setTimeout(() => setSlowModeNotice(null), Math.ceil(data.retry_after) * 1000);
+    });
+
     newSocket.on('episode_room_user_joined', (data) => {
       setActiveUsers(data.active_users);
     });
@@ -154,6 +175,7 @@ const EpisodeRoom = () => {
 
     socket.emit('send_episode_room_message', messageData);
 
+    lastSentRef.current = messageInput;
     setMessageInput('');
     setSpoilerEpisodeNumber('');
     setShowSpoilerTag(false);
@@ -418,6 +440,12 @@ const EpisodeRoom = () => {
                   <Send size={20} />
                 </Button>
               </div>
+              {slowModeNotice && (
+                <p className="text-xs text-yellow-400 mt-2 flex items-center gap-1">
+                  <Clock size={12} />
+                  {slowModeNotice}
+                </p>
+              )}
               <p className="text-xs text-gray-400 mt-2">
                 {canSeeSpoilers ? (
                   <span className="flex items-center gap-1">